@@ -0,0 +1,122 @@
+"""
+Measures the _bulk NDJSON exporter (export_bulk_ndjson) and the concurrent sender against a
+local HTTP stand-in for Elasticsearch, which accepts gzip _bulk bodies, counts their documents
+and can reject a share of the requests with 429 to exercise the retry path.
+No Postgres or Elasticsearch is needed.
+
+Run from the scripts directory (where the Spark and config packages live):
+    python -m benchmarks.bench_bulk_export --rows 1000000 --master local[*]
+"""
+import argparse
+import gzip
+import json
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pyspark.sql import SparkSession
+from Spark import Spark4DataProc
+from Spark.BulkExport import BulkSender
+
+from benchmarks.bench_write_table import synthetic_p7_frame
+
+
+class BulkStandIn(ThreadingHTTPServer):
+    """Minimal _bulk endpoint: counts the documents and document ids it received."""
+
+    def __init__(self, reject_rate, latency, seed):
+        super().__init__(("127.0.0.1", 0), BulkHandler)
+        self.reject_rate = reject_rate
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rejected = 0
+        self.document_ids = set()
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class BulkHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests += 1
+            reject = self.server.random.random() < self.server.reject_rate
+            self.server.rejected += reject
+        if reject:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        lines = body.decode("utf-8").splitlines()
+        ids = [json.loads(action)["index"].get("_id") for action in lines[::2]]
+        with self.server.lock:
+            self.server.document_ids.update(ids)
+        payload = json.dumps({"errors": False}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--partitions", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--reject-rate", type=float, default=0.05)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds the stand-in spends per request")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--master", default="local[*]")
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.appName("bench_bulk_export").master(args.master).getOrCreate()
+    proc = Spark4DataProc("localhost:5432", "bench", "bench", spark=spark)
+    df = synthetic_p7_frame(proc, args.rows, args.partitions).cache()
+    df.count()
+
+    server = BulkStandIn(args.reject_rate, args.latency, args.seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with tempfile.TemporaryDirectory() as output_path:
+            started = time.perf_counter()
+            chunks = proc.export_bulk_ndjson(df, "bench-shipments", output_path=output_path)
+            export_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            summary = BulkSender(server.endpoint, concurrency=args.concurrency, backoff=0.01).send(chunks)
+            send_seconds = time.perf_counter() - started
+    finally:
+        server.shutdown()
+
+    results = {
+        "rows": args.rows,
+        "chunks": len(chunks),
+        "bytes": sum(chunk["bytes"] for chunk in chunks),
+        "compressed_bytes": sum(chunk["compressed_bytes"] for chunk in chunks),
+        "export_seconds": export_seconds,
+        "export_rows_per_second": args.rows / export_seconds,
+        "send_seconds": send_seconds,
+        "send_rows_per_second": args.rows / send_seconds,
+        "requests": server.requests,
+        "rejected_requests": server.rejected,
+        "retries": summary["retries"],
+        "distinct_documents_received": len(server.document_ids),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Compares the columnar convert_to_p7 projection with the previous
+createDataFrame(df.rdd, schema) conversion, which round-trips every row through Python.
+
+Run from the scripts directory (where the Spark and config packages live):
+    python -m benchmarks.bench_convert_to_p7 --rows 1000000 --master local[*]
+"""
+import argparse
+import json
+import time
+
+from benchmarks.bench_write_table import synthetic_p7_frame
+from pyspark.sql.functions import col, lit, rand, when
+from Spark import Spark4DataProc
+
+
+def legacy_convert_to_p7(proc, df):
+    """The previous implementation; relies on df already being in P7 column order."""
+    return proc.spark.createDataFrame(df.rdd, proc.create_schema_p7())
+
+
+def time_conversion(convert, df):
+    start = time.perf_counter()
+    converted = convert(df)
+    # Force every column through the conversion without collecting it
+    converted.write.format("noop").mode("overwrite").save()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--partitions", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--master", default="local[*]")
+    args = parser.parse_args()
+
+    proc = Spark4DataProc("localhost:5432", "bench", "bench", appName="bench_convert_to_p7", master=args.master)
+    df = synthetic_p7_frame(proc, args.rows, args.partitions)
+    # Leave a few non-nullable values empty so the nullability report has something to find
+    df = df.withColumn(
+        "RECORD_ID", when(rand(seed=7) < 0.01, lit(None)).otherwise(col("RECORD_ID"))
+    )
+    df = df.cache()
+    df.count()
+
+    results = {"rows": args.rows}
+    for name, convert in (
+        ("rdd_round_trip", lambda frame: legacy_convert_to_p7(proc, frame)),
+        ("columnar", proc.convert_to_p7),
+    ):
+        timings = [time_conversion(convert, df) for _ in range(args.repeat)]
+        results[name] = {"seconds": timings, "best_seconds": min(timings)}
+    results["speedup"] = results["rdd_round_trip"]["best_seconds"] / results["columnar"]["best_seconds"]
+    results["nullability_violations"] = proc.check_p7_nullability(proc.convert_to_p7(df))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compares exact HS_CODE matching with longest-prefix matching against {cc}_hs_desc on the
+generated Costa Rica data (benchmarks.datagen): description coverage and throughput of each.
+No Postgres is needed; the reference table is served from the generated frame.
+
+Run from the scripts directory (where the Spark and config packages live):
+    python -m benchmarks.bench_hs_lookup --rows 10000000 --master local[*]
+"""
+import argparse
+import json
+import time
+
+from config.DataTypes.CR import CostaRicaTypes
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import col, count, lit, when
+from pyspark.sql.functions import sum as sum_
+from pyspark.sql.types import StringType
+from Spark import Spark4DataProc, hs_description_lookup
+
+from benchmarks.datagen import generate_reference_tables, hs_code_pool, pick, skewed_index
+
+
+def synthetic_hs_codes(spark, rows, seed):
+    """HS_CODE distributed like generate_raw_shipments, without the other columns."""
+    hs_codes = hs_code_pool()
+    return spark.range(rows).select(
+        col("id").alias("RECORD_ID"),
+        pick(hs_codes, skewed_index(len(hs_codes), 2.0, seed + 1)).alias("HS_CODE"),
+        lit(None).cast(StringType()).alias("HS_CODE_DESCRIPTION"),
+    )
+
+
+def measure(df):
+    started = time.perf_counter()
+    row = df.select(
+        count(lit(1)).alias("rows"),
+        sum_(when(col("HS_CODE_DESCRIPTION").isNotNull(), 1).otherwise(0)).alias("described"),
+    ).first()
+    seconds = time.perf_counter() - started
+    return {
+        "seconds": seconds,
+        "rows_per_second": row["rows"] / seconds if seconds else None,
+        "coverage": row["described"] / row["rows"] if row["rows"] else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--master", default="local[*]")
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.appName("bench_hs_lookup").master(args.master).getOrCreate()
+    proc = Spark4DataProc("localhost:5432", "bench", "bench", spark=spark)
+    country_code = CostaRicaTypes.country_code
+    table_key = ("HS_DESC", f"{country_code}_hs_desc")
+    hs_desc = generate_reference_tables(spark, country_code, companies=1, seed=args.seed)[table_key]
+    proc.reference_cache.frames[table_key] = hs_desc.cache()
+
+    df = synthetic_hs_codes(spark, args.rows, args.seed).cache()
+    df.count()
+
+    started = time.perf_counter()
+    proc.hs_prefix_index(country_code)
+    index_seconds = time.perf_counter() - started
+
+    results = {
+        "rows": args.rows,
+        "hs_desc_rows": hs_desc.count(),
+        "index_build_seconds": index_seconds,
+        "exact": measure(proc.enrich(df, [hs_description_lookup(country_code)])),
+        "longest_prefix": measure(proc.update_hs_code_by_prefix(df, country_code)),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+End-to-end benchmark of the CostaRica pipeline on generated data.
+
+For every scale a raw table and the matching reference tables are generated (benchmarks.datagen)
+and written to a local Postgres stand-in, then each CostaRica stage is timed on a local Spark
+session. The results are printed (and optionally written) as one JSON document so runs of
+different versions can be compared.
+
+Run from the scripts directory (where the Spark and config packages live):
+    python -m benchmarks.bench_pipeline --rows 1000000 10000000 --pg localhost:5432 \\
+        --jars /opt/airflow/scripts/jars/postgresql-42.2.24.jar --output results.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import traceback
+from datetime import datetime
+
+import pyspark
+from pyspark.sql import SparkSession
+from Spark import Spark4DataProc
+from Spark.CostaRica import CostaRica
+from Spark.ReferenceCache import ReferenceTableCache
+
+from benchmarks.datagen import load_dataset
+
+# (name, CostaRica method) in the order the stages depend on each other
+STAGES = [
+    ("columns", "update_columns"),
+    ("country", "update_country"),
+    ("hs_code", "update_hs_code"),
+    ("quantity", "update_quantity"),
+    ("ta_codes", "update_ta_codes"),
+    ("checks", "comprehensive_checks"),
+    ("fused", "process_fused"),
+]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def local_session(master, jars, shuffle_partitions):
+    builder = (
+        SparkSession.builder.appName("bench_pipeline")
+        .master(master)
+        .config("spark.sql.shuffle.partitions", shuffle_partitions)
+        .config("spark.sql.execution.arrow.pyspark.enabled", "true")
+    )
+    if jars:
+        builder = builder.config("spark.jars", jars)
+    return builder.getOrCreate()
+
+
+def stand_in(processor, url, user, password):
+    """Points a processor at the local Postgres stand-in instead of PostgresConfig."""
+    processor.url = url
+    processor.user = user
+    processor.password = password
+    return processor
+
+
+def timed_stage(processor, method):
+    started = time.perf_counter()
+    try:
+        getattr(processor, method)()
+        return {"status": "succeeded", "seconds": time.perf_counter() - started}
+    except Exception as error:
+        return {
+            "status": "failed",
+            "seconds": time.perf_counter() - started,
+            "error": f"{type(error).__name__}: {error}",
+            "traceback": traceback.format_exc(),
+        }
+
+
+def run_scale(spark, reference_cache, args, rows):
+    table_name = f"bench_imp_{rows}"
+    processor = stand_in(
+        CostaRica(table_name, spark=spark, reference_cache=reference_cache),
+        args.pg,
+        args.user,
+        args.password,
+    )
+    started = time.perf_counter()
+    load_dataset(processor, table_name, rows, "IMPORT", args.companies, seed=args.seed)
+    result = {"rows": rows, "table": table_name, "generate_seconds": time.perf_counter() - started, "stages": {}}
+
+    for name, method in STAGES:
+        # Reference tables are re-read per stage, as they would be in separate spark-submits
+        if args.cold:
+            reference_cache.clear()
+        result["stages"][name] = timed_stage(processor, method)
+        print(f"{table_name} {name}: {result['stages'][name]['status']} {result['stages'][name]['seconds']:.1f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000000])
+    parser.add_argument("--companies", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--master", default="local[*]")
+    parser.add_argument("--jars", default=None, help="PostgreSQL JDBC driver jar(s)")
+    parser.add_argument("--shuffle-partitions", type=int, default=64)
+    parser.add_argument("--pg", default="localhost:5432", help="host:port of the Postgres stand-in")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="postgres")
+    parser.add_argument("--cold", action="store_true", help="clear the reference cache before every stage")
+    parser.add_argument("--output", default=None, help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    spark = local_session(args.master, args.jars, args.shuffle_partitions)
+    reference_cache = ReferenceTableCache(
+        Spark4DataProc(args.pg, args.user, args.password, spark=spark),
+        snapshot_path="file://" + tempfile.mkdtemp(prefix="bench_reference_"),
+    )
+    results = {
+        "suite": "costa_rica_pipeline",
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "git_revision": git_revision(),
+        "python_version": platform.python_version(),
+        "spark_version": pyspark.__version__,
+        "master": args.master,
+        "scales": [run_scale(spark, reference_cache, args, rows) for rows in args.rows],
+    }
+
+    document = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(document)
+    print(document)
+
+
+if __name__ == "__main__":
+    main()
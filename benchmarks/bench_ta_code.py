@@ -0,0 +1,151 @@
+"""
+Compares the per-country TA code loop with the single-lookup TA code matcher
+on a synthetic dataset spanning all CountryCodes.COUNTRY_CODES_TWO_CHARS.
+
+Run from the scripts directory (where the Spark and config packages live):
+    python -m benchmarks.bench_ta_code --rows 1000000 --companies 200 --master local[*]
+"""
+import argparse
+import json
+import time
+
+from config.CountryCodeConfig import CountryCodes
+from pyspark.sql.functions import (
+    array,
+    col,
+    concat,
+    element_at,
+    floor,
+    lit,
+    lpad,
+    rand,
+    regexp_replace,
+    trim,
+    when,
+)
+from pyspark.sql.types import StringType
+from Spark import COMPANY_NAME_STRIP_PATTERN, Spark4DataProc
+
+
+class SyntheticTAProc(Spark4DataProc):
+    """Spark4DataProc serving the {cc}_kod_atama tables from generated frames instead of Postgres."""
+
+    def __init__(self, companies, **kwargs):
+        super().__init__("localhost:5432", "bench", "bench", **kwargs)
+        self.companies = companies
+        self.ta_tables = {}
+
+    def read_table(self, table_name, database_name, **kwargs):
+        if table_name not in self.ta_tables:
+            country_code = table_name.split("_")[0]
+            self.ta_tables[table_name] = (
+                self.spark.range(self.companies)
+                .select(
+                    concat(lit(country_code), lpad(col("id").cast("string"), 8, "0")).alias("TA_CODE"),
+                    concat(lit(f"COMPANY {country_code} "), col("id").cast("string")).alias("COMPANY_ham"),
+                )
+                .cache()
+            )
+        return self.ta_tables[table_name]
+
+    def _existing_tables(self, table_names, database_name):
+        # No company masters: the matcher normalizes the generated company files
+        return set()
+
+
+def synthetic_shipments(proc, rows, companies):
+    """Shipments with a skewed country distribution; the first countries dominate."""
+    countries = CountryCodes.COUNTRY_CODES_TWO_CHARS
+    codes = array(*[lit(code) for code in countries])
+
+    def skewed_country():
+        return element_at(codes, (floor(rand() * rand() * rand() * len(countries)) + 1).cast("int"))
+
+    def company_name(country):
+        return concat(lit("COMPANY "), country, lit(" "), floor(rand() * companies * 1.2).cast("string"))
+
+    df = proc.spark.range(rows).select(
+        col("id").alias("RECORD_ID"),
+        skewed_country().alias("EXPORTER_COUNTRY"),
+        skewed_country().alias("IMPORTER_COUNTRY"),
+    )
+    return df.select(
+        "*",
+        company_name(col("EXPORTER_COUNTRY")).alias("EXPORTER_NAME"),
+        company_name(col("IMPORTER_COUNTRY")).alias("IMPORTER_NAME"),
+        lit(None).cast(StringType()).alias("EXPORTER_TA_CODE"),
+        lit(None).cast(StringType()).alias("IMPORTER_TA_CODE"),
+    )
+
+
+def legacy_update_ta_code(proc, df, country_column, name_column, ta_code_column):
+    """The previous implementation: one distinct() job and one join per present country."""
+    condition = trim(
+        regexp_replace(col(name_column), COMPANY_NAME_STRIP_PATTERN, "")
+    ) == regexp_replace(col("COMPANY_ham"), COMPANY_NAME_STRIP_PATTERN, "")
+    for country_code in CountryCodes.COUNTRY_CODES_TWO_CHARS:
+        if country_code in df.select(country_column).distinct().rdd.map(lambda r: r[0]).collect():
+            new_codes_df = proc.read_table(f"{country_code}_kod_atama", "Yeni_veri_kod_atama_uniq")
+            df = df.join(new_codes_df, condition, "left").withColumn(
+                ta_code_column,
+                when(col(ta_code_column).isNull(), new_codes_df["TA_CODE"]).otherwise(col(ta_code_column)),
+            ).drop(new_codes_df["TA_CODE"], new_codes_df["COMPANY_ham"])
+    return df
+
+
+def timed(action):
+    start = time.perf_counter()
+    result = action()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--companies", type=int, default=200)
+    parser.add_argument("--master", default="local[*]")
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    proc = SyntheticTAProc(args.companies, appName="bench_ta_code", master=args.master)
+    df = synthetic_shipments(proc, args.rows, args.companies).cache()
+    df.count()
+    columns = ["RECORD_ID", "EXPORTER_TA_CODE", "IMPORTER_TA_CODE"]
+
+    fused, fused_seconds = timed(
+        lambda: proc.update_exporter_and_importer_ta_codes(df).select(columns).cache()
+    )
+    fused_rows, fused_action_seconds = timed(fused.count)
+    results = {
+        "rows": args.rows,
+        "countries": len(CountryCodes.COUNTRY_CODES_TWO_CHARS),
+        "single_lookup": {
+            "seconds": fused_seconds + fused_action_seconds,
+            "matched_exporters": fused.where(col("EXPORTER_TA_CODE").isNotNull()).count(),
+            "matched_importers": fused.where(col("IMPORTER_TA_CODE").isNotNull()).count(),
+        },
+    }
+
+    if not args.skip_legacy:
+
+        def run_legacy():
+            legacy_df = legacy_update_ta_code(proc, df, "EXPORTER_COUNTRY", "EXPORTER_NAME", "EXPORTER_TA_CODE")
+            legacy_df = legacy_update_ta_code(proc, legacy_df, "IMPORTER_COUNTRY", "IMPORTER_NAME", "IMPORTER_TA_CODE")
+            legacy_df = legacy_df.select(columns).cache()
+            legacy_df.count()
+            return legacy_df
+
+        legacy, legacy_seconds = timed(run_legacy)
+        results["per_country_loop"] = {"seconds": legacy_seconds}
+        results["speedup"] = legacy_seconds / results["single_lookup"]["seconds"]
+        results["identical_output"] = (
+            fused_rows == legacy.count()
+            and fused.exceptAll(legacy).count() == 0
+            and legacy.exceptAll(fused).count() == 0
+        )
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
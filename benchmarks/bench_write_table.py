@@ -0,0 +1,73 @@
+"""
+Compares the Spark JDBC INSERT writer with the COPY staging-swap writer.
+
+Run from the scripts directory (where the Spark and config packages live):
+    python -m benchmarks.bench_write_table --rows 1000000 --master local[*]
+"""
+import argparse
+import json
+import time
+
+from config.DBConfig import PostgresConfig
+from pyspark.sql.functions import col, concat, date_add, lit, rand
+from pyspark.sql.types import DateType, FloatType
+from Spark import Spark4DataProc
+
+
+def synthetic_p7_frame(proc, rows, partitions):
+    """Builds a P7-shaped DataFrame with the given number of rows."""
+    df = proc.spark.range(0, rows, numPartitions=partitions)
+    columns = []
+    for field in proc.create_schema_p7().fields:
+        if isinstance(field.dataType, FloatType):
+            value = (rand() * 10000).cast(FloatType())
+        elif isinstance(field.dataType, DateType):
+            value = date_add(lit("2023-01-01").cast(DateType()), (col("id") % 365).cast("int"))
+        else:
+            value = concat(lit(field.name + "_"), (col("id") % 100000).cast("string"))
+        columns.append(value.alias(field.name))
+    return df.select(columns)
+
+
+def time_write(proc, df, table_name, database_name, method):
+    start = time.perf_counter()
+    proc.write_table(df, table_name, database_name, mode="overwrite", method=method)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default=f"{PostgresConfig.HOST}:{PostgresConfig.PORT}")
+    parser.add_argument("--user", default=PostgresConfig.USER)
+    parser.add_argument("--password", default=PostgresConfig.PASSWORD)
+    parser.add_argument("--database", default="new_data")
+    parser.add_argument("--table", default="public.bench_write_table")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--partitions", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--master", default="local[*]")
+    args = parser.parse_args()
+
+    proc = Spark4DataProc(
+        args.host, args.user, args.password, appName="bench_write_table", master=args.master
+    )
+    df = synthetic_p7_frame(proc, args.rows, args.partitions).cache()
+    df.count()
+
+    results = {"rows": args.rows, "columns": len(df.columns), "partitions": args.partitions}
+    for method in ("jdbc", "copy"):
+        timings = [
+            time_write(proc, df, args.table, args.database, method)
+            for _ in range(args.repeat)
+        ]
+        results[method] = {
+            "seconds": timings,
+            "best_seconds": min(timings),
+            "rows_per_second": args.rows / min(timings),
+        }
+    results["speedup"] = results["jdbc"]["best_seconds"] / results["copy"]["best_seconds"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
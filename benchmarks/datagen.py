@@ -0,0 +1,222 @@
+"""
+Synthetic Costa Rica shipment data and matching reference tables.
+
+Everything is generated inside Spark from spark.range, so 1M-100M row tables never pass
+through Python. Column names come from CostaRicaTypes (raw names) and value types from
+the ShipmentFileType validation rules of the columns they are renamed to.
+"""
+import random
+from contextlib import closing
+
+from config.CountryCodeConfig import CountryCodes
+from config.DataTypes.CR import CostaRicaTypes
+from config.ShipmentFileConfig import ShipmentFileType
+from pyspark.sql import DataFrame
+from pyspark.sql.functions import (
+    array,
+    col,
+    concat,
+    concat_ws,
+    date_add,
+    element_at,
+    floor,
+    lit,
+    lpad,
+    pow,
+    rand,
+    round as round_,
+    upper,
+    when,
+)
+from pyspark.sql.types import DateType, DoubleType, StringType
+
+# Trading partners ordered by volume; the rest of CountryCodes follows with a long tail
+TOP_PARTNERS = ["US", "CN", "MX", "GT", "PA", "NI", "DE", "JP", "ES", "KR", "BR", "CO", "SV", "HN", "IN"]
+UNITS = ["KG", "U", "L", "M2", "M3", "M", "PAR", "DOC", "CJ", "TM", "GR", "ML", "JGO", "ROL", "SET"]
+UNIT_MAPPING = {"KG": ("Kilogram", 1.0), "U": ("Pieces", 1.0), "L": ("Liter", 1.0), "GR": ("Kilogram", 0.001),
+                "TM": ("Kilogram", 1000.0), "ML": ("Liter", 0.001), "M2": ("Square Meter", 1.0),
+                "M3": ("Cubic Meter", 1.0), "M": ("Meter", 1.0), "PAR": ("Pair", 1.0), "DOC": ("Pieces", 12.0),
+                "JGO": ("Set", 1.0), "SET": ("Set", 1.0)}
+PORTS = ["SANTAMARIA", "CALDERA", "LIMON", "PEÑAS BLANCAS", "PASO CANOAS", "CENTRAL", "MOIN", "GOLFITO"]
+COMPANY_PREFIXES = ["DISTRIBUIDORA", "COMERCIAL", "IMPORTADORA", "INDUSTRIAS", "GRUPO", "CORPORACION", "SERVICIOS"]
+COMPANY_WORDS = ["ALFA", "CENTRAL", "DEL NORTE", "PACIFICO", "TROPICAL", "ATLANTICO", "SAN JOSE", "ANDINA",
+                 "GLOBAL", "LATINA", "MAYA", "ORIENTE", "VERDE", "AZUL", "REAL", "NACIONAL"]
+COMPANY_SUFFIXES = ["S.A.", "S.R.L.", "LTDA", "INC.", "CO., LTD", "GMBH", "S.A. DE C.V.", "LLC"]
+
+REFERENCE_DATABASES = ["Country_Port_Code", "HS_DESC", "Yeni_veri_kod_atama_uniq", "UNIT_OF_QUANTITY"]
+
+
+def partner_countries():
+    rest = [code for code in CountryCodes.COUNTRY_CODES_TWO_CHARS if code not in TOP_PARTNERS]
+    return TOP_PARTNERS + rest
+
+
+def country_name(code):
+    return CountryCodes.COUNTRY_CODES_WITH_NAME.get(code, code).upper()
+
+
+def skewed_index(size, skew, seed):
+    """Index in [0, size) biased towards 0; larger skew means a longer tail."""
+    return floor(pow(rand(seed), skew) * size).cast("int")
+
+
+def pick(values, index):
+    return element_at(array(*[lit(value) for value in values]), index + 1)
+
+
+def hs_code_pool(size=4000, seed=11):
+    """10-digit national tariff lines grouped under realistic HS chapters."""
+    rng = random.Random(seed)
+    chapters = [chapter for chapter in range(1, 98) if chapter != 77]
+    codes = set()
+    while len(codes) < size:
+        chapter = rng.choice(chapters)
+        codes.add(f"{chapter:02d}{rng.randint(1, 99):02d}{rng.randint(10, 99):02d}{rng.randint(0, 99):02d}{rng.randint(0, 99):02d}")
+    return sorted(codes)
+
+
+def company_name(index, seed=0):
+    """Deterministic company name for a company index."""
+    rng = random.Random(index * 7919 + seed)
+    return " ".join(
+        [rng.choice(COMPANY_PREFIXES), rng.choice(COMPANY_WORDS), rng.choice(COMPANY_WORDS), rng.choice(COMPANY_SUFFIXES)]
+    )
+
+
+def company_pool(spark, companies) -> DataFrame:
+    return spark.createDataFrame(
+        [(index, company_name(index)) for index in range(companies)], ["COMPANY_INDEX", "COMPANY_NAME"]
+    )
+
+
+def raw_column_type(raw_name, rename):
+    rules = ShipmentFileType.fields.get(rename.get(raw_name), {}).get("validation_rules", ["text"])
+    if "date" in rules:
+        return DateType()
+    if "float" in rules:
+        return DoubleType()
+    return StringType()
+
+
+def generate_raw_shipments(spark, rows, data_type="IMPORT", companies=5000, partitions=None, seed=42) -> DataFrame:
+    """Raw Costa Rica import/export table shaped like the files loaded into the cr schema."""
+    rename = (
+        CostaRicaTypes.IMPORT_CHANGE_COLUMN_NAMES
+        if data_type == "IMPORT"
+        else CostaRicaTypes.EXPORT_CHANGE_COLUMN_NAMES
+    )
+    raw = {new: old for old, new in rename.items()}
+    countries = [country_name(code) for code in partner_countries()]
+    hs_codes = hs_code_pool()
+
+    df = spark.range(0, rows, numPartitions=partitions or spark.sparkContext.defaultParallelism)
+    df = df.select(
+        col("id"),
+        skewed_index(len(countries), 3.0, seed).alias("origin_index"),
+        skewed_index(len(hs_codes), 2.0, seed + 1).alias("hs_index"),
+        skewed_index(companies, 2.5, seed + 2).alias("company_index"),
+        skewed_index(len(UNITS), 2.0, seed + 3).alias("unit_index"),
+        rand(seed + 4).alias("noise"),
+    )
+    companies_df = company_pool(spark, companies)
+    df = df.join(companies_df.hint("broadcast"), df["company_index"] == companies_df["COMPANY_INDEX"], "left")
+
+    quantity = round_(pow(lit(10.0), rand(seed + 5) * 4), 2)
+    values = {
+        "ARRIVAL_DATE": date_add(lit("2023-01-01").cast(DateType()), floor(col("noise") * 365).cast("int")),
+        "DECLARATION_NUMBER": concat(lit("005-2023-"), lpad(floor(col("id") / 4).cast("string"), 9, "0")),
+        "ITEM_NO": (col("id") % 4 + 1).cast(DoubleType()),
+        "IMPORTER_TAX_ID": concat(lit("3-101-"), lpad(col("company_index").cast("string"), 6, "0")),
+        # Punctuation and spacing vary from the company master, as in the real files
+        "IMPORTER_NAME": when(col("noise") < 0.3, concat_ws(" ", col("COMPANY_NAME"), lit(".")))
+        .when(col("noise") < 0.5, upper(col("COMPANY_NAME")))
+        .otherwise(col("COMPANY_NAME")),
+        "HS_CODE": pick(hs_codes, col("hs_index")),
+        "PRODUCT_DETAILS": concat(lit("MERCADERIA PARTIDA "), pick(hs_codes, col("hs_index"))),
+        "COUNTRY_OF_ORIGIN": pick(countries, col("origin_index")),
+        "yedek_EXPORTER_COUNTRY": pick(countries, col("origin_index")),
+        "EXPORTER_COUNTRY": when(col("noise") < 0.85, pick(countries, col("origin_index"))).otherwise(lit(None)),
+        "QUANTITY": quantity,
+        "QUANTITY_UNIT": pick(UNITS, col("unit_index")),
+        "CIF_VALUE": round_(quantity * (rand(seed + 6) * 50 + 1), 2),
+        "NET_WEIGHT": round_(quantity * (rand(seed + 7) * 3 + 0.1), 2),
+        "GROSS_WEIGHT": round_(quantity * (rand(seed + 7) * 3 + 0.2), 2),
+        "PORT_OF_ARRIVAL": pick(PORTS, floor(rand(seed + 8) * len(PORTS)).cast("int")),
+    }
+    return df.select(
+        [
+            values[new].cast(raw_column_type(old, rename)).alias(old)
+            for new, old in raw.items()
+            if new in values
+        ]
+    )
+
+
+def generate_reference_tables(spark, country_code="CR", companies=5000, ta_countries=None, seed=42) -> dict:
+    """
+    Reference tables matching generate_raw_shipments, keyed by (database, table):
+    CountryCode, Country_Code_Uniq, {cc}_hs_desc, {cc}_unit_of_quantity and {cc}_kod_atama.
+    """
+    rng = random.Random(seed)
+    codes = partner_countries()
+    tables = {}
+    tables[("Country_Port_Code", "CountryCode")] = spark.createDataFrame(
+        [(country_name(code), code) for code in codes], ["country2", "code"]
+    )
+    tables[("Country_Port_Code", "Country_Code_Uniq")] = spark.createDataFrame(
+        [(code, CountryCodes.COUNTRY_CODES_WITH_NAME[code]) for code in codes if code in CountryCodes.COUNTRY_CODES_WITH_NAME],
+        ["Alpha-2 code", "English short name (upper/lower case)"],
+    )
+
+    hs_rows = []
+    for code in hs_code_pool():
+        # Most national lines are described directly; some only at HS6/HS8 level
+        level = rng.choices([10, 8, 6], weights=[80, 10, 10])[0]
+        new_code = code[:8] + "00" if rng.random() < 0.02 else None
+        hs_rows.append((code[:level], f"DESCRIPTION OF {code[:level]}", new_code if level == 10 else None))
+    tables[("HS_DESC", f"{country_code}_hs_desc")] = spark.createDataFrame(
+        sorted(set(hs_rows)), ["HS_CODE", "HS_CODE_DESC", "new_HS_CODE"]
+    )
+
+    tables[("UNIT_OF_QUANTITY", f"{country_code}_unit_of_quantity")] = spark.createDataFrame(
+        [(unit, target, factor) for unit, (target, factor) in UNIT_MAPPING.items()],
+        ["UNIT_OF_QUANTITY", "Yeni_Birim", "Aksiyon"],
+    )
+
+    # 90% of the companies are known to the TA code assignment tables
+    companies_df = company_pool(spark, companies).where(col("COMPANY_INDEX") % 10 != 0)
+    for ta_country in ta_countries or [country_code]:
+        tables[("Yeni_veri_kod_atama_uniq", f"{ta_country}_kod_atama")] = companies_df.select(
+            concat(lit(ta_country), lpad(col("COMPANY_INDEX").cast("string"), 8, "0")).alias("TA_CODE"),
+            col("COMPANY_NAME").alias("COMPANY_ham"),
+        )
+    return tables
+
+
+def ensure_databases(proc, databases, schema_database=None, schemas=()):
+    """Creates the stand-in databases (and schemas in schema_database) if they are missing."""
+    with closing(proc._pg_connection("postgres")) as conn:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            for database in databases:
+                cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (database,))
+                if not cursor.fetchone():
+                    cursor.execute(f'CREATE DATABASE "{database}"')
+    if schema_database:
+        with closing(proc._pg_connection(schema_database)) as conn:
+            with conn, conn.cursor() as cursor:
+                for schema in schemas:
+                    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+
+
+def load_dataset(proc, raw_table, rows, data_type="IMPORT", companies=5000, ta_countries=None, seed=42):
+    """Generates and writes a raw table plus all reference tables to the Postgres stand-in."""
+    database = CostaRicaTypes.DATABASE
+    schema = CostaRicaTypes.SCHEMA.lower()
+    ensure_databases(proc, [database] + REFERENCE_DATABASES, database, [schema])
+    for (reference_database, table_name), df in generate_reference_tables(
+        proc.spark, CostaRicaTypes.country_code, companies, ta_countries, seed
+    ).items():
+        proc.write_table(df, table_name, reference_database, mode="overwrite")
+    raw_df = generate_raw_shipments(proc.spark, rows, data_type, companies, seed=seed)
+    proc.write_table(raw_df, f"{schema}.{raw_table}", database, mode="overwrite")
@@ -1,10 +1,14 @@
+import json
 import logging
 import os
 import sys
+import time
+import urllib.request
 from datetime import timedelta
 
-from airflow.decorators import dag, task
-from airflow.providers.apache.spark.operators.spark_submit import SparkSubmitOperator
+from airflow.decorators import dag, task, task_group
+from airflow.models import Variable
+from airflow.providers.apache.spark.hooks.spark_submit import SparkSubmitHook
 from airflow.providers.postgres.hooks.postgres import PostgresHook
 from airflow.utils.dates import days_ago
 
@@ -18,6 +22,50 @@ default_args = {
     "retry":0
 }
 
+# Number of tables processed at the same time
+MAX_CONCURRENT_TABLES = 4
+
+# Spark resources by on-disk table size (pg_total_relation_size), smallest tier first
+RESOURCE_TIERS = [
+    {"max_bytes": 256 * 1024 ** 2, "num_executors": 1, "executor_memory": "2g", "executor_cores": 2, "driver_memory": "1g"},
+    {"max_bytes": 2 * 1024 ** 3, "num_executors": 2, "executor_memory": "4g", "executor_cores": 2, "driver_memory": "2g"},
+    {"max_bytes": 8 * 1024 ** 3, "num_executors": 4, "executor_memory": "6g", "executor_cores": 4, "driver_memory": "2g"},
+    {"max_bytes": None, "num_executors": 8, "executor_memory": "8g", "executor_cores": 4, "driver_memory": "4g"},
+]
+
+# Tables in the cr schema written by the pipeline itself, never raw input
+DERIVED_TABLE_SUFFIXES = ["_islendi", "_checks", "__staging"]
+BOOKKEEPING_TABLES = ["processed_tables", "processing_watermarks", "ingested_files"]
+
+# When set, tables are sent to the warm processing service (spark-jobs/processing_service.py)
+# instead of starting a new Spark application per table
+PROCESSING_SERVICE_VARIABLE = "processing_service_url"
+PROCESSING_SERVICE_POLL_SECONDS = 10
+
+
+def run_on_processing_service(service_url, table_name, mode="fused"):
+    """Submits a table to the processing service and waits for the job to finish."""
+    request = urllib.request.Request(
+        f"{service_url}/jobs",
+        data=json.dumps({"table": table_name, "country": "cr", "mode": mode}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(request) as response:
+        job_id = json.load(response)["job_id"]
+
+    while True:
+        with urllib.request.urlopen(f"{service_url}/jobs/{job_id}") as response:
+            job = json.load(response)
+        if job["status"] == "succeeded":
+            logger.info(
+                f"{table_name}: time to first row {job.get('time_to_first_row')}s, total {job.get('seconds')}s"
+            )
+            return job
+        if job["status"] == "failed":
+            raise RuntimeError(f"Processing {table_name} failed: {job.get('error')}")
+        time.sleep(PROCESSING_SERVICE_POLL_SECONDS)
+
 # scripts dizinini sistem yoluna ekle
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
 
@@ -27,6 +75,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'
     schedule_interval="*/5 * * * *",
     start_date=days_ago(1),
     catchup=False,
+    max_active_runs=1,
     tags=["costa_rica"],
 )
 def costa_rica_processing():
@@ -37,54 +86,96 @@ def costa_rica_processing():
         cursor = conn.cursor()
         cursor.execute(
             """
-            SELECT table_name FROM information_schema.tables
-            WHERE table_schema='cr' AND table_type='BASE TABLE'
-            AND table_name NOT IN (SELECT table_name FROM cr.processed_tables);
-            """
+            SELECT c.relname AS table_name FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'cr' AND c.relkind = 'r'
+            -- Month partitions of the processed tables are tables too
+            AND NOT c.relispartition
+            AND c.relname NOT IN (SELECT table_name FROM cr.processed_tables)
+            AND c.relname <> ALL(%s)
+            AND NOT c.relname LIKE ANY(%s)
+            ORDER BY c.relname;
+            """,
+            (
+                BOOKKEEPING_TABLES,
+                ["%" + suffix.replace("_", "\\_") for suffix in DERIVED_TABLE_SUFFIXES],
+            ),
         )
-        unprocessed_tables = cursor.fetchone()
+        unprocessed_tables = [row[0] for row in cursor.fetchall()]
         cursor.close()
         conn.close()
         return unprocessed_tables
 
     @task
-    def mark_table_as_processed(table_name):
+    def size_spark_job(table_name):
         conn = PostgresHook(postgres_conn_id="new_data_postgres").get_conn()
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO processed_tables (table_name) VALUES (%s) ON CONFLICT (table_name) DO NOTHING;",
-            (table_name,),
+            "SELECT coalesce(pg_total_relation_size(to_regclass(%s)), 0);",
+            (f"cr.{table_name}",),
         )
-        conn.commit()
+        table_size = cursor.fetchone()[0]
         cursor.close()
         conn.close()
 
-    def submit_spark_job(task_id, script, table_name):
+        tier = next(
+            tier for tier in RESOURCE_TIERS
+            if tier["max_bytes"] is None or table_size <= tier["max_bytes"]
+        )
+        resources = {key: value for key, value in tier.items() if key != "max_bytes"}
+        # The standalone master ignores num_executors: an application takes every free core unless capped
+        resources["total_executor_cores"] = tier["num_executors"] * tier["executor_cores"]
+        logger.info(f"{table_name}: {table_size} bytes, resources: {resources}")
+        return resources
+
+    @task(max_active_tis_per_dag=MAX_CONCURRENT_TABLES)
+    def submit_spark_job(table_name, resources, script="process.py"):
+        service_url = Variable.get(PROCESSING_SERVICE_VARIABLE, default_var=None)
+        if service_url:
+            run_on_processing_service(service_url, table_name)
+            return
+
         logger.info(f"PYTHONPATH:{sys.path}", )
-        return SparkSubmitOperator(
-            task_id=task_id,
-            application=f"/opt/airflow/scripts/dags/cr/{script}",
-            application_args=table_name,
-            executor_memory="2g",
-            executor_cores=2,
-            num_executors=1,
-            driver_memory="1g",
-            trigger_rule="all_success",
+        SparkSubmitHook(
+            name=f"{script} - {table_name}",
+            application_args=[table_name],
+            executor_memory=resources["executor_memory"],
+            executor_cores=resources["executor_cores"],
+            num_executors=resources["num_executors"],
+            total_executor_cores=resources["total_executor_cores"],
+            driver_memory=resources["driver_memory"],
             conf={
             'spark.executorEnv.PYTHONPATH': '/opt/airflow/scripts',
-            'spark.yarn.appMasterEnv.PYTHONPATH': '/opt/airflow/scripts'
+            'spark.yarn.appMasterEnv.PYTHONPATH': '/opt/airflow/scripts',
+            'spark.cores.max': str(resources["total_executor_cores"]),
+            # COPY writes are not safe to run twice at the same time
+            'spark.speculation': 'false'
         },
             jars="/opt/airflow/scripts/jars/postgresql-42.2.24.jar"
-        )
+        ).submit(application=f"/opt/airflow/scripts/dags/cr/{script}")
 
-    table_name = get_unprocessed_tables()
-    print("PYTHONPATH:", sys.path)
+    @task
+    def mark_table_as_processed(table_name):
+        conn = PostgresHook(postgres_conn_id="new_data_postgres").get_conn()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO cr.processed_tables (table_name) VALUES (%s) ON CONFLICT (table_name) DO NOTHING;",
+            (table_name,),
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
 
-    process = submit_spark_job("process", "process.py", table_name)
+    @task_group
+    def process_table(table_name):
+        resources = size_spark_job(table_name)
+        process = submit_spark_job(table_name, resources)
+        process >> mark_table_as_processed(table_name)
 
-    mark_processed = mark_table_as_processed(table_name)
+    print("PYTHONPATH:", sys.path)
 
-    process >> mark_processed
+    # One mapped group per pending table: each table is sized, processed and marked independently
+    process_table.expand(table_name=get_unprocessed_tables())
 
 
 costa_rica_dag = costa_rica_processing()
@@ -0,0 +1,30 @@
+from config.CompanyFileConfig import CompanyMasterConfig
+from config.CountryCodeConfig import CountryCodes
+from config.DBConfig import PostgresConfig
+from Spark import Spark4DataProc
+
+
+def main(country_codes):
+    proc = Spark4DataProc(
+        f"{PostgresConfig.HOST}:{PostgresConfig.PORT}",
+        PostgresConfig.USER,
+        PostgresConfig.PASSWORD,
+        appName="Build Company Master",
+    )
+    source_tables = {
+        country_code: CompanyMasterConfig.SOURCE_TABLE.format(country_code=country_code)
+        for country_code in country_codes
+    }
+    existing = proc._existing_tables(source_tables.values(), CompanyMasterConfig.DATABASE)
+    # Masters built from the current company file are kept
+    current = proc._current_company_masters(source_tables)
+    for country_code, source_table in source_tables.items():
+        if source_table in existing and country_code not in current:
+            proc.build_company_master(country_code)
+
+
+if __name__ == "__main__":
+    import sys
+
+    country_codes = sys.argv[1:] or CountryCodes.COUNTRY_CODES_TWO_CHARS
+    main(country_codes)
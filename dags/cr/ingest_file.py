@@ -0,0 +1,16 @@
+import logging
+
+from Spark.CostaRica import CostaRica
+
+
+def main(file_path, table_name, replace=False):
+    costa_rica = CostaRica(table_name=table_name, appName=f"Ingest File - {table_name}")
+    entry = costa_rica.ingest_file(file_path, replace=replace)
+    logging.info(f"{file_path} loaded as {table_name}: {entry}")
+
+if __name__ == "__main__":
+    import sys
+
+    # python ingest_file.py <file> <raw table name, e.g. yeni_veri_cr_2024_01> [--replace]
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1], sys.argv[2], replace="--replace" in sys.argv[3:])
@@ -1,19 +1,22 @@
+import logging
+
 from pyspark.sql import SparkSession
 from Spark.CostaRica import CostaRica
 
 
 def main(table_name):
     costa_rica = CostaRica(table_name=table_name, appName=f"Update Country - {table_name}")
-    costa_rica.update_columns()
-    costa_rica.update_country()
-    costa_rica.update_hs_code()
-    costa_rica.update_quantity()
-    costa_rica.update_ta_codes()
-    results = costa_rica.comprehensive_checks()
-    print(results)
+    # Stage checkpoints only pay off for the largest tables
+    if costa_rica.use_checkpoints():
+        costa_rica.process_resumable()
+    else:
+        costa_rica.process_fused()
+    costa_rica.comprehensive_checks()
 
 if __name__ == "__main__":
     import sys
 
+    # Step metrics (Spark.Instrumentation) are emitted as "run_metrics {...}" log lines
+    logging.basicConfig(level=logging.INFO)
     table_name = sys.argv[1]
     main(table_name)
@@ -0,0 +1,14 @@
+from Spark.CostaRica import CostaRica
+
+
+def main(table_name):
+    costa_rica = CostaRica(table_name=table_name, appName=f"Process Incremental - {table_name}")
+    if costa_rica.process_incremental():
+        costa_rica.comprehensive_checks()
+
+
+if __name__ == "__main__":
+    import sys
+
+    table_name = sys.argv[1]
+    main(table_name)
@@ -6,3 +6,14 @@ class CompanyFileType:
         "COMPANY_ADDRESS": {"column_no": 3, "validation_rules": ["text"]},
         "CITY_STATE": {"column_no": 4, "validation_rules": ["text"]},
     }
+
+
+class CompanyMasterConfig:
+    DATABASE = "Yeni_veri_kod_atama_uniq"
+    # Company file per country, validated against CompanyFileType
+    SOURCE_TABLE = "{country_code}_kod_atama"
+    # Raw company name column of the source table, mapped to COMPANY_NAME
+    SOURCE_NAME_COLUMN = "COMPANY_ham"
+    # Deduplicated, indexed NAME_KEY -> TA_CODE table per country
+    MASTER_TABLE = "{country_code}_company_master"
+    NAME_KEY_COLUMN = "NAME_KEY"
@@ -11,3 +11,35 @@ class S3Config:
     PORT = "9000"
     USER = "minio"
     PASSWORD = "miniosecret"
+
+
+class JDBCReadConfig:
+    FETCH_SIZE = 10000
+    # Tables smaller than this are read with a single JDBC query
+    MIN_PARTITIONED_BYTES = 64 * 1024 * 1024
+    # Target amount of table data handled by one read partition
+    TARGET_PARTITION_BYTES = 128 * 1024 * 1024
+    # Upper bound for automatically chosen partition counts, 0 means defaultParallelism
+    MAX_PARTITIONS = 0
+    # Columns probed (in order) when no split column is configured for a table
+    PARTITION_COLUMN_CANDIDATES = ["ARRIVAL_DATE", "DATE", "ITEM_NO", "ITEM"]
+    # Explicit split columns, e.g. {"cr.yeni_veri_cr_2023_12": "ARRIVAL_DATE"}
+    PARTITION_COLUMNS = {}
+    SPLITTABLE_TYPES = [
+        "int2",
+        "int4",
+        "int8",
+        "numeric",
+        "float4",
+        "float8",
+        "date",
+        "timestamp",
+        "timestamptz",
+    ]
+
+
+class JDBCWriteConfig:
+    # "copy" streams partitions with COPY FROM STDIN into a staging table that is swapped in at the end,
+    # "jdbc" uses Spark's JDBC INSERT batches
+    METHOD = "copy"
+    STAGING_SUFFIX = "__staging"
@@ -2,6 +2,12 @@ from config.DBConfig import PostgresConfig, S3Config
 
 
 class CostaRicaTypes:
+    # How the customs files write dates and numbers (see FileIngestor): an explicit strftime format,
+    # or None to detect each file's format with dates read day first; "12,5" is twelve and a half
+    INGEST_DATE_FORMAT = None
+    INGEST_DAYFIRST = True
+    INGEST_DECIMAL_SEPARATOR = ","
+
     IMPORT_CHANGE_COLUMN_NAMES = {
         "DATE": "ARRIVAL_DATE",
         "OPERATION#": "DECLARATION_NUMBER",
@@ -75,3 +81,12 @@ class CostaRicaTypes:
     DATABASE = "new_data"
     SCHEMA = "CR"
     country_code = "CR"
+
+    # Shipment line key, used to upsert incremental results into the processed table
+    KEY_COLUMNS = ["DECLARATION_NUMBER", "ITEM_NO", "ARRIVAL_DATE"]
+    # Raw column used as incremental high-water mark; None uses the commit time of the rows
+    # (pg_xact_commit_timestamp, needs track_commit_timestamp = on)
+    WATERMARK_COLUMN = None
+    # Commit time mode rereads rows committed this long before the high-water mark
+    WATERMARK_OVERLAP = "5 minutes"
+    WATERMARK_TABLE = "processing_watermarks"
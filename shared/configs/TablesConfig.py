@@ -9,3 +9,182 @@ class PostgresTablesConfig:
     RAW_DATA_FORMAT = (
         "yeni_veri_[a-z]_20[0-9]{2}_[0-9]{2}"  # Example : yeni_veri_cr_2023_12
     )
+
+
+class ReferenceCacheConfig:
+    # Must be reachable from the driver and every executor (shared volume or s3a:// bucket)
+    SNAPSHOT_PATH = "file:///opt/airflow/scripts/cache/reference"
+    ENABLED = True
+    # Temporary snapshot directories older than this were left by failed runs and are deleted
+    TEMP_MAX_AGE_SECONDS = 24 * 3600
+    # A session reusing a cached table checks its version again after this many seconds
+    REVALIDATE_SECONDS = 300
+
+
+class RunMetricsConfig:
+    # Per-step timings, row counts and Spark task metrics of every processing run
+    DATABASE = "new_data"
+    TABLE = "public.run_metrics"
+    ENABLED = True
+    # Public Spark4DataProc methods (and subclass methods) recorded as steps
+    STEP_PREFIXES = (
+        "read_table",
+        "write_table",
+        "update_",
+        "check_",
+        "comprehensive_checks",
+        "run_comprehensive_checks",
+        "process_",
+        "export_",
+        "ingest_",
+    )
+    # Seconds to wait for the Spark UI REST API when collecting stage metrics
+    REST_TIMEOUT = 5
+
+
+class CheckpointConfig:
+    # Parquet outputs of pipeline stages; use a file:// directory for local runs
+    ROOT_PATH = "s3a://pipeline-checkpoints/stages"
+    # Directory column added while writing and dropped again on load
+    PARTITION_COLUMN = "__checkpoint_partition"
+    # process.py only checkpoints raw tables at least this large on disk (the DAG's largest
+    # resource tier); smaller ones run fused, where rerunning from the start is cheaper than
+    # writing every stage. None never checkpoints.
+    MIN_BYTES = 8 * 1024 ** 3
+
+
+class SmallTableConfig:
+    # Tables with at most this many rows are processed with the pandas backend, without Spark
+    MAX_ROWS = 200000
+    ENABLED = True
+
+
+class CountryLookupConfig:
+    # "snapshot": the CountryCode / Country_Code_Uniq tables (via the reference cache),
+    # "config": CountryCodeConfig.COUNTRY_CODES_WITH_NAME, without reading any table
+    SOURCE = "snapshot"
+
+
+class EnrichConfig:
+    # Lookups whose projected size (optimizer estimate of the cached table) is at most this
+    # many bytes are broadcast; larger ones are joined with a shuffle
+    BROADCAST_MAX_BYTES = 64 * 1024 * 1024
+
+
+class HSCodeLookupConfig:
+    # Match HS_CODE against the longest {cc}_hs_desc code it starts with instead of exactly
+    PREFIX_MATCH = True
+    # Shortest table code used as a prefix (HS2 chapters)
+    MIN_PREFIX_LENGTH = 2
+
+
+class ApproxChecksConfig:
+    # comprehensive_checks switches to sampled checks for processed tables above MIN_ROWS rows
+    ENABLED = True
+    MIN_ROWS = 50000000
+    # A pilot sample of PILOT_FRACTION gives the rates; if they are not within MAX_RATE_ERROR the
+    # checks rerun once on the fraction those rates need, or exactly when it exceeds
+    # MAX_SAMPLE_FRACTION (each BERNOULLI sample reads the whole table)
+    PILOT_FRACTION = 0.001
+    MAX_SAMPLE_FRACTION = 0.1
+    # Largest accepted half-width of a rate's confidence interval (0.002 = 0.2 percentage points)
+    MAX_RATE_ERROR = 0.002
+    CONFIDENCE = 0.95
+    # Relative standard deviation of the approx_count_distinct (HyperLogLog++) cardinalities
+    CARDINALITY_RSD = 0.02
+    SEED = 17
+    # TABLESAMPLE method of the samples read from Postgres: BERNOULLI samples rows independently,
+    # as the confidence intervals assume; SYSTEM samples whole pages, reading far less but with
+    # intervals that are too narrow when similar rows share pages (as loaded files do)
+    SAMPLE_METHOD = "BERNOULLI"
+
+
+class DedupeConfig:
+    # Drops (or flags) shipment lines already processed from another raw table of the country
+    ENABLED = True
+    # "drop" removes the repeated lines, "flag" keeps them with FLAG_COLUMN set
+    MODE = "drop"
+    FLAG_COLUMN = "IS_DUPLICATE"
+    # Kept out of the country schema, whose tables the DAG processes as raw input
+    SCHEMA = "{country_code}_meta"
+    INDEX_TABLE = "{country_code}_meta.shipment_key_index"
+    BLOOM_TABLE = "{country_code}_meta.shipment_key_bloom"
+    STAGED_TABLE = "{country_code}_meta.{table_name}_staged_keys"
+    HASH_PARTITIONS = 16
+    # The Bloom filter is sized for this many keys (about 60 MB) and doubled when exceeded
+    BLOOM_CAPACITY = 50000000
+    BLOOM_FALSE_POSITIVE_RATE = 0.01
+    # Hashes per index lookup query
+    PROBE_BATCH = 50000
+
+
+class RecordIdConfig:
+    # "content_hash": RECORD_ID is a hash of the source table and the line's key columns, so
+    # reprocessing merges into the processed table on RECORD_ID, rewriting only changed rows;
+    # "uuid": a random RECORD_ID per run and a full overwrite of the processed table
+    MODE = "content_hash"
+    KEY_COLUMN = "RECORD_ID"
+    # Raw column numbering the lines of a loaded file (see FileIngestor); orders the lines that
+    # repeat a key, so their RECORD_IDs do not depend on their values. Not carried to processed tables
+    LINE_COLUMN = "__line"
+
+
+class MonthPartitionConfig:
+    # Processed tables are written as Postgres tables partitioned by month of PARTITION_COLUMN,
+    # each month loaded into a detached table and swapped in with ATTACH PARTITION (with
+    # RecordIdConfig.MODE = "content_hash" only on the first write, later ones merge month by month)
+    ENABLED = True
+    PARTITION_COLUMN = "ARRIVAL_DATE"
+    # Physical row order of a month's table (keeps the BRIN ranges narrow)
+    SORT_COLUMNS = ("ARRIVAL_DATE", "HS_CODE")
+    BRIN_COLUMNS = ("ARRIVAL_DATE",)
+    BRIN_PAGES_PER_RANGE = 32
+    BTREE_COLUMNS = ("HS_CODE",)
+    # Spark tasks the months are hashed into (and driver threads preparing the loaded months)
+    WRITERS = 8
+    # Concurrent COPYs per month: a month is split by a hash of the row, each slice loaded in sort order
+    WRITERS_PER_MONTH = 4
+
+
+class BulkExportConfig:
+    # Directory shared by the driver and every executor; every export writes to its own subdirectory
+    OUTPUT_PATH = "/opt/airflow/scripts/export/elasticsearch"
+    INDEX = "shipments-{country_code}"
+    # Document _id (deterministic, so re-exporting or retrying a chunk overwrites instead of duplicating)
+    ID_COLUMN = "RECORD_ID"
+    # Uncompressed bytes of one chunk, i.e. of one _bulk request body
+    MAX_CHUNK_BYTES = 10 * 1024 * 1024
+    COMPRESSION_LEVEL = 6
+    # Elasticsearch URL the chunks are posted to, e.g. "http://elasticsearch:9200"; None only writes them
+    ENDPOINT = None
+    # Chunks in flight at once; the next chunk is read only when a request finishes. Also bounds
+    # streaming exports, whose documents are coalesced to this many partitions (one task each)
+    CONCURRENCY = 4
+    # With an ENDPOINT the executors post the chunks they build instead of writing them to OUTPUT_PATH
+    # (one request in flight per task, at most CONCURRENCY tasks), so no directory has to be shared
+    # with the driver
+    STREAM = True
+    MAX_RETRIES = 5
+    # Seconds before the first retry of a rejected (429/5xx) chunk, doubled on every further retry
+    RETRY_BACKOFF = 1.0
+    TIMEOUT = 120
+
+
+class IngestConfig:
+    # Files are loaded into this schema and moved to the country schema (where the DAG finds them) once complete
+    SCHEMA = "{country_code}_ingest"
+    # Loaded files, registered in the country schema in the same transaction as the table move
+    REGISTRY_TABLE = "ingested_files"
+    # Rows parsed, coerced and copied at a time; memory use is about (WORKERS + 1) chunks
+    CHUNK_ROWS = 100000
+    # Chunks loaded in parallel, each with its own COPY connection
+    WORKERS = 4
+    CSV_SEPARATOR = ","
+    CSV_ENCODING = "utf-8-sig"
+    # Share of a column's values that may fail to convert (and load as null) before the file is refused
+    MAX_COERCION_ERROR_RATE = 0.01
+    # A column of the first chunk above that rate: "fail" refuses the file, "text" loads the column as raw text
+    COERCION_ERRORS = "fail"
+    # mdbtools command streaming an Access table as CSV
+    MDB_EXPORT = "mdb-export"
+    MDB_TABLES = "mdb-tables"
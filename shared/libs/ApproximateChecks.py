@@ -0,0 +1,129 @@
+import math
+from statistics import NormalDist
+
+
+class Estimate(float):
+    """
+    A check figure with its accuracy. Behaves as the (point) value, so approximate results keep
+    the shape of exact ones; low/high bound the true value at the given confidence (None where
+    unbounded) and exact tells whether the figure was computed on all rows.
+    """
+
+    def __new__(cls, value, low=None, high=None, confidence=None, exact=False, sample_fraction=None, sample_rows=None):
+        estimate = super().__new__(cls, value)
+        estimate.low = low
+        estimate.high = high
+        estimate.confidence = confidence
+        estimate.exact = exact
+        estimate.sample_fraction = sample_fraction
+        estimate.sample_rows = sample_rows
+        return estimate
+
+    @classmethod
+    def exact_value(cls, value):
+        return cls(value, value, value, 1.0, exact=True, sample_fraction=1.0)
+
+    def as_dict(self):
+        return {
+            "value": float(self),
+            "exact": self.exact,
+            "low": self.low,
+            "high": self.high,
+            "confidence": self.confidence,
+            "sample_fraction": self.sample_fraction,
+            "sample_rows": self.sample_rows,
+        }
+
+
+class SampledValues(list):
+    """Distinct values seen in a sample: values missing here may still occur in the table."""
+
+    def __init__(self, values, sample_fraction=None, sample_rows=None):
+        super().__init__(values)
+        self.exact = False
+        self.sample_fraction = sample_fraction
+        self.sample_rows = sample_rows
+
+    def derive(self, values):
+        """Values computed from these ones, with the same sampling information."""
+        return SampledValues(values, self.sample_fraction, self.sample_rows)
+
+    def as_dict(self):
+        return {
+            "values": sorted(self),
+            "exact": False,
+            "sample_fraction": self.sample_fraction,
+            "sample_rows": self.sample_rows,
+        }
+
+
+def derive_values(source, values):
+    """values, carrying the sampling information of source if source came from a sample."""
+    return source.derive(values) if isinstance(source, SampledValues) else values
+
+
+def z_score(confidence):
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def wilson_interval(successes, trials, z):
+    """Wilson score interval of a binomial rate; stays informative for rates near 0 or 1."""
+    if trials == 0:
+        return 0.0, 1.0
+    rate = successes / trials
+    denominator = 1 + z * z / trials
+    center = (rate + z * z / (2 * trials)) / denominator
+    half_width = z * math.sqrt(rate * (1 - rate) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def estimate_count(count, sample_rows, fraction, z, confidence):
+    """
+    Scales the count of a Bernoulli sample (rows kept with probability fraction) to the table.
+    The interval combines the rate's Wilson interval with the uncertainty of the row count.
+    """
+    low_rate, high_rate = wilson_interval(count, sample_rows, z)
+    row_error = z * math.sqrt(sample_rows * (1 - fraction))
+    low_rows = max(float(sample_rows), (sample_rows - row_error) / fraction)
+    high_rows = (sample_rows + row_error) / fraction
+    return Estimate(
+        count / fraction,
+        max(float(count), low_rate * low_rows),
+        high_rate * high_rows,
+        confidence,
+        sample_fraction=fraction,
+        sample_rows=sample_rows,
+    )
+
+
+def rate_error(count, sample_rows, z):
+    """Half-width of the rate's confidence interval, the criterion for stopping the sampling."""
+    low, high = wilson_interval(count, sample_rows, z)
+    return (high - low) / 2
+
+
+def required_sample_rows(count, sample_rows, z, max_rate_error):
+    """
+    Sample size at which the rate's confidence interval narrows to max_rate_error, taking as the
+    rate the point of its current interval nearest 1/2, where the interval is widest. Rates near
+    0 or 1 still need z^2 / (2 max_rate_error) rows, the width of the Wilson interval at 0.
+    """
+    low, high = wilson_interval(count, sample_rows, z)
+    rate = min(max(0.5, low), high)
+    return math.ceil(max(z * z * rate * (1 - rate) / (max_rate_error * max_rate_error), z * z / (2 * max_rate_error)))
+
+
+def estimate_cardinality(value, rsd, z, confidence, sample_fraction, sample_rows):
+    """
+    An approx_count_distinct result. On a sample it only bounds the table's cardinality from
+    below (unsampled rows may hold further values), so the upper bound is left open.
+    """
+    exact_rows = sample_fraction >= 1
+    return Estimate(
+        value,
+        max(0.0, value * (1 - z * rsd)),
+        value * (1 + z * rsd) if exact_rows else None,
+        confidence,
+        sample_fraction=sample_fraction,
+        sample_rows=sample_rows,
+    )
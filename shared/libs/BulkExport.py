@@ -0,0 +1,237 @@
+import gzip
+import json
+import logging
+import os
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from config.TablesConfig import BulkExportConfig
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "_manifest.json"
+CHUNK_SUFFIX = ".ndjson.gz"
+# Responses that mean "slow down" rather than "this request is wrong"
+RETRY_STATUSES = {429, 502, 503, 504}
+# Keeps _bulk responses to the fields the sender reads instead of one full item per document
+BULK_RESPONSE_FILTER = "errors,items.*.status,items.*.error.type,items.*.error.reason"
+
+
+class BulkExportError(Exception):
+    """Raised when chunks could not be delivered to the bulk endpoint."""
+
+
+def action_line(index_name, document_id):
+    """The _bulk action line of a document; without an id Elasticsearch generates one."""
+    action = {"_index": index_name}
+    if document_id is not None:
+        action["_id"] = document_id
+    return json.dumps({"index": action}, separators=(",", ":"))
+
+
+def write_manifest(directory, chunks):
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as manifest:
+        json.dump({"chunks": chunks}, manifest)
+    os.replace(path + ".tmp", path)
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as manifest:
+        return json.load(manifest)["chunks"]
+
+
+class ChunkWriter:
+    """
+    Runs on the executors: writes the (document id, source JSON) pairs of one partition as
+    gzip-compressed _bulk NDJSON files of at most max_bytes uncompressed bytes each (a single
+    larger document gets a chunk of its own). Files are named after the partition and chunk
+    number and renamed into place once complete, so a retried task overwrites its own chunks.
+    """
+
+    def __init__(
+        self,
+        directory,
+        index_name,
+        max_bytes=BulkExportConfig.MAX_CHUNK_BYTES,
+        compression_level=BulkExportConfig.COMPRESSION_LEVEL,
+    ):
+        self.directory = directory
+        self.index_name = index_name
+        self.max_bytes = max_bytes
+        self.compression_level = compression_level
+
+    def chunk_name(self, partition_id, chunk_number):
+        return f"part-{partition_id:05d}-{chunk_number:05d}{CHUNK_SUFFIX}"
+
+    def chunks(self, documents):
+        """(chunk number, NDJSON lines, documents, uncompressed bytes) of the chunks of one partition."""
+        lines, count, size, chunk_number = [], 0, 0, 0
+        for document_id, source in documents:
+            pair = (action_line(self.index_name, document_id) + "\n" + source + "\n").encode("utf-8")
+            if lines and size + len(pair) > self.max_bytes:
+                yield chunk_number, lines, count, size
+                lines, count, size, chunk_number = [], 0, 0, chunk_number + 1
+            lines.append(pair)
+            count += 1
+            size += len(pair)
+        if lines:
+            yield chunk_number, lines, count, size
+
+    def _flush(self, partition_id, chunk_number, lines, documents, size):
+        path = os.path.join(self.directory, self.chunk_name(partition_id, chunk_number))
+        with gzip.open(path + ".tmp", "wb", compresslevel=self.compression_level) as chunk:
+            chunk.writelines(lines)
+        os.replace(path + ".tmp", path)
+        return {
+            "path": path,
+            "documents": documents,
+            "bytes": size,
+            "compressed_bytes": os.path.getsize(path),
+        }
+
+    def write_partition(self, partition_id, documents):
+        for chunk_number, lines, count, size in self.chunks(documents):
+            yield self._flush(partition_id, chunk_number, lines, count, size)
+
+    def send_partition(self, partition_id, documents, sender):
+        """
+        Streams the partition's chunks to the bulk endpoint instead of writing them: every chunk is
+        compressed in memory and posted by the task that built it (see BulkSender.send_body), so no
+        directory has to be shared with the driver. A chunk that could not be delivered is returned
+        with its error rather than failing the task, like BulkSender.send does.
+        """
+        for chunk_number, lines, count, size in self.chunks(documents):
+            body = gzip.compress(b"".join(lines), compresslevel=self.compression_level)
+            chunk = {
+                "path": self.chunk_name(partition_id, chunk_number),
+                "documents": count,
+                "bytes": size,
+                "compressed_bytes": len(body),
+            }
+            try:
+                yield sender.send_body(chunk, body)
+            except BulkExportError as error:
+                yield {**chunk, "error": str(error)}
+
+
+class BulkSender:
+    """
+    Posts gzip chunks to <endpoint>/_bulk from a bounded thread pool: at most concurrency
+    requests are in flight and a chunk is only read from disk when a slot frees up, so a
+    slow cluster holds back the sender instead of filling memory. Rejected requests (429 and
+    gateway errors, or a response whose items were rejected with 429) are retried with
+    exponential backoff, honouring Retry-After. Resending a whole chunk is safe because the
+    documents carry deterministic ids. Documents failing for any other reason (mapping errors)
+    are counted and logged, not retried; a success status whose body is not a _bulk response
+    fails the chunk.
+    """
+
+    def __init__(
+        self,
+        endpoint,
+        concurrency=BulkExportConfig.CONCURRENCY,
+        max_retries=BulkExportConfig.MAX_RETRIES,
+        backoff=BulkExportConfig.RETRY_BACKOFF,
+        timeout=BulkExportConfig.TIMEOUT,
+    ):
+        self.url = f"{endpoint.rstrip('/')}/_bulk?filter_path={BULK_RESPONSE_FILTER}"
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def _post(self, body):
+        """Returns (status, parsed response or None, Retry-After seconds or None)."""
+        request = urllib.request.Request(
+            self.url,
+            data=body,
+            method="POST",
+            headers={"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                content = response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            retry_after = error.headers.get("Retry-After") if error.headers else None
+            return error.code, None, float(retry_after) if retry_after and retry_after.isdigit() else None
+        except OSError:
+            # Connection refused or reset, timeouts: treated like an overloaded cluster
+            return 503, None, None
+        try:
+            payload = json.loads(content)
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            # A success status without an Elasticsearch response (e.g. a proxy's page): the documents' fate is unknown
+            raise BulkExportError(f"HTTP {status} response is not a _bulk response: {content[:200]!r}")
+        return status, payload, None
+
+    def send_chunk(self, chunk):
+        with open(chunk["path"], "rb") as source:
+            body = source.read()
+        return self.send_body(chunk, body)
+
+    def send_body(self, chunk, body):
+        """Posts one gzip _bulk body (of the chunk described by chunk), retrying rejections; returns the chunk's result."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                status, payload, retry_after = self._post(body)
+            except BulkExportError as error:
+                raise BulkExportError(f"{chunk['path']}: {error}") from None
+            if status < 300:
+                items = [next(iter(item.values())) for item in payload.get("items", [])]
+                if any(item.get("status") == 429 for item in items):
+                    status = 429
+                else:
+                    failed = [item for item in items if item.get("status", 200) >= 300]
+                    if failed:
+                        logger.warning(
+                            "%s: %d documents rejected, e.g. %s",
+                            chunk["path"], len(failed), failed[0].get("error"),
+                        )
+                    return {**chunk, "attempts": attempt + 1, "failed_documents": len(failed)}
+            if status not in RETRY_STATUSES:
+                break
+            if attempt < self.max_retries:
+                time.sleep(retry_after if retry_after is not None else self.backoff * 2 ** attempt)
+        raise BulkExportError(f"{chunk['path']}: bulk request failed with HTTP {status}")
+
+    def send(self, chunks) -> dict:
+        """Sends every chunk; raises BulkExportError after the others are sent if any chunk failed."""
+        pending = iter(chunks)
+        results, errors = [], []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            running = set()
+            while True:
+                while len(running) < self.concurrency:
+                    chunk = next(pending, None)
+                    if chunk is None:
+                        break
+                    running.add(pool.submit(self.send_chunk, chunk))
+                if not running:
+                    break
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        results.append(future.result())
+                    except BulkExportError as error:
+                        errors.append(str(error))
+        return self.summary(results, errors)
+
+    @staticmethod
+    def summary(results, errors=()) -> dict:
+        """Totals of the sent chunks' results; raises BulkExportError if any chunk failed (errors, or results with an error)."""
+        errors = list(errors) + [result["error"] for result in results if "error" in result]
+        results = [result for result in results if "error" not in result]
+        if errors:
+            raise BulkExportError(f"{len(errors)} of {len(errors) + len(results)} chunks failed: {errors[0]}")
+        return {
+            "chunks": len(results),
+            "documents": sum(result["documents"] for result in results),
+            "failed_documents": sum(result["failed_documents"] for result in results),
+            "retries": sum(result["attempts"] - 1 for result in results),
+        }
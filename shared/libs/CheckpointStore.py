@@ -0,0 +1,96 @@
+import json
+
+from config.DBConfig import S3Config
+from config.TablesConfig import CheckpointConfig
+from pyspark.sql import Column, DataFrame
+from Spark.HadoopFS import HadoopFileSystem, configure_s3a
+
+MANIFEST_NAME = "_manifest.json"
+
+
+class CheckpointStore:
+    """
+    Keeps the output of every pipeline stage of a table as Parquet, with a manifest of the
+    stages completed so far and the version of the source table they were computed from. A
+    failed run leaves its checkpoints behind, so the next run resumes after the last completed
+    stage instead of starting from the raw table, unless the source has changed since.
+    Checkpoints of a table are removed once its final result has been written.
+
+    Layout below root_path: <key>/<stage>/ (Parquet) and <key>/_manifest.json.
+    """
+
+    def __init__(self, spark, root_path=CheckpointConfig.ROOT_PATH):
+        if root_path.startswith("s3a://"):
+            configure_s3a(spark, S3Config.HOST, S3Config.PORT, S3Config.USER, S3Config.PASSWORD)
+        self.spark = spark
+        self.fs = HadoopFileSystem(spark, root_path)
+
+    def _manifest_path(self, key):
+        return self.fs.join(key, MANIFEST_NAME)
+
+    def _read_manifest(self, key):
+        if not self.fs.exists(self._manifest_path(key)):
+            return None
+        return json.loads(self.fs.read_text(self._manifest_path(key)))
+
+    def _write_manifest(self, key, manifest):
+        path = self._manifest_path(key)
+        self.fs.write_text(path + ".tmp", json.dumps(manifest))
+        self.fs.delete(path)
+        self.fs.rename(path + ".tmp", path)
+
+    def completed_stages(self, key, stage_names, source_version=None):
+        """
+        Returns the completed stages of key, in order. Checkpoints written for a different
+        list of stages are discarded, since they cannot be resumed by this pipeline, and so are
+        checkpoints of another source_version (or when it is None, as the source cannot be told
+        apart from a reloaded one).
+        """
+        manifest = self._read_manifest(key)
+        if manifest is None:
+            return []
+        if (
+            manifest["stages"] != list(stage_names)
+            or source_version is None
+            or manifest.get("source_version") != source_version
+        ):
+            self.clear(key)
+            return []
+        return manifest["completed"]
+
+    def save(
+        self, df: DataFrame, key, stage, stage_names, partition_by: Column = None, source_version=None
+    ) -> DataFrame:
+        """
+        Writes a stage's output and marks the stage completed. Returns the checkpoint read back,
+        so the next stage starts from Parquet instead of recomputing the plan.
+        """
+        stage_path = self.fs.join(key, stage)
+        temp_path = stage_path + ".tmp"
+        writer = df
+        if partition_by is not None:
+            writer = df.withColumn(CheckpointConfig.PARTITION_COLUMN, partition_by)
+        writer = writer.write.mode("overwrite")
+        if partition_by is not None:
+            writer = writer.partitionBy(CheckpointConfig.PARTITION_COLUMN)
+        writer.parquet(temp_path)
+
+        # A stage only counts as completed once its files are complete under the final path
+        self.fs.delete(stage_path)
+        self.fs.rename(temp_path, stage_path)
+        completed = self.completed_stages(key, stage_names, source_version)
+        self._write_manifest(
+            key,
+            {"stages": list(stage_names), "source_version": source_version, "completed": completed + [stage]},
+        )
+        return self.load(key, stage)
+
+    def load(self, key, stage) -> DataFrame:
+        df = self.spark.read.parquet(self.fs.join(key, stage))
+        if CheckpointConfig.PARTITION_COLUMN in df.columns:
+            df = df.drop(CheckpointConfig.PARTITION_COLUMN)
+        return df
+
+    def clear(self, key):
+        """Removes all checkpoints of key."""
+        self.fs.delete(self.fs.join(key))
@@ -1,18 +1,39 @@
+from contextlib import closing
+from functools import partial
 from typing import Literal
 
 from config.DataTypes.CR import CostaRicaTypes
+from config.TablesConfig import (
+    ApproxChecksConfig,
+    BulkExportConfig,
+    CheckpointConfig,
+    DedupeConfig,
+    MonthPartitionConfig,
+    RecordIdConfig,
+    SmallTableConfig,
+)
+from pyspark.sql.functions import col, count, date_format, lit
+from pyspark.sql.functions import max as max_
 from Spark import Spark4DataProc
+from Spark.CheckpointStore import CheckpointStore
+from Spark.PostgresCopy import quote_identifier
+from Spark.FileIngest import FileIngestor, raw_column_types
+from Spark.PandasBackend import PandasBackend, UnsupportedByPandas
+from Spark.ShipmentDedupe import ShipmentKeyIndex
+
+WATERMARK_ALIAS = "__watermark"
 
 
 class CostaRica(Spark4DataProc):
 
-    def __init__(self, table_name, appName="CostaRicaDataProcessing"):
+    def __init__(self, table_name, appName="CostaRicaDataProcessing", **session_kwargs):
 
         super().__init__(
             f"{CostaRicaTypes.HOST}:{CostaRicaTypes.PORT}",
             CostaRicaTypes.USER,
             CostaRicaTypes.PASSWORD,
             appName,
+            **session_kwargs,
         )
         self.database = CostaRicaTypes.DATABASE
         if table_name:
@@ -50,104 +71,461 @@ class CostaRica(Spark4DataProc):
         df = self.add_columns_by_type(df)
         return self.reorder_and_maintain_columns(df)
 
-    def update_columns(self):
-        """Güncelleme işlemlerini yönetir, sütun isimlerini ve yeni sütunları ekler."""
-        cr_df = self.read_table(self.country_code + "." + self.table, self.database)
+    @property
+    def raw_table(self):
+        """Ham (işlenmemiş) tablonun şema ile birlikte tam adı."""
+        return self.country_code + "." + self.table
+
+    @property
+    def processed_table(self):
+        """İşlenmiş tablonun şema ile birlikte tam adı."""
+        return self.raw_table + "_islendi"
+
+    @property
+    def checks_table(self):
+        """Veri kontrol sonuçlarının yazıldığı tablonun tam adı."""
+        return self.raw_table + "_checks"
+
+    def ingest_file(self, path, sheet_name=None, source_table=None, replace=False):
+        """
+        Gelen ham dosyayı (CSV, Excel, Access) parça parça okuyup sütun tiplerine dönüştürerek bu
+        tablonun adıyla ham şemaya yükler ve DAG'ın işlemesi için kaydeder. Tarih ve sayı biçimleri
+        CostaRicaTypes.INGEST_* ayarlarından alınır. Spark kullanılmaz.
+        """
+        ingestor = FileIngestor(
+            self,
+            self.country_code,
+            self.database,
+            raw_column_types(
+                [CostaRicaTypes.IMPORT_CHANGE_COLUMN_NAMES, CostaRicaTypes.EXPORT_CHANGE_COLUMN_NAMES]
+            ),
+            date_format=CostaRicaTypes.INGEST_DATE_FORMAT,
+            dayfirst=CostaRicaTypes.INGEST_DAYFIRST,
+            decimal_separator=CostaRicaTypes.INGEST_DECIMAL_SEPARATOR,
+        )
+        return ingestor.ingest(
+            path, self.table, sheet_name=sheet_name, source_table=source_table, replace=replace
+        )
+
+    def transform_columns(self, df, ops=None):
+        """Sütun isimlerini değiştirir, yeni sütunları ekler ve sıralar."""
+        ops = ops or self
         data_type = self.determine_data_type(self.table)
         column_details = self.get_column_details(data_type)
 
-        cr_df = self.rename_columns(cr_df, column_details["rename"])
-        cr_df = self.add_columns(cr_df, column_details["add"])
-        cr_df = self.finalize_dataframe(cr_df)
+        record_key = None
+        if RecordIdConfig.MODE == "content_hash":
+            record_key = (self.table, CostaRicaTypes.KEY_COLUMNS)
+        return ops.apply_column_specs(
+            df, rename=column_details["rename"], add=column_details["add"], record_key=record_key
+        )
+
+    def processed_write_mode(self):
+        """
+        İşlenmiş tabloya yazma kipi ve anahtarı. İçerik hash'li RECORD_ID ile yalnızca değişen
+        satırlara dokunan birleştirme (merge) önceliklidir: aylık bölümlere (partition) ayrılmış
+        tabloda her ay kendi bölümüne birleştirilir, tablo henüz bölümlü değilse aylar hazırlanıp
+        ATTACH PARTITION ile eklenir. RECORD_ID rastgeleyse aylar her seferinde değiştirilir,
+        bölümleme kapalıysa tablo tamamen yeniden yazılır.
+        """
+        if RecordIdConfig.MODE == "content_hash":
+            mode = "partition_merge" if MonthPartitionConfig.ENABLED else "merge"
+            return {"mode": mode, "key_columns": [RecordIdConfig.KEY_COLUMN]}
+        if MonthPartitionConfig.ENABLED:
+            return {"mode": "partition_swap"}
+        return {"mode": "overwrite"}
 
-        self.write_table(
-            cr_df, self.country_code + "." + self.table+'_islendi', self.database, mode="overwrite"
+    @property
+    def shipment_key_index(self):
+        """Ülkenin daha önce işlenmiş satırlarının anahtar indeksi (tekrarlanan satırları bulmak için)."""
+        return ShipmentKeyIndex(self, self.country_code, self.database)
+
+    def transform_dedupe(self, df, ops=None):
+        """Başka bir ham tablodan zaten işlenmiş satırları (DedupeConfig.MODE'a göre) atar veya işaretler."""
+        return (ops or self).dedupe_shipments(
+            df, self.shipment_key_index, self.table, CostaRicaTypes.KEY_COLUMNS
         )
 
-    def update_ta_codes(self):
-        cr_df = self.read_table(
-            table_name=self.country_code + "." + self.table+'_islendi', database_name=self.database
+    def processed_key_sink(self):
+        """
+        Yazılan satırların anahtar hash'lerini ve RECORD_ID'lerini yazma sırasında toplayan KeySink;
+        tekrar kontrolü kapalıysa None.
+        """
+        if not DedupeConfig.ENABLED:
+            return None
+        return self.shipment_key_index.sink(self.table, CostaRicaTypes.KEY_COLUMNS, RecordIdConfig.KEY_COLUMN)
+
+    def record_processed_keys(self, key_sink):
+        """
+        Yazma sırasında toplanan satır anahtarlarını indekse ekler; sonraki tablolar bunları tekrar
+        olarak görür. Bu tablo işlenirken başka bir tablonun kaydettiği anahtarların satırları
+        _islendi tablosundan kısa bir kilitli işlemde atılır (veya işaretlenir); kilit tüm işleme
+        boyunca tutulmaz, tablolar paralel işlenir.
+        """
+        if key_sink is not None:
+            self.shipment_key_index.record_staged(self.table, self.processed_table, key_sink)
+
+    def transform_country(self, df, ops=None):
+        """Ülke ve liman sütunlarını günceller."""
+        return (ops or self).update_countries_and_ports(
+            df,
+            country_columns=("COUNTRY_OF_ORIGIN", "EXPORTER_COUNTRY", "IMPORTER_COUNTRY"),
+            port_columns=(
+                ("IMPORTER_COUNTRY", "PORT_OF_ARRIVAL"),
+                ("EXPORTER_COUNTRY", "PORT_OF_DEPARTURE"),
+            ),
         )
-        self.update_exporter_ta_code(cr_df)
-        self.update_importer_ta_code(cr_df)
-        self.write_table(
-            df=cr_df,
-            table_name=self.country_code + "." + self.table+'_islendi',
+
+    def transform_hs_code(self, df, ops=None):
+        """HS_CODE ve HS_CODE_DESCRIPTION sütunlarını günceller."""
+        return (ops or self).update_hs_code_description(df, self.country_code)
+
+    def transform_quantity(self, df, ops=None):
+        """Miktar ve birim sütunlarını günceller."""
+        return (ops or self).update_quantity_and_unit(df, self.country_code)
+
+    def transform_ta_codes(self, df, ops=None):
+        """İhracatçı ve ithalatçı TA kodlarını günceller."""
+        return (ops or self).update_exporter_and_importer_ta_codes(df)
+
+    def pipeline_stages(self, ops=None):
+        """
+        İşleme adımlarını çalışma sırasına göre (isim, fonksiyon) olarak döndürür.
+        ops verilirse (PandasBackend) adımlar Spark yerine onun işlemleriyle çalışır.
+        """
+        stages = [("columns", self.transform_columns)]
+        if DedupeConfig.ENABLED:
+            # Tekrarlanan satırlar zenginleştirme adımlarından önce elenir
+            stages.append(("dedupe", self.transform_dedupe))
+        stages += [
+            ("country", self.transform_country),
+            ("hs_code", self.transform_hs_code),
+            ("quantity", self.transform_quantity),
+            ("ta_codes", self.transform_ta_codes),
+        ]
+        return [(name, partial(transform, ops=ops)) for name, transform in stages]
+
+    def small_table_backend(self, table_name):
+        """Tablo SmallTableConfig.MAX_ROWS satırdan küçükse Spark'sız çalışan PandasBackend, değilse None."""
+        if not SmallTableConfig.ENABLED:
+            return None
+        rows = self._count_rows_up_to(table_name, self.database, SmallTableConfig.MAX_ROWS)
+        if rows > SmallTableConfig.MAX_ROWS:
+            return None
+        return PandasBackend(self)
+
+    def process_small_table(self, key_sink=None):
+        """
+        Küçük tabloları pandas ile işler. Tablo büyükse veya veri pandas ile Spark'la birebir
+        aynı şekilde işlenemiyorsa False döner ve işleme Spark ile yapılmalıdır.
+        """
+        backend = self.small_table_backend(self.raw_table)
+        if backend is None:
+            return False
+        try:
+            backend.process_table(
+                source_table=self.raw_table,
+                target_table=self.processed_table,
+                database_name=self.database,
+                steps=[step for _, step in self.pipeline_stages(ops=backend)],
+                key_sink=key_sink,
+                **self.processed_write_mode(),
+            )
+        except UnsupportedByPandas:
+            return False
+        return True
+
+    def process_fused(self):
+        """
+        Tüm adımları tek bir lazy plan olarak zincirler: ham tablo bir kez okunur,
+        sonuç _islendi tablosuna bir kez yazılır. Küçük tablolar Spark başlatılmadan pandas ile işlenir.
+        """
+        watermark = self.current_watermark()
+        key_sink = self.processed_key_sink()
+        if not self.process_small_table(key_sink):
+            steps = [step for _, step in self.pipeline_stages()]
+            self.process_table(
+                source_table=self.raw_table,
+                target_table=self.processed_table,
+                database_name=self.database,
+                steps=steps,
+                key_sink=key_sink,
+                **self.processed_write_mode(),
+            )
+        self.record_processed_keys(key_sink)
+        # Sonraki artımlı çalıştırmalar yalnızca bu noktadan sonra gelen satırları işler
+        if watermark is not None:
+            self.set_watermark(watermark)
+
+    def use_checkpoints(self):
+        """Ham tablo diskte CheckpointConfig.MIN_BYTES veya daha büyükse True döner."""
+        if CheckpointConfig.MIN_BYTES is None:
+            return False
+        with closing(self._pg_connection(self.database)) as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT coalesce(pg_total_relation_size(to_regclass(%s)), 0)", (self.raw_table,))
+            return cursor.fetchone()[0] >= CheckpointConfig.MIN_BYTES
+
+    def process_resumable(self, checkpoints=None):
+        """
+        process_fused ile aynı sonucu üretir, ancak her adımın çıktısını Parquet checkpoint olarak
+        saklar. Hata sonrası yeniden çalıştırma son tamamlanan adımdan devam eder; Postgres'e
+        yalnızca nihai sonuç yazılır.
+        """
+        if self.small_table_backend(self.raw_table) is not None:
+            # Küçük tablolar saniyeler içinde işlenir; checkpoint gerekmez
+            return self.process_fused()
+        watermark = self.current_watermark()
+        key_sink = self.processed_key_sink()
+        self.process_table_resumable(
+            source_table=self.raw_table,
+            target_table=self.processed_table,
             database_name=self.database,
-            mode="overwrite",
+            stages=self.pipeline_stages(),
+            checkpoints=checkpoints or CheckpointStore(self.spark),
+            **self.processed_write_mode(),
+            partition_by=date_format(col("ARRIVAL_DATE"), "yyyy-MM"),
+            key_sink=key_sink,
         )
+        self.record_processed_keys(key_sink)
+        if watermark is not None:
+            self.set_watermark(watermark)
 
-    def update_country(self):
-        cr_df = self.read_table(
-            table_name=self.country_code + "." + self.table+'_islendi', database_name=self.database
-        )
-        cr_df = self.update_country_of_origin(cr_df)
-        cr_df = self.update_exporter_country(cr_df)
-        cr_df = self.update_importer_country(cr_df)
-        cr_df = self.update_port_of_arrival(cr_df)
-        cr_df = self.update_port_of_departure(cr_df)
-        self.write_table(
-            df=cr_df,
-            table_name=self.country_code + "." + self.table+'_islendi',
+    @property
+    def watermark_table(self):
+        """Artımlı işleme için tablo bazlı high-water mark tablosu."""
+        return self.country_code + "." + CostaRicaTypes.WATERMARK_TABLE
+
+    def get_watermark(self):
+        """Tablonun son işlenen high-water mark değerini döndürür, yoksa None."""
+        with closing(self._pg_connection(self.database)) as conn:
+            with conn, conn.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {self.watermark_table} (
+                        table_name text PRIMARY KEY,
+                        watermark text NOT NULL,
+                        updated_at timestamptz NOT NULL DEFAULT now()
+                    )
+                    """
+                )
+                cursor.execute(
+                    f"SELECT watermark FROM {self.watermark_table} WHERE table_name = %s",
+                    (self.table,),
+                )
+                row = cursor.fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, watermark):
+        """Tablonun high-water mark değerini kaydeder."""
+        with closing(self._pg_connection(self.database)) as conn:
+            with conn, conn.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    INSERT INTO {self.watermark_table} (table_name, watermark)
+                    VALUES (%s, %s)
+                    ON CONFLICT (table_name)
+                    DO UPDATE SET watermark = EXCLUDED.watermark, updated_at = now()
+                    """,
+                    (self.table, str(watermark)),
+                )
+
+    def watermark_expression(self):
+        """
+        High-water mark olarak kullanılan SQL ifadesi: ayarlı sütun veya satırın commit zamanı.
+        xmin'in kendisi kullanılmaz; 32 bitlik değer sarmalandığında (wraparound) küçülür.
+        """
+        if CostaRicaTypes.WATERMARK_COLUMN:
+            return f't."{CostaRicaTypes.WATERMARK_COLUMN}"'
+        return "pg_xact_commit_timestamp(t.xmin)"
+
+    def require_commit_timestamps(self, cursor):
+        """Commit zamanı modunda sunucunun commit zamanlarını tuttuğunu doğrular."""
+        cursor.execute("SHOW track_commit_timestamp")
+        if cursor.fetchone()[0] != "on":
+            raise RuntimeError(
+                "Incremental processing needs track_commit_timestamp = on, or CostaRicaTypes.WATERMARK_COLUMN"
+            )
+
+    def current_watermark(self):
+        """
+        Okumadan önce alınan güvenli high-water mark. Commit zamanı modunda şu anki zamandır: daha
+        sonra commit edilen satırların zamanı bundan büyüktür ve bir sonraki çalıştırmada okunur.
+        """
+        with closing(self._pg_connection(self.database)) as conn, conn.cursor() as cursor:
+            if CostaRicaTypes.WATERMARK_COLUMN:
+                cursor.execute(
+                    f'SELECT max("{CostaRicaTypes.WATERMARK_COLUMN}") FROM {self.raw_table}'
+                )
+            else:
+                self.require_commit_timestamps(cursor)
+                cursor.execute("SELECT now()")
+            return cursor.fetchone()[0]
+
+    def raw_key_columns(self):
+        """CostaRicaTypes.KEY_COLUMNS sütunlarının ham tablodaki isimleri."""
+        rename = self.get_column_details(self.determine_data_type(self.table))["rename"]
+        return [raw for key in CostaRicaTypes.KEY_COLUMNS for raw, name in rename.items() if name == key]
+
+    def read_delta(self, watermark):
+        """
+        Ham tablodan yalnızca high-water mark sonrası gelen satırları, ve aynı anahtarı taşıyan daha
+        önceki satırları okur: aynı anahtarlı satırların sıra numaraları (dolayısıyla RECORD_ID'leri)
+        tam işlemedeki gibi anahtarın tüm satırları üzerinden hesaplanır. Commit zamanı modunda
+        CostaRicaTypes.WATERMARK_OVERLAP kadar geriden başlanır (commit anı ile görünür olma anı
+        arasındaki fark için); tekrar okunan satırların upsert'i bir şey değiştirmez.
+        """
+        mark = self.watermark_expression()
+        condition = None
+        if watermark is not None and CostaRicaTypes.WATERMARK_COLUMN:
+            condition = "{} > '{}'".format(mark, str(watermark).replace("'", "''"))
+        elif watermark is not None and not str(watermark).isdigit():
+            # Sadece rakamlardan oluşan değer eski xmin modundan kalmıştır: tablo baştan okunur
+            condition = "{} > timestamptz '{}' - interval '{}'".format(
+                mark, str(watermark).replace("'", "''"), CostaRicaTypes.WATERMARK_OVERLAP
+            )
+        where = ""
+        if condition is not None:
+            where = f"WHERE {condition}"
+            keys = self.raw_key_columns()
+            if keys:
+                # Boş anahtar değerleri de eşleşsin diye metin olarak, NULL yerine işaretle karşılaştırılır
+                key_tuple = ", ".join(f"coalesce(t.{quote_identifier(key)}::text, '\\N')" for key in keys)
+                where += (
+                    f" OR ({key_tuple}) IN (SELECT {key_tuple} FROM {self.raw_table} t WHERE {condition})"
+                )
+        query = f"(SELECT t.*, {mark} AS {WATERMARK_ALIAS} FROM {self.raw_table} t {where}) AS delta"
+        return self.read_table(query, self.database)
+
+    def process_incremental(self):
+        """
+        Son çalıştırmadan bu yana ham tabloya eklenen satırları (ve aynı anahtarlı önceki satırları,
+        bkz. read_delta) tüm adımlardan geçirir ve _islendi tablosuna RECORD_ID üzerinden upsert
+        eder: anahtarı tekrarlanan satırlar birbirinin yerine yazılmaz, boş anahtarlı satırlar da
+        yazılır. İşlenen satır sayısını döndürür.
+        """
+        if RecordIdConfig.MODE != "content_hash":
+            raise ValueError("Incremental processing upserts on RECORD_ID and needs RecordIdConfig.MODE = 'content_hash'")
+        safe_mark = None if CostaRicaTypes.WATERMARK_COLUMN else self.current_watermark()
+        delta = self.read_delta(self.get_watermark()).cache()
+        try:
+            summary = delta.agg(
+                max_(WATERMARK_ALIAS).alias("mark"), count(lit(1)).alias("rows")
+            ).first()
+            if not summary["rows"]:
+                return 0
+            # Commit zamanı modunda okumadan önce alınan zaman; okunan satırların hepsi ondan önce commit edilmiştir
+            new_mark = safe_mark if safe_mark is not None else summary["mark"]
+
+            df = self.run_pipeline(
+                delta.drop(WATERMARK_ALIAS), [step for _, step in self.pipeline_stages()]
+            )
+            # Tekrar olarak atılan satırların anahtarları zaten indekste; yazılanlarınki yeterlidir
+            key_sink = self.processed_key_sink()
+            self.write_table(
+                df,
+                self.processed_table,
+                self.database,
+                mode="upsert",
+                key_columns=[RecordIdConfig.KEY_COLUMN],
+                key_sink=key_sink,
+            )
+            self.record_processed_keys(key_sink)
+            self.set_watermark(new_mark)
+            return summary["rows"]
+        finally:
+            delta.unpersist()
+
+    def run_stage(self, transform, source_table=None):
+        """Tek bir adımı çalıştırır: tabloyu okur, dönüştürür ve _islendi tablosuna yazar."""
+        self.process_table(
+            source_table=source_table or self.processed_table,
+            target_table=self.processed_table,
             database_name=self.database,
-            mode="overwrite",
+            steps=[transform],
+            **self.processed_write_mode(),
         )
 
-    def update_hs_code(self):
-        cr_df = self.read_table(
-            table_name=self.country_code + "." + self.table+'_islendi', database_name=self.database
-        )
-        cr_df = self.update_hs_code_description(cr_df, "CR")
-        self.write_table(
-            df=cr_df,
-            table_name=self.country_code + "." + self.table+'_islendi',
-            database_name=self.database,
-            mode="overwrite",
+    def export_to_elasticsearch(self, endpoint=BulkExportConfig.ENDPOINT):
+        """
+        İşlenmiş tabloyu Elasticsearch _bulk formatında sıkıştırılmış NDJSON parçalarına yazar;
+        endpoint verilmişse parçaları eşzamanlı olarak gönderir (BulkExportConfig.STREAM açıksa parçalar
+        diske yazılmadan executor'lardan doğrudan gönderilir). Belge kimliği RECORD_ID'dir.
+        """
+        return self.export_bulk_ndjson(
+            self.read_table(self.processed_table, self.database),
+            BulkExportConfig.INDEX.format(country_code=self.country_code.lower()),
+            endpoint=endpoint,
+            directory_name=self.table,
         )
-        pass
+
+    def update_columns(self):
+        """Güncelleme işlemlerini yönetir, sütun isimlerini ve yeni sütunları ekler."""
+        self.run_stage(self.transform_columns, source_table=self.raw_table)
+
+    def dedupe(self):
+        self.run_stage(self.transform_dedupe)
+
+    def update_ta_codes(self):
+        self.run_stage(self.transform_ta_codes)
+
+    def update_country(self):
+        self.run_stage(self.transform_country)
+
+    def update_hs_code(self):
+        self.run_stage(self.transform_hs_code)
 
     def update_quantity(self):
-        cr_df = self.read_table(
-            table_name=self.country_code + "." + self.table+'_islendi', database_name=self.database
-        )
-        cr_df = self.update_quantity_and_unit(cr_df, "CR")
-        self.write_table(
-            df=cr_df,
-            table_name=self.country_code + "." + self.table+'_islendi',
-            database_name=self.database,
-            mode="overwrite",
-        )
+        self.run_stage(self.transform_quantity)
+
+    def use_approximate_checks(self):
+        """İşlenmiş tablo ApproxChecksConfig.MIN_ROWS satırdan büyükse (planlayıcı tahmini) True döner."""
+        if not ApproxChecksConfig.ENABLED:
+            return False
+        rows = self._estimated_row_count(self.processed_table, self.database)
+        return rows is not None and rows > ApproxChecksConfig.MIN_ROWS
 
-    def comprehensive_checks(self):
-        cr_df = self.read_table(
-            table_name=self.country_code + "." + self.table, database_name=self.database
+    def comprehensive_checks(self, df=None, persist=True, approximate=None):
+        """
+        Veri bütünlüğünü tek bir tarama ile kapsamlı bir şekilde kontrol eder.
+        Sonuçlar tabloya özel kontrol tablosuna yazılır. Küçük tablolar pandas ile kontrol edilir.
+        approximate True ise sayımlar örneklemden güven aralıklarıyla tahmin edilir; None ise
+        bu karar tablonun büyüklüğüne göre verilir (use_approximate_checks).
+        """
+        ops = self
+        sampler = None
+        if df is None:
+            ops = self.small_table_backend(self.processed_table) or self
+            df = ops.read_table(
+                table_name=self.processed_table, database_name=self.database
+            )
+            if approximate is None:
+                approximate = ops is self and self.use_approximate_checks()
+            if approximate and ops is self:
+                # Örneklem Postgres'te TABLESAMPLE ile çekilir, tablonun tamamı okunmaz
+                def sampler(fraction):
+                    return self.read_table_sample(
+                        self.processed_table, self.database, fraction, seed=ApproxChecksConfig.SEED
+                    )
+        checks = ops.run_comprehensive_checks(
+            df,
+            null_columns=[
+                "PORT_OF_ARRIVAL",
+                "PORT_OF_DEPARTURE",
+                "HS_CODE",
+                "HS_CODE_DESCRIPTION",
+                "ARRIVAL_DATE",
+                "IMPORTER_TA_CODE",
+                "EXPORTER_TA_CODE",
+                "QUANTITY",
+                "QUANTITY_UNIT",
+                "COUNTRY_OF_ORIGIN",
+            ],
+            country_column="COUNTRY_OF_ORIGIN",
+            ta_columns=["IMPORTER_TA_CODE", "EXPORTER_TA_CODE"],
+            country_code=self.country_code,
+            approximate=bool(approximate),
+            sampler=sampler,
         )
-        """Veri bütünlüğünü kapsamlı bir şekilde kontrol eder."""
-        checks = {
-            "null_checks": self.check_null_columns(
-                cr_df,
-                [
-                    "PORT_OF_ARRIVAL",
-                    "PORT_OF_DEPARTURE",
-                    "HS_CODE",
-                    "HS_CODE_DESCRIPTION",
-                    "ARRIVAL_DATE",
-                    "IMPORTER_TA_CODE",
-                    "EXPORTER_TA_CODE",
-                    "QUANTITY",
-                    "QUANTITY_UNIT",
-                    "COUNTRY_OF_ORIGIN",
-                ],
-            ),
-            "invalid_country_codes": self.check_missing_country(
-                cr_df, "COUNTRY_OF_ORIGIN"
-            ).collect(),
-            "hs_code_integrity": self.check_hs_code_integrity(cr_df),
-            "ta_code_issues": self.check_ta_codes(
-                cr_df, ["IMPORTER_TA_CODE", "EXPORTER_TA_CODE"]
-            ),
-            "quantity_integrity": self.check_quantity_integrity(
-                cr_df, self.country_code
-            ),
-        }
+        if persist:
+            self.write_check_results(checks, self.checks_table, self.database)
         return checks
@@ -0,0 +1,30 @@
+from config.CountryCodeConfig import CountryCodes
+
+
+def config_country_maps():
+    """
+    (country name -> ISO-2 code, ISO-2 code -> country name) compiled from CountryCodeConfig.
+    Names are matched as written and upper-cased, the two spellings found in the raw files.
+    """
+    names_to_codes = {}
+    for code, name in CountryCodes.COUNTRY_CODES_WITH_NAME.items():
+        names_to_codes.setdefault(name, code)
+        names_to_codes.setdefault(name.upper(), code)
+    return names_to_codes, dict(CountryCodes.COUNTRY_CODES_WITH_NAME)
+
+
+def table_country_maps(country_rows, port_rows):
+    """
+    The same maps built from the rows of the CountryCode (country2, code) and Country_Code_Uniq
+    ("Alpha-2 code", "English short name (upper/lower case)") tables. Rows with a null key or
+    value never change a value and are skipped; for a duplicated key the first row wins.
+    """
+    names_to_codes = {}
+    for name, code in country_rows:
+        if name is not None and code is not None:
+            names_to_codes.setdefault(name, code)
+    codes_to_names = {}
+    for code, name in port_rows:
+        if code is not None and name is not None:
+            codes_to_names.setdefault(code, name)
+    return names_to_codes, codes_to_names
@@ -0,0 +1,80 @@
+LOOKUP_POLICIES = (
+    "prefer_lookup",  # the lookup value where the key matched, else the current value
+    "keep_existing",  # the current value unless it is null, then the lookup value
+    "replace",  # the lookup value, null where the key did not match
+    "multiply",  # the current value times the lookup value where the key matched
+)
+
+
+def lookup(table_name, database_name, keys, outputs):
+    """
+    Declares one lookup of enrich():
+        keys: {data column: lookup column} equi-join keys,
+        outputs: {data column: (lookup column, policy)}, policy one of LOOKUP_POLICIES.
+    Output columns missing from the data are appended (their current value being null).
+    Lookup keys are expected to be unique, as for the hand-written joins.
+    """
+    if not keys:
+        raise ValueError(f"Lookup on {database_name}.{table_name} has no key columns")
+    for column_name, (_, policy) in outputs.items():
+        if policy not in LOOKUP_POLICIES:
+            raise ValueError(f"Unknown lookup policy {policy!r} for {column_name}")
+    return {
+        "table_name": table_name,
+        "database_name": database_name,
+        "keys": dict(keys),
+        "outputs": dict(outputs),
+    }
+
+
+def plan_lookups(columns, lookups):
+    """
+    Turns a list of lookups into the operations both backends run in order:
+        ("join", alias, table_name, database_name, [(data column, lookup column)], [lookup columns])
+        ("set", data column, alias, lookup column, policy)
+    Lookups on the same table with the same keys share one join, unless one of the key columns is
+    written in between (a later lookup must see the updated key). Each join only carries the
+    lookup columns some output needs. "set" operations keep the order of the lookups, so a
+    column written by several lookups ends up as if they had run one after the other.
+    """
+    present = set(columns)
+    joins = {}
+    open_joins = {}
+    operations = []
+    for lookup_spec in lookups:
+        missing = [column for column in lookup_spec["keys"] if column not in present]
+        if missing:
+            raise ValueError(
+                f"Lookup on {lookup_spec['database_name']}.{lookup_spec['table_name']} "
+                f"needs missing columns {missing}"
+            )
+        signature = (
+            lookup_spec["database_name"],
+            lookup_spec["table_name"],
+            tuple(sorted(lookup_spec["keys"].items())),
+        )
+        alias = open_joins.get(signature)
+        if alias is None:
+            alias = f"lookup{len(joins)}"
+            joins[alias] = (
+                "join",
+                alias,
+                lookup_spec["table_name"],
+                lookup_spec["database_name"],
+                list(lookup_spec["keys"].items()),
+                [],
+            )
+            open_joins[signature] = alias
+            operations.append(joins[alias])
+
+        needed = joins[alias][5]
+        for column_name, (lookup_column, policy) in lookup_spec["outputs"].items():
+            if lookup_column not in needed:
+                needed.append(lookup_column)
+            operations.append(("set", column_name, alias, lookup_column, policy))
+            present.add(column_name)
+            # Joins keyed on a column written here can no longer take further lookups
+            for other_signature, other_alias in list(open_joins.items()):
+                if any(column_name == key for key, _ in other_signature[2]):
+                    del open_joins[other_signature]
+    return operations
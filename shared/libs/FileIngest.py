@@ -0,0 +1,410 @@
+import json
+import logging
+import os
+import re
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import closing, contextmanager
+from itertools import chain, islice
+
+import pandas as pd
+from config.ShipmentFileConfig import ShipmentFileType
+from config.TablesConfig import IngestConfig, RecordIdConfig
+from Spark.PostgresCopy import copy_rows, quote_identifier
+
+logger = logging.getLogger(__name__)
+
+# Postgres type of a raw column, by the validation rules of the shipment column it is renamed to
+RULE_TYPES = {"date": "date", "float": "double precision"}
+CSV_EXTENSIONS = {".csv": None, ".txt": None, ".tsv": "\t"}
+EXCEL_EXTENSIONS = {".xlsx", ".xlsm"}
+ACCESS_EXTENSIONS = {".mdb", ".accdb"}
+# Dates as mdb-export is told to write them
+ACCESS_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Year-first dates are never day-first, whatever the country writes otherwise
+ISO_DATE_PATTERN = re.compile(r"^\d{4}-\d{1,2}-\d{1,2}")
+# Digit group separators other than the thousands separator: spaces, no-break spaces, apostrophes
+DIGIT_GROUPING_PATTERN = re.compile(r"[\s\u00a0\u202f']")
+
+
+def raw_column_types(renames, column_specs=ShipmentFileType.fields):
+    """{raw column name: Postgres type} for the raw names of the given rename mappings."""
+    types = {}
+    for rename in renames:
+        for raw_name, name in rename.items():
+            rules = column_specs.get(name, {}).get("validation_rules", [])
+            types.setdefault(raw_name, next((RULE_TYPES[rule] for rule in rules if rule in RULE_TYPES), "text"))
+    return types
+
+
+def clean_header(names):
+    """Strips header names and names blank ones (pandas' "Unnamed: n" included) after their position."""
+    cleaned = []
+    for position, name in enumerate(names):
+        name = "" if name is None else str(name).strip()
+        if not name or name.startswith("Unnamed: "):
+            name = f"column_{position}"
+        cleaned.append(name)
+    return cleaned
+
+
+def csv_chunks(path, chunk_rows, separator=IngestConfig.CSV_SEPARATOR, encoding=IngestConfig.CSV_ENCODING):
+    """DataFrames of at most chunk_rows rows of a CSV file (compressed files included), all values as text."""
+    reader = pd.read_csv(
+        path,
+        sep=separator,
+        encoding=encoding,
+        dtype=str,
+        keep_default_na=False,
+        na_values=[""],
+        chunksize=chunk_rows,
+    )
+    with reader:
+        for frame in reader:
+            frame.columns = clean_header(frame.columns)
+            yield frame
+
+
+def excel_chunks(path, chunk_rows, sheet_name=None):
+    """DataFrames of at most chunk_rows rows of an .xlsx sheet, read row by row in openpyxl's read-only mode."""
+    # Only needed for Excel files
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = clean_header(next(rows, ()))
+        first = True
+        while True:
+            batch = list(islice(rows, chunk_rows))
+            if not batch and not first:
+                break
+            first = False
+            # Rows can be longer than the header when cells right of it were ever formatted
+            yield pd.DataFrame([row[: len(header)] for row in batch], columns=header, dtype=object)
+    finally:
+        workbook.close()
+
+
+def access_tables(path):
+    output = subprocess.run(
+        [IngestConfig.MDB_TABLES, "-1", path], check=True, capture_output=True, text=True
+    ).stdout
+    return [name for name in output.splitlines() if name]
+
+
+def access_chunks(path, chunk_rows, table_name=None):
+    """DataFrames of at most chunk_rows rows of an Access table, streamed as CSV by mdb-export."""
+    table_name = table_name or access_tables(path)[0]
+    process = subprocess.Popen(
+        [IngestConfig.MDB_EXPORT, "-D", "%Y-%m-%d %H:%M:%S", path, table_name],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    try:
+        yield from csv_chunks(process.stdout, chunk_rows, separator=",", encoding="utf-8")
+    finally:
+        process.stdout.close()
+        error = process.stderr.read().decode("utf-8", "replace")
+        if process.wait() != 0:
+            raise RuntimeError(f"{IngestConfig.MDB_EXPORT} failed for {path} ({table_name}): {error.strip()}")
+
+
+def file_extension(path):
+    """Extension of a file, the inner one for .gz/.bz2/.zip/.xz compressed files."""
+    name = path.lower()
+    for suffix in (".gz", ".bz2", ".zip", ".xz"):
+        name = name.removesuffix(suffix)
+    return os.path.splitext(name)[1]
+
+
+def file_chunks(path, chunk_rows, sheet_name=None, source_table=None):
+    """Chunk reader by file extension (.gz/.zip compressed CSVs keep their inner extension)."""
+    extension = file_extension(path)
+    if extension in CSV_EXTENSIONS:
+        return csv_chunks(path, chunk_rows, separator=CSV_EXTENSIONS[extension] or IngestConfig.CSV_SEPARATOR)
+    if extension in EXCEL_EXTENSIONS:
+        return excel_chunks(path, chunk_rows, sheet_name)
+    if extension in ACCESS_EXTENSIONS:
+        return access_chunks(path, chunk_rows, source_table)
+    raise ValueError(f"Unsupported file type: {path}")
+
+
+def guess_date_format(values, dayfirst):
+    """
+    strftime format of a date column, guessed from its first text value (day first or not as the
+    country writes dates, except for year-first values); None if there is none or it is not a date.
+    """
+    text = values.dropna()
+    text = text[text.map(lambda value: isinstance(value, str) and value.strip() != "")]
+    if text.empty:
+        return None
+    value = text.iloc[0].strip()
+    return pd.tseries.api.guess_datetime_format(value, dayfirst=dayfirst and not ISO_DATE_PATTERN.match(value))
+
+
+def parse_number(value, decimal_separator):
+    """
+    A number written with digit grouping and the country's decimal separator: "1.234,5" and "12,5"
+    with ",", "1,234.5" with ".". A value using both separators, or one separator several times,
+    shows which one groups digits whatever the country's convention. None if it is not a number.
+    """
+    if not isinstance(value, str):
+        # Excel cells arrive typed: numbers convert, dates and times do not
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    text = DIGIT_GROUPING_PATTERN.sub("", value)
+    thousands_separator = "." if decimal_separator == "," else ","
+    if "," in text and "." in text:
+        decimal_separator = "," if text.rfind(",") > text.rfind(".") else "."
+        thousands_separator = "." if decimal_separator == "," else ","
+    elif text.count(decimal_separator) > 1:
+        decimal_separator, thousands_separator = thousands_separator, decimal_separator
+    try:
+        return float(text.replace(thousands_separator, "").replace(decimal_separator, "."))
+    except ValueError:
+        return None
+
+
+def coerce_chunk(frame, column_types, date_formats, decimal_separator):
+    """
+    Converts a chunk to its columns' types, dates with the file's date_formats ({column: strftime
+    format}) and numbers with the country's decimal_separator (see parse_number). Values that cannot
+    be converted become null; returns the rows (tuples, None for nulls) and the number of such
+    values per column.
+    """
+    columns = {}
+    errors = {}
+    for name in frame.columns:
+        values = frame[name]
+        column_type = column_types.get(name, "text")
+        if column_type == "date":
+            converted = pd.to_datetime(values, errors="coerce", format=date_formats.get(name)).dt.date
+        elif column_type == "double precision":
+            converted = pd.to_numeric(
+                values.map(lambda value: parse_number(value, decimal_separator), na_action="ignore"), errors="coerce"
+            )
+        else:
+            converted = values.where(values.isna(), values.astype(str))
+        failed = int((converted.isna() & values.notna()).sum())
+        if failed:
+            errors[name] = failed
+        columns[name] = converted
+    coerced = pd.DataFrame(columns).astype(object)
+    rows = coerced.where(coerced.notna(), None).itertuples(index=False, name=None)
+    return rows, errors
+
+
+def error_rates(frame, errors):
+    """Share of each column's non-null values that coerce_chunk could not convert."""
+    return {name: count / max(int(frame[name].notna().sum()), 1) for name, count in errors.items()}
+
+
+class FileIngestor:
+    """
+    Loads an incoming raw file into <country schema>.<table_name> with bounded memory: the file is
+    read in IngestConfig.CHUNK_ROWS-row chunks (pandas for CSV, openpyxl read-only for Excel,
+    mdb-export for Access), each chunk is coerced to the raw column types and copied with its own
+    COPY, IngestConfig.WORKERS chunks at a time. The table is built in the ingest schema, which
+    the DAG does not look at, and moved into the country schema in the same transaction that
+    registers the file, so the DAG never picks up a half-loaded table. Every line gets its
+    position in the file in RecordIdConfig.LINE_COLUMN, which orders lines repeating a key.
+
+    Dates are read with the country's date_format or, without one, with a format detected once per
+    file and column (day first as dayfirst says); files with date columns need one of the two.
+    Numbers are read with the country's decimal_separator. A column whose values fail to convert
+    beyond IngestConfig.MAX_COERCION_ERROR_RATE in the first chunk refuses the file or, with
+    IngestConfig.COERCION_ERRORS = "text", is loaded as text; in a later chunk it refuses the file.
+    """
+
+    def __init__(
+        self, proc, country_code, database_name, column_types, date_format=None, dayfirst=None, decimal_separator="."
+    ):
+        self.proc = proc
+        self.database_name = database_name
+        self.column_types = column_types
+        self.date_format = date_format
+        self.dayfirst = dayfirst
+        self.decimal_separator = decimal_separator
+        self.country_schema = country_code.lower()
+        self.ingest_schema = IngestConfig.SCHEMA.format(country_code=country_code.lower())
+        self.registry_table = f"{self.country_schema}.{IngestConfig.REGISTRY_TABLE}"
+
+    @contextmanager
+    def _cursor(self):
+        with closing(self.proc._pg_connection(self.database_name)) as conn:
+            with conn, conn.cursor() as cursor:
+                yield cursor
+
+    def _date_formats(self, path, first, column_types):
+        """{date column: strftime format} used for the whole file."""
+        date_columns = [name for name in first.columns if column_types.get(name) == "date"]
+        if file_extension(path) in ACCESS_EXTENSIONS:
+            return {name: ACCESS_DATE_FORMAT for name in date_columns}
+        if self.date_format is not None:
+            return {name: self.date_format for name in date_columns}
+        if date_columns and self.dayfirst is None:
+            raise ValueError(f"{path}: date columns {date_columns} need a date format or dayfirst")
+        formats = {}
+        for name in date_columns:
+            formats[name] = guess_date_format(first[name], self.dayfirst)
+            # Excel date cells arrive as datetimes and need no format
+            if formats[name] is None and first[name].map(lambda value: isinstance(value, str)).any():
+                raise ValueError(f"{path}: cannot detect the date format of column {name!r}")
+        return formats
+
+    def _checked_errors(self, path, frame, errors, refuse=True):
+        """
+        {column: error rate} of the columns whose values failed to convert beyond
+        IngestConfig.MAX_COERCION_ERROR_RATE; with refuse, a ValueError if there is any.
+        """
+        rates = error_rates(frame, errors)
+        failed = {name: rate for name, rate in rates.items() if rate > IngestConfig.MAX_COERCION_ERROR_RATE}
+        if failed and refuse:
+            raise ValueError(f"{path}: too many values do not match the column type: {failed}")
+        return failed
+
+    def _file_column_types(self, path, first, date_formats):
+        """
+        The column types of the file: those of the first chunk's columns that convert within
+        IngestConfig.MAX_COERCION_ERROR_RATE, text for the others with IngestConfig.COERCION_ERRORS = "text".
+        """
+        column_types = dict(self.column_types)
+        _, errors = coerce_chunk(first, column_types, date_formats, self.decimal_separator)
+        failed = self._checked_errors(path, first, errors, refuse=IngestConfig.COERCION_ERRORS != "text")
+        if failed:
+            logger.warning(f"{path}: columns loaded as text because too many values do not match their type: {failed}")
+            column_types.update({name: "text" for name in failed})
+        return column_types
+
+    def _create_ingest_table(self, ingest_table, columns, column_types):
+        definitions = ", ".join(
+            [f"{quote_identifier(RecordIdConfig.LINE_COLUMN)} bigint NOT NULL"]
+            + [f"{quote_identifier(name)} {column_types.get(name, 'text')}" for name in columns]
+        )
+        with self._cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {self.ingest_schema}")
+            cursor.execute(f"DROP TABLE IF EXISTS {ingest_table}")
+            cursor.execute(f"CREATE TABLE {ingest_table} ({definitions})")
+
+    def _load_chunk(self, path, frame, first_line, ingest_table, connection_kwargs, column_types, date_formats):
+        rows, errors = coerce_chunk(frame, column_types, date_formats, self.decimal_separator)
+        self._checked_errors(path, frame, errors)
+        # Lines are numbered from 1 in file order, whichever worker loads them
+        numbered = ((line, *row) for line, row in enumerate(rows, first_line))
+        row_count, byte_count = copy_rows(
+            numbered, connection_kwargs, ingest_table, [RecordIdConfig.LINE_COLUMN, *frame.columns]
+        )
+        return row_count, byte_count, errors
+
+    def _load_chunks(self, path, chunks, ingest_table, columns, column_types, date_formats):
+        """Copies the chunks with at most IngestConfig.WORKERS in flight; returns (rows, bytes, errors)."""
+        connection_kwargs = self.proc._pg_connection_kwargs(self.database_name)
+        totals = {"rows": 0, "bytes": 0, "errors": {}}
+
+        def collect(done):
+            for future in done:
+                row_count, byte_count, errors = future.result()
+                totals["rows"] += row_count
+                totals["bytes"] += byte_count
+                for name, count in errors.items():
+                    totals["errors"][name] = totals["errors"].get(name, 0) + count
+
+        with ThreadPoolExecutor(max_workers=IngestConfig.WORKERS) as pool:
+            running = set()
+            first_line = 1
+            for frame in chunks:
+                if list(frame.columns) != columns:
+                    raise ValueError(f"Chunk columns {list(frame.columns)} differ from the header {columns}")
+                if len(running) >= IngestConfig.WORKERS:
+                    # The next chunk is only read once a running one is done
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    collect(done)
+                running.add(
+                    pool.submit(
+                        self._load_chunk,
+                        path,
+                        frame,
+                        first_line,
+                        ingest_table,
+                        connection_kwargs,
+                        column_types,
+                        date_formats,
+                    )
+                )
+                first_line += len(frame)
+            collect(wait(running).done)
+        return totals
+
+    def ingest(self, path, table_name, sheet_name=None, source_table=None, replace=False) -> dict:
+        """
+        Loads the file at path as table_name and registers it; returns the registry entry.
+        An existing table of that name is only replaced with replace=True.
+        """
+        target_table = f"{self.country_schema}.{table_name}"
+        ingest_table = f"{self.ingest_schema}.{table_name}"
+        if not replace and self.proc._existing_tables([target_table], self.database_name):
+            raise ValueError(f"{target_table} already exists")
+
+        chunks = file_chunks(path, IngestConfig.CHUNK_ROWS, sheet_name=sheet_name, source_table=source_table)
+        first = next(chunks, None)
+        if first is None:
+            raise ValueError(f"{path} has no header row")
+        columns = list(first.columns)
+        # Formats and types are settled on the first chunk and kept for the whole file
+        date_formats = self._date_formats(path, first, self.column_types)
+        column_types = self._file_column_types(path, first, date_formats)
+        self._create_ingest_table(ingest_table, columns, column_types)
+        try:
+            totals = self._load_chunks(path, chain([first], chunks), ingest_table, columns, column_types, date_formats)
+            if totals["errors"]:
+                logger.warning(f"{path}: values set to null because they do not match the column type: {totals['errors']}")
+            with self._cursor() as cursor:
+                cursor.execute(f"ANALYZE {ingest_table}")
+            entry = {
+                "table_name": table_name,
+                "source_file": os.path.abspath(path),
+                "rows": totals["rows"],
+                "bytes": totals["bytes"],
+                "coercion_errors": totals["errors"],
+            }
+            with self._cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {self.registry_table} (
+                        table_name text PRIMARY KEY,
+                        source_file text NOT NULL,
+                        rows bigint NOT NULL,
+                        bytes bigint NOT NULL,
+                        coercion_errors jsonb,
+                        loaded_at timestamptz NOT NULL DEFAULT now()
+                    )
+                    """
+                )
+                if replace:
+                    cursor.execute(f"DROP TABLE IF EXISTS {target_table}")
+                    # A replaced table is processed again
+                    cursor.execute("SELECT to_regclass(%s)", (f"{self.country_schema}.processed_tables",))
+                    if cursor.fetchone()[0] is not None:
+                        cursor.execute(
+                            f"DELETE FROM {self.country_schema}.processed_tables WHERE table_name = %s", (table_name,)
+                        )
+                cursor.execute(f"ALTER TABLE {ingest_table} SET SCHEMA {self.country_schema}")
+                cursor.execute(
+                    f"""
+                    INSERT INTO {self.registry_table} (table_name, source_file, rows, bytes, coercion_errors)
+                    VALUES (%(table_name)s, %(source_file)s, %(rows)s, %(bytes)s, %(errors_json)s)
+                    ON CONFLICT (table_name) DO UPDATE SET source_file = EXCLUDED.source_file,
+                        rows = EXCLUDED.rows, bytes = EXCLUDED.bytes,
+                        coercion_errors = EXCLUDED.coercion_errors, loaded_at = now()
+                    """,
+                    {**entry, "errors_json": json.dumps(entry["coercion_errors"])},
+                )
+            return entry
+        except BaseException:
+            with self._cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {ingest_table}")
+            raise
@@ -0,0 +1,40 @@
+import re
+
+from config.TablesConfig import HSCodeLookupConfig
+
+NON_DIGITS = re.compile(r"[^0-9]")
+
+
+def normalize_hs_code(code):
+    """Digits of an HS / national tariff code ("0101.21.00" -> "01012100"), None if there are none."""
+    if code is None:
+        return None
+    return NON_DIGITS.sub("", str(code)) or None
+
+
+class HSPrefixIndex:
+    """
+    The codes of a {cc}_hs_desc table by normalized code, for longest-prefix matching: a national
+    tariff line without a row of its own takes the description of the longest table code it
+    starts with (HS8, then HS6, HS4, HS2). A table code's new_HS_CODE only applies to a line
+    whose whole code it is. Built once on the driver from the cached table.
+    """
+
+    def __init__(self, rows, min_length=HSCodeLookupConfig.MIN_PREFIX_LENGTH):
+        # normalized code -> (HS_CODE_DESC, new_HS_CODE); the first row of a code wins
+        self.entries = {}
+        for code, description, new_code in rows:
+            key = normalize_hs_code(code)
+            if key is not None and len(key) >= min_length:
+                self.entries.setdefault(key, (description, new_code))
+        self.lengths = sorted({len(key) for key in self.entries}, reverse=True)
+
+    def match(self, code):
+        """The longest indexed code that is a prefix of code, or None."""
+        key = normalize_hs_code(code)
+        if key is None:
+            return None
+        for length in self.lengths:
+            if length <= len(key) and key[:length] in self.entries:
+                return key[:length]
+        return None
@@ -0,0 +1,64 @@
+class HadoopFileSystem:
+    """
+    Thin wrapper over the Hadoop FileSystem API of the running Spark session.
+    Works the same for file://, s3a:// and hdfs:// paths, so driver-side bookkeeping
+    (markers, manifests, snapshot versions) lives next to the data Spark writes.
+    """
+
+    def __init__(self, spark, root_path):
+        self.jvm = spark._jvm
+        self.conf = spark._jsc.hadoopConfiguration()
+        self.root_path = root_path.rstrip("/")
+        self.fs = self._path(self.root_path).getFileSystem(self.conf)
+
+    def _path(self, path):
+        return self.jvm.org.apache.hadoop.fs.Path(path)
+
+    def join(self, *parts):
+        """Joins path parts below the root path."""
+        return "/".join([self.root_path] + [str(part).strip("/") for part in parts])
+
+    def exists(self, path):
+        return self.fs.exists(self._path(path))
+
+    def delete(self, path, recursive=True):
+        if self.exists(path):
+            self.fs.delete(self._path(path), recursive)
+
+    def rename(self, source, target):
+        self.fs.mkdirs(self._path(target).getParent())
+        return self.fs.rename(self._path(source), self._path(target))
+
+    def list_names(self, path):
+        """Returns the names of the direct children of path, or an empty list if it does not exist."""
+        if not self.exists(path):
+            return []
+        return [status.getPath().getName() for status in self.fs.listStatus(self._path(path))]
+
+    def write_text(self, path, text):
+        stream = self.fs.create(self._path(path), True)
+        try:
+            stream.write(bytearray(text.encode("utf-8")))
+        finally:
+            stream.close()
+
+    def read_text(self, path):
+        return self.read_bytes(path).decode("utf-8")
+
+    def read_bytes(self, path):
+        stream = self.fs.open(self._path(path))
+        try:
+            return bytes(self.jvm.org.apache.commons.io.IOUtils.toByteArray(stream))
+        finally:
+            stream.close()
+
+
+def configure_s3a(spark, host, port, access_key, secret_key):
+    """Points the session's s3a:// filesystem at an S3-compatible endpoint such as MinIO."""
+    conf = spark._jsc.hadoopConfiguration()
+    conf.set("fs.s3a.endpoint", f"http://{host}:{port}")
+    conf.set("fs.s3a.access.key", access_key)
+    conf.set("fs.s3a.secret.key", secret_key)
+    conf.set("fs.s3a.path.style.access", "true")
+    conf.set("fs.s3a.connection.ssl.enabled", "false")
+    conf.set("fs.s3a.impl", "org.apache.hadoop.fs.s3a.S3AFileSystem")
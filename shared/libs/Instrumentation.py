@@ -0,0 +1,293 @@
+import functools
+import json
+import logging
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import closing, contextmanager
+from datetime import datetime, timezone
+
+import psycopg2
+from config.TablesConfig import RunMetricsConfig
+from pyspark.sql import DataFrame
+
+logger = logging.getLogger(__name__)
+
+JOB_GROUP_PROPERTY = "spark.jobGroup.id"
+JOB_DESCRIPTION_PROPERTY = "spark.job.description"
+
+# Spark UI REST stage fields summed per step (all attempts of all stages of the step's jobs)
+STAGE_METRIC_FIELDS = {
+    "inputRecords": "input_records",
+    "inputBytes": "input_bytes",
+    "outputRecords": "output_records",
+    "outputBytes": "output_bytes",
+    "shuffleReadBytes": "shuffle_read_bytes",
+    "shuffleReadRecords": "shuffle_read_records",
+    "shuffleWriteBytes": "shuffle_write_bytes",
+    "shuffleWriteRecords": "shuffle_write_records",
+    "memoryBytesSpilled": "memory_bytes_spilled",
+    "diskBytesSpilled": "disk_bytes_spilled",
+    "executorRunTime": "executor_run_time_ms",
+    "jvmGcTime": "jvm_gc_time_ms",
+    "numCompleteTasks": "tasks",
+    "numFailedTasks": "failed_tasks",
+}
+
+
+class RunMetrics:
+    """
+    Records one row per instrumented step call: wall time, row counts and the Spark task
+    metrics of the jobs the step started. Every step runs under its own Spark job group, so
+    its jobs are found through the status tracker and their stage metrics through the
+    Spark UI REST API. Steps nest (process_table -> read_table, write_table); a parent's
+    metrics include its children's. Results are logged as one JSON line per step and
+    stored in RunMetricsConfig.TABLE when the outermost step finishes.
+    Calls that only build a lazy plan (they return a DataFrame) are not recorded as steps:
+    their time says nothing about the work, which runs in the action that consumes the plan.
+    Jobs and counters of such a call (e.g. a collect it needed) go to the enclosing step.
+    """
+
+    def __init__(
+        self,
+        proc,
+        table_name=RunMetricsConfig.TABLE,
+        database_name=RunMetricsConfig.DATABASE,
+        enabled=RunMetricsConfig.ENABLED,
+    ):
+        self.proc = proc
+        self.table_name = table_name
+        self.database_name = database_name
+        self.enabled = enabled
+        self.run_id = uuid.uuid4().hex
+        # Steps of a warm session may run on several threads at once
+        self._local = threading.local()
+
+    @property
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def add(self, **counters):
+        """Adds counters (e.g. rows_written, copy_bytes) to the innermost running step."""
+        if self._stack:
+            step_counters = self._stack[-1]["counters"]
+            for name, value in counters.items():
+                step_counters[name] = step_counters.get(name, 0) + value
+
+    @contextmanager
+    def step(self, name, table_name=None):
+        # Steps running before (or without) a SparkSession, e.g. on the pandas backend, only get wall time
+        sc = self.proc.spark.sparkContext if self.proc.has_session else None
+        parent = self._stack[-1] if self._stack else None
+        previous_group = sc.getLocalProperty(JOB_GROUP_PROPERTY) if sc else None
+        previous_description = sc.getLocalProperty(JOB_DESCRIPTION_PROPERTY) if sc else None
+
+        step_id = uuid.uuid4().hex[:16]
+        group = f"{previous_group}/{step_id}" if previous_group else step_id
+        frame = {
+            "step_id": step_id,
+            "parent_step_id": parent["step_id"] if parent else None,
+            "step": name,
+            "table_name": table_name,
+            "groups": [group] if sc else [],
+            "counters": {},
+            "children": [],
+            "started_at": datetime.now(timezone.utc),
+        }
+        self._stack.append(frame)
+        if sc:
+            sc.setJobGroup(group, f"{name} {table_name or ''}".strip())
+        started = time.perf_counter()
+        frame["plan_only"] = False
+        try:
+            yield frame
+            frame["status"] = "succeeded"
+        except BaseException as error:
+            frame["status"] = "failed"
+            frame["error"] = f"{type(error).__name__}: {error}"
+            raise
+        finally:
+            frame["seconds"] = time.perf_counter() - started
+            self._stack.pop()
+            if sc:
+                sc.setLocalProperty(JOB_GROUP_PROPERTY, previous_group)
+                sc.setLocalProperty(JOB_DESCRIPTION_PROPERTY, previous_description)
+            if frame["plan_only"] and frame["status"] == "succeeded":
+                if parent is not None:
+                    parent["groups"].extend(frame["groups"])
+                    parent["children"].extend(frame["children"])
+                    for name, value in frame["counters"].items():
+                        parent["counters"][name] = parent["counters"].get(name, 0) + value
+            elif parent is not None:
+                parent["groups"].extend(frame["groups"])
+                parent["children"].append(frame)
+            else:
+                self._flush(frame)
+
+    def _stage_ids(self, groups):
+        if not groups:
+            return set()
+        tracker = self.proc.spark.sparkContext.statusTracker()
+        stage_ids = set()
+        for group in groups:
+            for job_id in tracker.getJobIdsForGroup(group):
+                job = tracker.getJobInfo(job_id)
+                if job is not None:
+                    stage_ids.update(job.stageIds)
+        return stage_ids
+
+    def _stage_metrics(self, stage_id):
+        """Sums the metrics of all attempts of a stage from the Spark UI REST API."""
+        sc = self.proc.spark.sparkContext
+        if not sc.uiWebUrl:
+            return {}
+        url = f"{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}/stages/{stage_id}"
+        try:
+            with urllib.request.urlopen(url, timeout=RunMetricsConfig.REST_TIMEOUT) as response:
+                attempts = json.load(response)
+        except (OSError, ValueError):
+            return {}
+        metrics = {}
+        for attempt in attempts:
+            for field, name in STAGE_METRIC_FIELDS.items():
+                metrics[name] = metrics.get(name, 0) + (attempt.get(field) or 0)
+        return metrics
+
+    def _records(self, frame, stage_cache):
+        """Flattens a finished step tree into metric records, children first."""
+        records = []
+        for child in frame["children"]:
+            records.extend(self._records(child, stage_cache))
+
+        stage_ids = self._stage_ids(frame["groups"])
+        totals = {name: 0 for name in STAGE_METRIC_FIELDS.values()}
+        for stage_id in stage_ids:
+            if stage_id not in stage_cache:
+                stage_cache[stage_id] = self._stage_metrics(stage_id)
+            for name, value in stage_cache[stage_id].items():
+                totals[name] += value
+
+        counters = frame["counters"]
+        for child in frame["children"]:
+            for name, value in child["counters"].items():
+                counters[name] = counters.get(name, 0) + value
+
+        records.append(
+            {
+                "run_id": self.run_id,
+                "app_id": self.proc.spark.sparkContext.applicationId if self.proc.has_session else None,
+                "step_id": frame["step_id"],
+                "parent_step_id": frame["parent_step_id"],
+                "step": frame["step"],
+                "table_name": frame["table_name"],
+                "status": frame["status"],
+                "error": frame.get("error"),
+                "started_at": frame["started_at"].isoformat(),
+                "seconds": frame["seconds"],
+                "stages": len(stage_ids),
+                "input_rows": totals["input_records"],
+                "output_rows": counters.get("rows_written", totals["output_records"]),
+                "shuffle_read_bytes": totals["shuffle_read_bytes"],
+                "shuffle_write_bytes": totals["shuffle_write_bytes"],
+                "spill_bytes": totals["memory_bytes_spilled"] + totals["disk_bytes_spilled"],
+                "gc_seconds": totals["jvm_gc_time_ms"] / 1000,
+                "jdbc_bytes": counters.get("copy_bytes", 0),
+                "details": {**totals, **counters},
+            }
+        )
+        return records
+
+    def _flush(self, frame):
+        """Logs and stores the records of a finished outermost step; never fails the step."""
+        try:
+            records = self._records(frame, {})
+        except Exception:
+            logger.warning("Collecting run metrics failed", exc_info=True)
+            return
+        for record in records:
+            logger.info("run_metrics %s", json.dumps(record, default=str))
+        try:
+            self._store(records)
+        except psycopg2.Error:
+            logger.warning(f"Writing run metrics to {self.table_name} failed", exc_info=True)
+
+    def _store(self, records):
+        with closing(self.proc._pg_connection(self.database_name)) as conn:
+            with conn, conn.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {self.table_name} (
+                        run_id text NOT NULL,
+                        app_id text,
+                        step_id text PRIMARY KEY,
+                        parent_step_id text,
+                        step text NOT NULL,
+                        table_name text,
+                        status text NOT NULL,
+                        error text,
+                        started_at timestamptz NOT NULL,
+                        seconds double precision NOT NULL,
+                        stages integer,
+                        input_rows bigint,
+                        output_rows bigint,
+                        shuffle_read_bytes bigint,
+                        shuffle_write_bytes bigint,
+                        spill_bytes bigint,
+                        gc_seconds double precision,
+                        jdbc_bytes bigint,
+                        details jsonb
+                    )
+                    """
+                )
+                cursor.executemany(
+                    f"""
+                    INSERT INTO {self.table_name} (
+                        run_id, app_id, step_id, parent_step_id, step, table_name, status, error,
+                        started_at, seconds, stages, input_rows, output_rows, shuffle_read_bytes,
+                        shuffle_write_bytes, spill_bytes, gc_seconds, jdbc_bytes, details
+                    ) VALUES (
+                        %(run_id)s, %(app_id)s, %(step_id)s, %(parent_step_id)s, %(step)s,
+                        %(table_name)s, %(status)s, %(error)s, %(started_at)s, %(seconds)s,
+                        %(stages)s, %(input_rows)s, %(output_rows)s, %(shuffle_read_bytes)s,
+                        %(shuffle_write_bytes)s, %(spill_bytes)s, %(gc_seconds)s,
+                        %(jdbc_bytes)s, %(details_json)s
+                    )
+                    """,
+                    [{**record, "details_json": json.dumps(record["details"])} for record in records],
+                )
+
+
+def instrumented(name, method):
+    """Wraps a Spark4DataProc method so each call is recorded as a step of proc.run_metrics."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = getattr(self, "run_metrics", None)
+        if metrics is None or not metrics.enabled:
+            return method(self, *args, **kwargs)
+        table_name = kwargs.get("table_name")
+        if table_name is None and name in ("read_table", "write_table"):
+            table_name = next((arg for arg in args if isinstance(arg, str)), None)
+        with metrics.step(name, table_name or getattr(self, "table", None)) as frame:
+            result = method(self, *args, **kwargs)
+            frame["plan_only"] = isinstance(result, DataFrame)
+            return result
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def instrument_class(cls, prefixes=RunMetricsConfig.STEP_PREFIXES):
+    """Wraps the public methods of cls whose names start with one of prefixes."""
+    for attribute, value in list(vars(cls).items()):
+        if (
+            callable(value)
+            and not attribute.startswith("_")
+            and attribute.startswith(prefixes)
+            and not getattr(value, "__instrumented__", False)
+        ):
+            setattr(cls, attribute, instrumented(attribute, value))
+    return cls
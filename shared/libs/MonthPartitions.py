@@ -0,0 +1,280 @@
+import datetime
+from contextlib import closing
+
+import psycopg2
+from config.DBConfig import JDBCWriteConfig
+from config.TablesConfig import MonthPartitionConfig
+from pyspark.sql.types import StructType
+from Spark.PostgresCopy import (
+    PARTITION_ID_COLUMN,
+    copy_partition_rows,
+    create_table_sql,
+    quote_identifier,
+    split_table_name,
+)
+
+# Longest identifier Postgres keeps (longer index names are truncated)
+MAX_IDENTIFIER_LENGTH = 63
+
+
+def month_start(value):
+    """First day of the month of a date or timestamp; None for None."""
+    if value is None:
+        return None
+    return datetime.date(value.year, value.month, 1)
+
+
+def next_month(month):
+    return datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def sort_key(row, positions):
+    """Python ordering matching Spark's ascending sort (nulls first) on the given row positions."""
+    return tuple((row[position] is not None, row[position]) for position in positions)
+
+
+def month_order(month):
+    """Sort key of months with the default partition's None first."""
+    return (month is not None, month)
+
+
+class MonthPartitionedTable:
+    """
+    A table stored as a Postgres table partitioned by range of partition_column, with one
+    partition per month named <table>_<yyyy>_<mm> and a DEFAULT partition <table>_default for
+    rows without a partition_column. A write loads every month into its own detached table,
+    with several tasks copying into the same month (each in MonthPartitionConfig.SORT_COLUMNS
+    order), builds that month's BRIN and btree indexes after the load, and then publishes all
+    months in one transaction: the previous partitions are dropped and the new ones attached
+    with ATTACH PARTITION. Readers see the old data until the commit, and no row is deleted or
+    rewritten in place.
+    """
+
+    def __init__(self, table_name, schema: StructType = None, partition_column=MonthPartitionConfig.PARTITION_COLUMN):
+        self.table_name = table_name
+        self.schema = schema
+        self.partition_column = partition_column
+        self.schema_name, self.relation = split_table_name(table_name)
+
+    def _qualified(self, relation):
+        return f"{self.schema_name}.{relation}" if self.schema_name else relation
+
+    def leaf_relation(self, month):
+        """Relation name of a month's partition; month None is the DEFAULT partition."""
+        if month is None:
+            return f"{self.relation}_default"
+        return f"{self.relation}_{month:%Y_%m}"
+
+    def leaf_table(self, month):
+        return self._qualified(self.leaf_relation(month))
+
+    def staging_table(self, month):
+        return self.leaf_table(month) + JDBCWriteConfig.STAGING_SUFFIX
+
+    def _index_definitions(self, relation):
+        """(index name, USING clause) of the indexes every month (and the parent) carries."""
+        indexes = [
+            (
+                f"{relation}_{column}_brin".lower()[:MAX_IDENTIFIER_LENGTH],
+                f"USING brin ({quote_identifier(column)}) "
+                f"WITH (pages_per_range = {MonthPartitionConfig.BRIN_PAGES_PER_RANGE})",
+            )
+            for column in MonthPartitionConfig.BRIN_COLUMNS
+        ]
+        indexes += [
+            (f"{relation}_{column}_btree".lower()[:MAX_IDENTIFIER_LENGTH], f"USING btree ({quote_identifier(column)})")
+            for column in MonthPartitionConfig.BTREE_COLUMNS
+        ]
+        return indexes
+
+    def month_predicate(self, month, alias=None):
+        """SQL condition of the rows belonging to a month's partition (month None: the DEFAULT partition)."""
+        column = quote_identifier(self.partition_column)
+        if alias:
+            column = f"{alias}.{column}"
+        if month is None:
+            return f"{column} IS NULL"
+        return (
+            f"{column} IS NOT NULL AND {column} >= DATE '{month.isoformat()}' "
+            f"AND {column} < DATE '{next_month(month).isoformat()}'"
+        )
+
+    def _bounds_constraint(self, month):
+        return f"CHECK ({self.month_predicate(month)})"
+
+    def _partition_bounds(self, month):
+        if month is None:
+            return "DEFAULT"
+        return f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+
+    def load_month(self, connection_kwargs, month, rows, columns, partition_id=0):
+        """
+        Runs on the executors: streams one task's (already sorted) rows of a month into the month's
+        detached table with COPY. Every task loading rows of the month copies into the same table,
+        created by the first of them; a retried task replaces its own rows (see
+        copy_partition_rows). Returns (rows, bytes).
+        """
+        staging_table = self.staging_table(month)
+        with closing(psycopg2.connect(**connection_kwargs)) as conn:
+            with conn, conn.cursor() as cursor:
+                # Committed before the COPY, so the month's other tasks do not wait for this one
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (staging_table,))
+                cursor.execute("SELECT to_regclass(%s)", (staging_table,))
+                if cursor.fetchone()[0] is None:
+                    cursor.execute(create_table_sql(staging_table, self.schema, partition_ids=True))
+        return copy_partition_rows(partition_id, rows, connection_kwargs, staging_table, columns)
+
+    def finish_month(self, connection_kwargs, month):
+        """
+        Prepares a loaded month's table for ATTACH PARTITION once all its tasks are done: builds its
+        indexes, a CHECK constraint matching the partition bounds (so attaching does not scan it)
+        and statistics.
+        """
+        staging_table = self.staging_table(month)
+        _, staging_relation = split_table_name(staging_table)
+        with closing(psycopg2.connect(**connection_kwargs)) as conn:
+            with conn, conn.cursor() as cursor:
+                # Dropping a column does not rewrite the table
+                cursor.execute(f"ALTER TABLE {staging_table} DROP COLUMN {quote_identifier(PARTITION_ID_COLUMN)}")
+                for index_name, using in self._index_definitions(staging_relation):
+                    cursor.execute(f"CREATE INDEX {quote_identifier(index_name)} ON {staging_table} {using}")
+                cursor.execute(
+                    f"ALTER TABLE {staging_table} ADD CONSTRAINT month_bounds {self._bounds_constraint(month)}"
+                )
+                cursor.execute(f"ANALYZE {staging_table}")
+
+    def _attached_leaves(self, cursor):
+        cursor.execute(
+            """
+            SELECT n.nspname, c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE i.inhparent = to_regclass(%s)
+            """,
+            (self.table_name,),
+        )
+        return [(schema, relation) for schema, relation in cursor.fetchall()]
+
+    def attached_months(self, cursor):
+        """Months of the attached partitions, None for the DEFAULT partition."""
+        months = []
+        prefix = f"{self.relation}_".lower()
+        for _, relation in self._attached_leaves(cursor):
+            suffix = relation.lower().removeprefix(prefix)
+            if suffix == "default":
+                months.append(None)
+            else:
+                year, _, month = suffix.partition("_")
+                months.append(datetime.date(int(year), int(month), 1))
+        return months
+
+    def _columns(self, cursor, table_name):
+        cursor.execute(
+            """
+            SELECT attname, format_type(atttypid, atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped
+            ORDER BY attnum
+            """,
+            (table_name,),
+        )
+        return cursor.fetchall()
+
+    def _relkind(self, cursor):
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (self.table_name,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def is_partitioned(self, cursor):
+        return self._relkind(cursor) == "p"
+
+    def _create_parent(self, cursor):
+        cursor.execute(
+            create_table_sql(self.table_name, self.schema)
+            + f" PARTITION BY RANGE ({quote_identifier(self.partition_column)})"
+        )
+        for index_name, using in self._index_definitions(self.relation):
+            cursor.execute(f"CREATE INDEX {quote_identifier(index_name)} ON {self.table_name} {using}")
+
+    def publish(self, cursor, months):
+        """
+        Replaces the table's contents with the loaded months, in the caller's transaction. A plain
+        table of the same name (or a partitioned one with other columns) is replaced by the
+        partitioned table; months that were not loaded are dropped, as with an overwrite. The
+        DEFAULT partition keeps its constraint, so new months are attached next to it without a scan.
+        """
+        relkind = self._relkind(cursor)
+        if relkind is not None and (
+            relkind != "p"
+            or (months and self._columns(cursor, self.table_name) != self._columns(cursor, self.staging_table(months[0])))
+        ):
+            cursor.execute(f"DROP TABLE {self.table_name}")
+            relkind = None
+        if relkind is None:
+            self._create_parent(cursor)
+
+        # Dropping a partition detaches it; the new months' indexes carry the names the old ones had
+        for schema, relation in self._attached_leaves(cursor):
+            cursor.execute(f"DROP TABLE {quote_identifier(schema)}.{quote_identifier(relation)}")
+        for month in months:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.leaf_table(month)}")
+        for month in months:
+            staging_table = self.staging_table(month)
+            _, staging_relation = split_table_name(staging_table)
+            leaf_relation = self.leaf_relation(month)
+            cursor.execute(f"ALTER TABLE {staging_table} RENAME TO {leaf_relation}")
+            for (staging_index, _), (leaf_index, _) in zip(
+                self._index_definitions(staging_relation), self._index_definitions(leaf_relation)
+            ):
+                cursor.execute(
+                    f"ALTER INDEX {self._qualified(quote_identifier(staging_index))} RENAME TO {quote_identifier(leaf_index)}"
+                )
+            # The month's indexes match the parent's, so they are attached instead of rebuilt
+            cursor.execute(
+                f"ALTER TABLE {self.table_name} ATTACH PARTITION {self.leaf_table(month)} {self._partition_bounds(month)}"
+            )
+            if month is not None:
+                cursor.execute(f"ALTER TABLE {self.leaf_table(month)} DROP CONSTRAINT month_bounds")
+
+    def ensure_months(self, cursor, staging_table):
+        """
+        Creates the (empty) partitions of the months present in staging_table that the table lacks;
+        returns the months present.
+        """
+        column = quote_identifier(self.partition_column)
+        cursor.execute(f"SELECT DISTINCT date_trunc('month', {column})::date FROM {staging_table}")
+        months = sorted((row[0] for row in cursor.fetchall()), key=month_order)
+        attached = {relation.lower() for _, relation in self._attached_leaves(cursor)}
+        # The DEFAULT partition first: a month attached next to it is checked against its constraint
+        for month in months:
+            if self.leaf_relation(month).lower() in attached:
+                continue
+            cursor.execute(
+                f"CREATE TABLE {self.leaf_table(month)} PARTITION OF {self.table_name} {self._partition_bounds(month)}"
+            )
+            if month is None:
+                cursor.execute(
+                    f"ALTER TABLE {self.leaf_table(month)} ADD CONSTRAINT month_bounds {self._bounds_constraint(month)}"
+                )
+        return months
+
+    def discard_staging(self, cursor):
+        """Drops the detached month tables a failed write left behind."""
+        cursor.execute(
+            """
+            SELECT n.nspname, c.relname
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind = 'r' AND n.nspname = coalesce(%s, current_schema())
+              AND c.relname LIKE %s AND right(c.relname, %s) = %s
+            """,
+            (
+                self.schema_name.lower() if self.schema_name else None,
+                self.relation.replace("_", r"\_") + r"\_%",
+                len(JDBCWriteConfig.STAGING_SUFFIX),
+                JDBCWriteConfig.STAGING_SUFFIX,
+            ),
+        )
+        for schema, relation in cursor.fetchall():
+            cursor.execute(f"DROP TABLE IF EXISTS {schema}.{relation}")
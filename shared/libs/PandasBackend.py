@@ -0,0 +1,497 @@
+import re
+import uuid
+from contextlib import closing
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from config.CompanyFileConfig import CompanyFileType, CompanyMasterConfig
+from config.CountryCodeConfig import CountryCodes
+from config.ShipmentFileConfig import ShipmentFileType
+from config.TablesConfig import CountryLookupConfig, DedupeConfig, HSCodeLookupConfig, RecordIdConfig
+from pyspark.sql.types import (
+    BooleanType,
+    DateType,
+    DecimalType,
+    DoubleType,
+    FloatType,
+    IntegerType,
+    LongType,
+    ShortType,
+    StringType,
+    StructField,
+    StructType,
+    TimestampType,
+)
+from Spark import COMPANY_NAME_STRIP_PATTERN, TA_CODE_PATTERN, hs_description_lookup, unit_lookup
+from Spark.CountryLookup import config_country_maps, table_country_maps
+from Spark.Enrichment import lookup, plan_lookups
+from Spark.HSCodeIndex import HSPrefixIndex, normalize_hs_code
+from Spark.SchemaCompiler import (
+    plan_projection,
+    record_id,
+    record_key_sources,
+    record_ordinals,
+    record_window_ordinals,
+)
+from Spark.ShipmentDedupe import key_hash
+
+# Column types as the Spark JDBC reader maps them, so both backends write identical tables
+POSTGRES_TO_SPARK_TYPES = {
+    "text": StringType(),
+    "character varying": StringType(),
+    "character": StringType(),
+    "uuid": StringType(),
+    "json": StringType(),
+    "jsonb": StringType(),
+    "smallint": IntegerType(),
+    "integer": IntegerType(),
+    "bigint": LongType(),
+    "real": FloatType(),
+    "double precision": DoubleType(),
+    "numeric": DecimalType(38, 18),
+    "boolean": BooleanType(),
+    "date": DateType(),
+    "timestamp without time zone": TimestampType(),
+    "timestamp with time zone": TimestampType(),
+}
+SPEC_SPARK_TYPES = {
+    "string": StringType(),
+    "int": IntegerType(),
+    "float": FloatType(),
+    "double": DoubleType(),
+    "date": DateType(),
+    "uuid": StringType(),
+}
+NUMERIC_TYPES = (ShortType, IntegerType, LongType, FloatType, DoubleType, DecimalType)
+# Separates the parts of composite lookup keys (country and name key in the TA lookup)
+KEY_SEPARATOR = "\x1f"
+
+
+class UnsupportedByPandas(ValueError):
+    """Raised for data the pandas backend cannot process exactly like Spark; the caller falls back to Spark."""
+
+
+class PandasTable:
+    """A pandas frame (object columns, None for nulls) with the Spark schema it corresponds to."""
+
+    def __init__(self, frame: pd.DataFrame, schema: StructType):
+        self.frame = frame
+        self.schema = schema
+
+    @property
+    def columns(self):
+        return self.schema.fieldNames()
+
+    def data_type(self, column):
+        return self.schema[column].dataType
+
+    def replace(self, columns: dict, types: dict | None = None) -> "PandasTable":
+        """Returns a table with the given columns replaced in place (or appended), optionally retyped."""
+        frame = self.frame.copy(deep=False)
+        fields = {field.name: field for field in self.schema.fields}
+        for name, values in columns.items():
+            frame[name] = nulls_to_none(values)
+            data_type = (types or {}).get(name)
+            if data_type is not None or name not in fields:
+                fields[name] = StructField(name, data_type or StringType(), True)
+        return PandasTable(frame[list(fields)], StructType(list(fields.values())))
+
+
+def nulls_to_none(values: pd.Series) -> pd.Series:
+    """Object series with None for every null, the only null COPY and Spark agree on."""
+    values = values.astype(object)
+    return values.where(values.notna(), None)
+
+
+def coalesce(*series: pd.Series) -> pd.Series:
+    result = series[0]
+    for other in series[1:]:
+        result = result.where(result.notna(), other)
+    return nulls_to_none(result)
+
+
+def composite_key(series: list) -> pd.Series:
+    """The lookup key of each row: the value itself, or the values joined by KEY_SEPARATOR; None if any is null."""
+    if len(series) == 1:
+        return series[0]
+    frame = pd.concat(series, axis=1)
+    keys = frame.astype(str).agg(KEY_SEPARATOR.join, axis=1)
+    return keys.where(frame.notna().all(axis=1), None)
+
+
+def apply_policy(policy, current: pd.Series, value: pd.Series) -> pd.Series:
+    """pandas counterpart of the Enrichment.LOOKUP_POLICIES as Spark4DataProc.enrich applies them."""
+    if policy == "prefer_lookup":
+        return coalesce(value, current)
+    if policy == "keep_existing":
+        return coalesce(current, value)
+    if policy == "replace":
+        return nulls_to_none(value)
+    factor = pd.to_numeric(value, errors="coerce")
+    current = pd.to_numeric(current, errors="coerce").astype(float)
+    return nulls_to_none(current.where(factor.isna(), current * factor))
+
+
+def cast_value(value, data_type):
+    """Casts a spec default the way Spark's lit(value).cast(type) does for the types specs use."""
+    if value is None:
+        return None
+    if isinstance(data_type, StringType):
+        return str(value)
+    if isinstance(data_type, (ShortType, IntegerType, LongType)):
+        return int(value)
+    if isinstance(data_type, (FloatType, DoubleType)):
+        return float(value)
+    if isinstance(data_type, DateType) and not isinstance(value, date):
+        return date.fromisoformat(str(value))
+    return value
+
+
+def spark_type(postgres_type):
+    if postgres_type.startswith("numeric("):
+        precision, scale = postgres_type[len("numeric("):-1].split(",")
+        return DecimalType(int(precision), int(scale))
+    base_type = re.sub(r"\(.*\)", "", postgres_type).strip()
+    return POSTGRES_TO_SPARK_TYPES.get(base_type, StringType())
+
+
+class PandasBackend:
+    """
+    Runs the table operations of a Spark4DataProc (column specs, country/port/HS/unit lookups,
+    TA code matching, checks) on pandas in the driver process. Tables are read and written with
+    psycopg2 only, so small tables are processed without starting Spark. Every operation
+    mirrors the Spark method of the same name and produces the same rows, column order and
+    column types.
+    """
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.reference_tables = {}
+
+    def read_table(self, table_name, database_name) -> PandasTable:
+        with closing(self.proc._pg_connection(database_name)) as conn, conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+                FROM pg_attribute a
+                WHERE a.attrelid = to_regclass(%s) AND a.attnum > 0 AND NOT a.attisdropped
+                ORDER BY a.attnum
+                """,
+                (table_name,),
+            )
+            schema = StructType(
+                [StructField(name, spark_type(type_name), True) for name, type_name in cursor.fetchall()]
+            )
+            cursor.execute(f"SELECT * FROM {table_name}")
+            frame = pd.DataFrame(cursor.fetchall(), columns=schema.fieldNames(), dtype=object)
+        return PandasTable(frame, schema)
+
+    def read_reference_table(self, table_name, database_name) -> PandasTable:
+        key = (database_name, table_name)
+        if key not in self.reference_tables:
+            self.reference_tables[key] = self.read_table(table_name, database_name)
+        return self.reference_tables[key]
+
+    def enrich(self, table: PandasTable, lookups, types: dict | None = None) -> PandasTable:
+        """Same as Spark4DataProc.enrich, with dict lookups; appended columns take the lookup column's type."""
+        state = {column: table.frame[column] for column in table.columns}
+        appended_types = {}
+        values = {}
+        for operation in plan_lookups(table.columns, lookups):
+            if operation[0] == "join":
+                _, alias, table_name, database_name, keys, needed = operation
+                reference = self.read_reference_table(table_name, database_name)
+                reference_keys = composite_key([reference.frame[column] for _, column in keys])
+                data_keys = composite_key([state[column] for column, _ in keys])
+                matched = reference_keys.notna()
+                for lookup_column in needed:
+                    mapping = dict(zip(reference_keys[matched], reference.frame[lookup_column][matched]))
+                    values[alias, lookup_column] = data_keys.map(mapping)
+                    appended_types[alias, lookup_column] = reference.data_type(lookup_column)
+            else:
+                _, column_name, alias, lookup_column, policy = operation
+                if column_name not in state:
+                    state[column_name] = pd.Series([None] * len(table.frame), index=table.frame.index, dtype=object)
+                    if column_name not in (types or {}):
+                        types = {**(types or {}), column_name: appended_types[alias, lookup_column]}
+                state[column_name] = apply_policy(policy, state[column_name], values[alias, lookup_column])
+        return table.replace(state, types=types)
+
+    def write_table(self, table: PandasTable, table_name, database_name, mode="overwrite", key_columns=None, key_sink=None):
+        if key_sink is not None:
+            hashes = self.key_hashes(table, key_sink.key_columns)
+            present = hashes.notna()
+            key_sink.copy(0, zip(hashes[present], table.frame[key_sink.row_id_column][present]))
+        frame = table.frame.astype(object).where(table.frame.notna(), None)
+        self.proc.copy_write_rows(
+            frame.itertuples(index=False, name=None),
+            table.schema,
+            table_name,
+            database_name,
+            mode=mode,
+            key_columns=key_columns,
+        )
+
+    def process_table(
+        self, source_table, target_table, database_name, steps, mode="overwrite", key_columns=None, key_sink=None
+    ):
+        table = self.read_table(source_table, database_name)
+        for step in steps:
+            table = step(table)
+        self.write_table(table, target_table, database_name, mode=mode, key_columns=key_columns, key_sink=key_sink)
+
+    def apply_column_specs(
+        self, table: PandasTable, rename=None, add=None, column_specs=ShipmentFileType.fields, record_key=None
+    ):
+        rows = len(table.frame)
+        columns = {}
+        fields = []
+        plan = plan_projection(table.columns, rename, add, column_specs)
+        for name, source in plan:
+            if source[0] == "column":
+                columns[name] = table.frame[source[1]]
+                data_type = table.data_type(source[1])
+            elif source[0] == "default" and source[1] == "uuid" and record_key is not None:
+                source_table, key_columns = record_key
+                keys = [
+                    table.frame[key] if key is not None else pd.Series([None] * rows, index=table.frame.index)
+                    for key in record_key_sources(plan, key_columns)
+                ]
+                key_values = list(zip(*keys)) if keys else [()] * rows
+                if RecordIdConfig.LINE_COLUMN in table.columns:
+                    ordinals = record_ordinals(key_values, [int(line) for line in table.frame[RecordIdConfig.LINE_COLUMN]])
+                else:
+                    source_rows = list(
+                        table.frame.astype(object).where(table.frame.notna(), None).itertuples(index=False, name=None)
+                    )
+                    try:
+                        ordinals = record_window_ordinals(key_values, source_rows)
+                    except TypeError as error:
+                        # Mixed value types in a column have no order matching Spark's
+                        raise UnsupportedByPandas(f"Cannot order the lines of {source_table}: {error}") from error
+                columns[name] = pd.Series(
+                    [record_id(source_table, values, ordinal) for values, ordinal in zip(key_values, ordinals)],
+                    index=table.frame.index,
+                    dtype=object,
+                )
+                data_type = StringType()
+            elif source[0] == "default" and source[1] == "uuid":
+                columns[name] = pd.Series([str(uuid.uuid4()) for _ in range(rows)], dtype=object)
+                data_type = StringType()
+            elif source[0] == "default":
+                data_type = SPEC_SPARK_TYPES.get(source[1])
+                if data_type is None:
+                    raise UnsupportedByPandas(f"Unsupported column type in spec: {source[1]}")
+                columns[name] = pd.Series([cast_value(source[2], data_type)] * rows, dtype=object)
+            else:
+                data_type = source[1]
+                columns[name] = pd.Series([None] * rows, dtype=object)
+            fields.append(StructField(name, data_type, True))
+        frame = pd.DataFrame(
+            {name: values.reset_index(drop=True) for name, values in columns.items()}, dtype=object
+        )
+        return PandasTable(frame, StructType(fields))
+
+    def update_country_column(self, table: PandasTable, column_name):
+        return self.enrich(
+            table,
+            [lookup("CountryCode", "Country_Port_Code", {column_name: "country2"}, {column_name: ("code", "prefer_lookup")})],
+        )
+
+    def update_port(self, table: PandasTable, join_column, update_column):
+        return self.enrich(
+            table,
+            [
+                lookup(
+                    "Country_Code_Uniq",
+                    "Country_Port_Code",
+                    {join_column: "Alpha-2 code"},
+                    {update_column: ("English short name (upper/lower case)", "keep_existing")},
+                )
+            ],
+        )
+
+    def country_lookup_maps(self, source=CountryLookupConfig.SOURCE):
+        if source == "config":
+            return config_country_maps()
+        countries = self.read_reference_table("CountryCode", "Country_Port_Code").frame
+        ports = self.read_reference_table("Country_Code_Uniq", "Country_Port_Code").frame
+        return table_country_maps(
+            zip(countries["country2"], countries["code"]),
+            zip(ports["Alpha-2 code"], ports["English short name (upper/lower case)"]),
+        )
+
+    def update_countries_and_ports(
+        self,
+        table: PandasTable,
+        country_columns=("COUNTRY_OF_ORIGIN", "EXPORTER_COUNTRY", "IMPORTER_COUNTRY"),
+        port_columns=(("IMPORTER_COUNTRY", "PORT_OF_ARRIVAL"), ("EXPORTER_COUNTRY", "PORT_OF_DEPARTURE")),
+        source=CountryLookupConfig.SOURCE,
+    ):
+        names_to_codes, codes_to_names = self.country_lookup_maps(source)
+        replacements = {}
+        for column_name in country_columns:
+            if column_name in table.columns:
+                values = table.frame[column_name]
+                replacements[column_name] = coalesce(values.map(names_to_codes), values)
+        for join_column, update_column in port_columns:
+            if join_column in table.columns and update_column in table.columns:
+                country = replacements.get(join_column, table.frame[join_column])
+                replacements[update_column] = coalesce(table.frame[update_column], country.map(codes_to_names))
+        return table.replace(replacements)
+
+    def update_hs_code_description(self, table: PandasTable, country_code):
+        if not HSCodeLookupConfig.PREFIX_MATCH:
+            return self.enrich(table, [hs_description_lookup(country_code)])
+        reference = self.read_reference_table(f"{country_code}_hs_desc", "HS_DESC").frame
+        index = HSPrefixIndex(zip(reference["HS_CODE"], reference["HS_CODE_DESC"], reference["new_HS_CODE"]))
+        hs_codes = table.frame["HS_CODE"]
+        codes = hs_codes.dropna().unique()
+        matched = hs_codes.map({code: index.match(code) for code in codes})
+        # new_HS_CODE only replaces the code it was given for, not codes that merely start with it
+        exact = hs_codes.map({code: index.match(code) == normalize_hs_code(code) for code in codes}) == True  # noqa: E712
+        entries = matched.map(index.entries)
+        current = table.frame.get("HS_CODE_DESCRIPTION", pd.Series([None] * len(hs_codes), index=hs_codes.index, dtype=object))
+        new_codes = entries.map(lambda entry: entry[1], na_action="ignore").where(exact, None)
+        return table.replace(
+            {
+                "HS_CODE_DESCRIPTION": coalesce(entries.map(lambda entry: entry[0], na_action="ignore"), current),
+                "HS_CODE": coalesce(new_codes, hs_codes),
+            }
+        )
+
+    def update_quantity_and_unit(self, table: PandasTable, country_code, unit_column="QUANTITY_UNIT"):
+        if not isinstance(table.data_type("QUANTITY"), NUMERIC_TYPES):
+            # Spark's string * double coercion is not reproduced here
+            raise UnsupportedByPandas("QUANTITY is not numeric")
+        # Same cast as the Spark step: decimals become doubles before and regardless of the lookup
+        table = table.replace(
+            {"QUANTITY": table.frame["QUANTITY"].map(float, na_action="ignore")}, types={"QUANTITY": DoubleType()}
+        )
+        return self.enrich(table, [unit_lookup(country_code, unit_column)], types={"QUANTITY": DoubleType()})
+
+    def key_hashes(self, table: PandasTable, key_columns) -> pd.Series:
+        keys = table.frame[list(key_columns)]
+        return pd.Series(
+            [key_hash(values) for values in keys.itertuples(index=False, name=None)], index=keys.index, dtype=object
+        )
+
+    def dedupe_shipments(self, table: PandasTable, key_index, source_table, key_columns, mode=DedupeConfig.MODE):
+        """Same as Spark4DataProc.dedupe_shipments, probing the Bloom filter in-process."""
+        hashes = self.key_hashes(table, key_columns)
+        duplicates = set()
+        bloom = key_index.load_bloom()
+        if bloom is not None:
+            present = np.asarray(hashes.dropna().unique().tolist(), dtype=np.int64)
+            candidates = present[bloom.might_contain(present)].tolist()
+            duplicates = key_index.duplicates(candidates, source_table)
+        is_duplicate = hashes.isin(duplicates)
+        if mode == "flag":
+            return table.replace({DedupeConfig.FLAG_COLUMN: is_duplicate}, types={DedupeConfig.FLAG_COLUMN: BooleanType()})
+        return PandasTable(table.frame[~is_duplicate].reset_index(drop=True), table.schema)
+
+    def normalize_company_name(self, names: pd.Series) -> pd.Series:
+        return names.astype("string").str.replace(COMPANY_NAME_STRIP_PATTERN, "", regex=True).str.strip(" ")
+
+    def read_company_keys(self, country_code) -> pd.DataFrame:
+        """Same as normalized_company_keys(read_company_file(...)): one minimal TA_CODE per name key."""
+        companies = self.read_table(
+            CompanyMasterConfig.SOURCE_TABLE.format(country_code=country_code), CompanyMasterConfig.DATABASE
+        ).frame
+        if "COMPANY_NAME" not in companies.columns:
+            companies = companies.rename(columns={CompanyMasterConfig.SOURCE_NAME_COLUMN: "COMPANY_NAME"})
+        valid = pd.Series(True, index=companies.index)
+        for column_name, specs in CompanyFileType.fields.items():
+            if column_name not in companies.columns:
+                continue
+            rules = specs["validation_rules"]
+            if "exist" in rules:
+                valid &= companies[column_name].notna()
+            if "ta_code" in rules:
+                valid &= companies[column_name].astype("string").str.contains(TA_CODE_PATTERN, regex=True, flags=re.ASCII).fillna(False)
+        companies = companies[valid]
+        keys = pd.DataFrame(
+            {"NAME_KEY": self.normalize_company_name(companies["COMPANY_NAME"]), "TA_CODE": companies["TA_CODE"]}
+        )
+        keys = keys[keys["NAME_KEY"].notna() & (keys["NAME_KEY"] != "")]
+        return keys.groupby("NAME_KEY", as_index=False)["TA_CODE"].min()
+
+    def load_ta_code_lookup(self, country_codes) -> dict:
+        """'<country><KEY_SEPARATOR><name key>' -> TA code for the given countries, from the masters or the company files."""
+        country_codes = sorted(set(country_codes) & set(CountryCodes.COUNTRY_CODES_TWO_CHARS))
+        current = self.proc._current_company_masters(country_codes)
+        lookup = {}
+        for country_code in country_codes:
+            if country_code in current:
+                companies = self.read_table(
+                    CompanyMasterConfig.MASTER_TABLE.format(country_code=country_code), CompanyMasterConfig.DATABASE
+                ).frame
+                name_keys = companies[CompanyMasterConfig.NAME_KEY_COLUMN]
+            else:
+                companies = self.read_company_keys(country_code)
+                name_keys = companies["NAME_KEY"]
+            for name_key, ta_code in zip(name_keys, companies["TA_CODE"]):
+                if name_key is not None:
+                    lookup[country_code + KEY_SEPARATOR + name_key] = ta_code
+        return lookup
+
+    def update_ta_code(self, table: PandasTable, country_column, name_column, ta_code_column, lookup=None):
+        if name_column not in table.columns:
+            return table
+        if lookup is None:
+            lookup = self.load_ta_code_lookup(set(table.frame[country_column].dropna()))
+        keys = (
+            table.frame[country_column].astype("string")
+            + KEY_SEPARATOR
+            + self.normalize_company_name(table.frame[name_column])
+        )
+        return table.replace({ta_code_column: coalesce(table.frame[ta_code_column], keys.map(lookup))})
+
+    def update_exporter_and_importer_ta_codes(self, table: PandasTable):
+        countries = set()
+        for column in ("EXPORTER_COUNTRY", "IMPORTER_COUNTRY"):
+            countries |= set(table.frame[column].dropna())
+        lookup = self.load_ta_code_lookup(countries)
+        table = self.update_ta_code(table, "EXPORTER_COUNTRY", "EXPORTER_NAME", "EXPORTER_TA_CODE", lookup)
+        return self.update_ta_code(table, "IMPORTER_COUNTRY", "IMPORTER_NAME", "IMPORTER_TA_CODE", lookup)
+
+    def reference_values(self, table_name, database_name, column_name) -> set:
+        values = self.read_reference_table(table_name, database_name).frame[column_name].dropna()
+        return {str(value) for value in values}
+
+    def run_comprehensive_checks(
+        self, table: PandasTable, null_columns, country_column, ta_columns, country_code, approximate=False, sampler=None
+    ) -> dict:
+        """Same checks and result shape as Spark4DataProc.run_comprehensive_checks; small tables are always checked exactly."""
+        frame = table.frame
+
+        def count(mask):
+            return int(mask.sum())
+
+        def not_matching(column, pattern):
+            values = frame[column].dropna().astype(str)
+            return count(~values.str.contains(pattern, regex=True, flags=re.ASCII))
+
+        unit_table = f"{country_code}_unit_of_quantity"
+        known_countries = self.reference_values("Country_Code_Uniq", "Country_Port_Code", "Alpha-2 code")
+        known_units = self.reference_values(unit_table, "UNIT_OF_QUANTITY", "UNIT_OF_QUANTITY")
+        ta_issues = {
+            column: count(frame[column].isna()) + not_matching(column, TA_CODE_PATTERN)
+            for column in ta_columns
+        }
+        return {
+            "null_checks": {column: count(frame[column].isna()) for column in null_columns},
+            "hs_code_integrity": {
+                "null_hs_code": count(frame["HS_CODE"].isna()),
+                "null_hs_code_description": count(frame["HS_CODE_DESCRIPTION"].isna()),
+                "invalid_hs_code_format": not_matching("HS_CODE", r"^\d+$"),
+            },
+            "ta_code_issues": {column: issues for column, issues in ta_issues.items() if issues > 0},
+            "quantity_integrity": {
+                "null_quantity": count(frame["QUANTITY"].isna()),
+                "null_quantity_unit": count(frame["QUANTITY_UNIT"].isna()),
+                "missing_units": sorted(set(frame["QUANTITY_UNIT"].dropna()) - known_units),
+            },
+            "invalid_country_codes": sorted(set(frame[country_column].dropna()) - known_countries),
+        }
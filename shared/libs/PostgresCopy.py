@@ -0,0 +1,169 @@
+import datetime
+import math
+from contextlib import closing
+from decimal import Decimal
+
+import psycopg2
+from pyspark import TaskContext
+from pyspark.sql.types import (
+    BinaryType,
+    BooleanType,
+    ByteType,
+    DateType,
+    DecimalType,
+    DoubleType,
+    FloatType,
+    IntegerType,
+    LongType,
+    ShortType,
+    StringType,
+    StructType,
+    TimestampType,
+)
+
+COPY_NULL = "\\N"
+# Column of a staging table recording the Spark partition that loaded each row (see copy_partition_rows)
+PARTITION_ID_COLUMN = "__partition_id"
+
+SPARK_TO_POSTGRES_TYPES = {
+    StringType: "text",
+    IntegerType: "integer",
+    LongType: "bigint",
+    ShortType: "smallint",
+    ByteType: "smallint",
+    FloatType: "real",
+    DoubleType: "double precision",
+    DateType: "date",
+    TimestampType: "timestamp",
+    BooleanType: "boolean",
+    BinaryType: "bytea",
+}
+
+
+def quote_identifier(name):
+    """Quotes a column name the same way Spark's JDBC writer does."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def split_table_name(table_name):
+    """Splits 'schema.table' into (schema, table); schema is None for unqualified names."""
+    schema, _, relation = table_name.rpartition(".")
+    return schema or None, relation
+
+
+def postgres_type(data_type):
+    """Maps a Spark SQL data type to the matching PostgreSQL column type."""
+    if isinstance(data_type, DecimalType):
+        return f"numeric({data_type.precision},{data_type.scale})"
+    return SPARK_TO_POSTGRES_TYPES.get(type(data_type), "text")
+
+
+def create_table_sql(table_name, schema: StructType, partition_ids=False):
+    """Builds a CREATE TABLE statement for the given Spark schema, optionally led by PARTITION_ID_COLUMN."""
+    columns = [
+        f"{quote_identifier(field.name)} {postgres_type(field.dataType)}"
+        for field in schema.fields
+    ]
+    if partition_ids:
+        columns.insert(0, f"{quote_identifier(PARTITION_ID_COLUMN)} integer NOT NULL")
+    return f"CREATE TABLE {table_name} ({', '.join(columns)})"
+
+
+def format_copy_value(value):
+    """Formats a single value for COPY ... FROM STDIN in text format."""
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        if math.isinf(value):
+            return "Infinity" if value > 0 else "-Infinity"
+        return repr(value)
+    if isinstance(value, (int, Decimal)):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray)):
+        return "\\\\x" + bytes(value).hex()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class CopyRowStream:
+    """
+    File-like adapter that serializes rows lazily for cursor.copy_expert,
+    so a partition is streamed to Postgres without being held in memory.
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = ""
+        self.row_count = 0
+        self.byte_count = 0
+
+    def read(self, size=-1):
+        lines = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = "\t".join(format_copy_value(value) for value in row) + "\n"
+            lines.append(line)
+            length += len(line)
+            self.row_count += 1
+        data = "".join(lines)
+        if size >= 0:
+            data, self.buffer = data[:size], data[size:]
+        else:
+            self.buffer = ""
+        self.byte_count += len(data)
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def copy_rows(rows, connection_kwargs, table_name, columns):
+    """
+    Streams an iterator of rows into table_name with COPY FROM STDIN.
+    Runs on the executors; the partition is committed as a single transaction.
+    """
+    stream = CopyRowStream(rows)
+    column_list = ", ".join(quote_identifier(column) for column in columns)
+    with closing(psycopg2.connect(**connection_kwargs)) as conn:
+        with conn, conn.cursor() as cursor:
+            cursor.copy_expert(f"COPY {table_name} ({column_list}) FROM STDIN", stream)
+    return stream.row_count, stream.byte_count
+
+
+def copy_partition_rows(partition_id, rows, connection_kwargs, table_name, columns):
+    """
+    copy_rows for one task of a Spark write into a table created with partition_ids=True.
+    The rows are tagged with partition_id. A retried attempt of the partition (a task or stage
+    retry) first deletes the rows an earlier attempt committed, in the same transaction, so it
+    replaces them instead of adding them a second time; attempts of a partition are serialized
+    with an advisory lock. First attempts, and loads from the driver into a fresh table, skip
+    that delete: the table has no index on PARTITION_ID_COLUMN, so every delete scans it.
+    Speculative execution stays off, so a first attempt never runs next to a retry.
+    """
+    context = TaskContext.get()
+    retried = context is not None and (context.attemptNumber() > 0 or context.stageAttemptNumber() > 0)
+    stream = CopyRowStream((partition_id, *row) for row in rows)
+    column_list = ", ".join(quote_identifier(column) for column in [PARTITION_ID_COLUMN, *columns])
+    with closing(psycopg2.connect(**connection_kwargs)) as conn:
+        with conn, conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s), %s)", (table_name, partition_id))
+            if retried:
+                cursor.execute(
+                    f"DELETE FROM {table_name} WHERE {quote_identifier(PARTITION_ID_COLUMN)} = %s", (partition_id,)
+                )
+            cursor.copy_expert(f"COPY {table_name} ({column_list}) FROM STDIN", stream)
+    return stream.row_count, stream.byte_count
@@ -0,0 +1,180 @@
+import json
+import logging
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config.DBConfig import PostgresConfig
+from Spark import Spark4DataProc
+from Spark.CostaRica import CostaRica
+
+logger = logging.getLogger(__name__)
+
+# Country processors the service can run, keyed by the schema of the raw tables
+PROCESSORS = {"cr": CostaRica}
+
+
+class ProcessingService:
+    """
+    Keeps one warm SparkSession (with its reference-table cache) and runs table-processing
+    requests against it, so a table no longer pays for spark-submit, JVM startup and
+    executor allocation. Use master="local[*]" for a local stand-in.
+    """
+
+    def __init__(
+        self,
+        appName="DataProcessingService",
+        master="spark://spark-master:7077",
+        max_workers=1,
+        job_retention_seconds=3600,
+    ):
+        started = time.perf_counter()
+        self.proc = Spark4DataProc(
+            f"{PostgresConfig.HOST}:{PostgresConfig.PORT}",
+            PostgresConfig.USER,
+            PostgresConfig.PASSWORD,
+            appName,
+            master,
+        )
+        # Start the session now; the point of the service is that requests find it warm
+        self.proc.spark.sparkContext
+        self.startup_seconds = time.perf_counter() - started
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.jobs = {}
+        self.job_retention_seconds = job_retention_seconds
+        self._lock = threading.Lock()
+
+    def submit(self, table_name, country="cr", mode="fused"):
+        """Queues a table for processing and returns its job id."""
+        if country not in PROCESSORS:
+            raise ValueError(f"Unknown country: {country}")
+        if mode not in ("fused", "incremental"):
+            raise ValueError(f"Unknown mode: {mode}")
+
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._evict_finished_jobs()
+            self.jobs[job_id] = {
+                "job_id": job_id,
+                "table": table_name,
+                "country": country,
+                "mode": mode,
+                "status": "queued",
+                "queued_at": time.time(),
+            }
+        self.pool.submit(self._run, job_id)
+        return job_id
+
+    def _evict_finished_jobs(self):
+        """Forgets jobs that finished more than job_retention_seconds ago (callers hold the lock)."""
+        oldest = time.time() - self.job_retention_seconds
+        for job_id in [
+            job_id for job_id, job in self.jobs.items()
+            if job["status"] in ("succeeded", "failed") and job.get("finished_at", time.time()) < oldest
+        ]:
+            del self.jobs[job_id]
+
+    def status(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self.jobs[job_id].update(fields)
+
+    def _run(self, job_id):
+        job = self.status(job_id)
+        started = time.perf_counter()
+        self._update(job_id, status="running", started_at=time.time())
+        try:
+            processor = PROCESSORS[job["country"]](
+                table_name=job["table"],
+                spark=self.proc.spark,
+                reference_cache=self.proc.reference_cache,
+            )
+            processor.spark.sparkContext.setJobGroup(job_id, f"{job['mode']} {job['table']}")
+
+            # Time from request start until the session delivers the first raw row
+            processor.read_table(processor.raw_table, processor.database).limit(1).collect()
+            self._update(job_id, time_to_first_row=time.perf_counter() - started)
+
+            if job["mode"] == "incremental":
+                processed_rows = processor.process_incremental()
+                self._update(job_id, processed_rows=processed_rows)
+                if processed_rows:
+                    processor.comprehensive_checks()
+            else:
+                processor.process_fused()
+                processor.comprehensive_checks()
+            self._update(job_id, status="succeeded")
+        except Exception as error:
+            logger.exception(f"Processing {job['table']} failed")
+            self._update(
+                job_id,
+                status="failed",
+                error=str(error),
+                traceback=traceback.format_exc(),
+            )
+        finally:
+            self._update(job_id, seconds=time.perf_counter() - started, finished_at=time.time())
+
+    def serve(self, host="0.0.0.0", port=8099):
+        """Serves the HTTP API until interrupted."""
+        server = ThreadingHTTPServer((host, port), make_handler(self))
+        logger.info(f"Processing service ready on {host}:{port} after {self.startup_seconds:.1f}s")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            self.pool.shutdown(wait=True)
+
+
+def make_handler(service):
+    """
+    Builds the request handler:
+        POST /jobs {"table": ..., "country": "cr", "mode": "fused" | "incremental"} -> 202 {"job_id": ...}
+        GET  /jobs/<job_id> -> job status with timings
+        GET  /health -> session startup time
+    """
+
+    class ProcessingRequestHandler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == "/health":
+                return self._send(200, {"status": "ok", "startup_seconds": service.startup_seconds})
+            if self.path.startswith("/jobs/"):
+                job = service.status(self.path[len("/jobs/"):])
+                if job:
+                    return self._send(200, job)
+            return self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/jobs":
+                return self._send(404, {"error": "not found"})
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                job_id = service.submit(
+                    request["table"],
+                    country=request.get("country", "cr"),
+                    mode=request.get("mode", "fused"),
+                )
+            except (KeyError, ValueError) as error:
+                return self._send(400, {"error": str(error)})
+            return self._send(202, {"job_id": job_id})
+
+        def log_message(self, format, *args):
+            logger.info(format % args)
+
+    return ProcessingRequestHandler
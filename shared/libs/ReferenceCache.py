@@ -0,0 +1,130 @@
+import threading
+import time
+import uuid
+from contextlib import closing
+
+import psycopg2
+from config.TablesConfig import ReferenceCacheConfig
+from pyspark.sql import DataFrame
+from pyspark.sql.functions import broadcast
+from Spark.HadoopFS import HadoopFileSystem
+
+# Directories being written by a run, named <prefix><start time in ms>_<random id>
+TEMP_PREFIX = "_tmp_"
+
+
+class ReferenceTableCache:
+    """
+    Loads small lookup tables (country, port, HS description, unit mappings) once per session
+    and keeps a Parquet snapshot of each across runs. A snapshot is reused as long as the
+    table's version (row count + max xmin) is unchanged, so Postgres only serves the cheap
+    version query instead of the whole table. Snapshots are stored as <publish time>_<version>
+    directories; publishing one only deletes those published before it. A long-lived session
+    checks a cached table's version again once it is ReferenceCacheConfig.REVALIDATE_SECONDS
+    old and reloads the table if it changed.
+    """
+
+    def __init__(self, proc, snapshot_path=ReferenceCacheConfig.SNAPSHOT_PATH):
+        self.proc = proc
+        self.snapshot_path = snapshot_path
+        # (database, table) -> (cached frame, version, monotonic time of the last version check)
+        self.frames = {}
+        self._fs = None
+        # A warm session may serve several tables at once
+        self._lock = threading.Lock()
+
+    @property
+    def fs(self):
+        if self._fs is None:
+            self._fs = HadoopFileSystem(self.proc.spark, self.snapshot_path)
+        return self._fs
+
+    def table_version(self, table_name, database_name):
+        """Returns a cheap version tag for the table, or None if it cannot be determined."""
+        try:
+            with closing(self.proc._pg_connection(database_name)) as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT count(*), coalesce(max(xmin::text::bigint), 0) FROM {table_name}"
+                )
+                row_count, max_xmin = cursor.fetchone()
+        except psycopg2.Error:
+            return None
+        return f"v{row_count}_{max_xmin}"
+
+    def _snapshots(self, table_dir):
+        """(publish time in ms, directory name, version) of the table's published snapshots, oldest first."""
+        snapshots = []
+        for name in self.fs.list_names(table_dir):
+            published, _, version = name.partition("_")
+            if published.isdigit():
+                snapshots.append((int(published), name, version))
+        return sorted(snapshots)
+
+    def _remove_stale(self, table_dir, published):
+        """
+        Deletes the snapshots published before the given publish time (not newer ones another
+        run may just have published) and temporary directories abandoned by failed writers.
+        """
+        for publish_time, name, _ in self._snapshots(table_dir):
+            if publish_time < published:
+                self.fs.delete(f"{table_dir}/{name}")
+        oldest_temp = published - ReferenceCacheConfig.TEMP_MAX_AGE_SECONDS * 1000
+        for name in self.fs.list_names(table_dir):
+            if name.startswith(TEMP_PREFIX):
+                started = name[len(TEMP_PREFIX):].partition("_")[0]
+                if started.isdigit() and int(started) < oldest_temp:
+                    self.fs.delete(f"{table_dir}/{name}")
+
+    def _load_snapshot(self, table_name, database_name, version) -> DataFrame:
+        if version is None:
+            return self.proc.read_table(table_name, database_name)
+
+        table_dir = self.fs.join(database_name, table_name)
+        current = [name for _, name, snapshot_version in self._snapshots(table_dir) if snapshot_version == version]
+        if current:
+            return self.proc.spark.read.parquet(f"{table_dir}/{current[-1]}")
+
+        # Every writer loads into a directory of its own and renames it into place, so a failed or
+        # concurrent run never leaves (or reads) a partial snapshot
+        started = int(time.time() * 1000)
+        temp_dir = f"{table_dir}/{TEMP_PREFIX}{started}_{uuid.uuid4().hex}"
+        self.proc.read_table(table_name, database_name).write.parquet(temp_dir)
+        published = int(time.time() * 1000)
+        snapshot_dir = f"{table_dir}/{published:013d}_{version}"
+        if not self.fs.rename(temp_dir, snapshot_dir):
+            self.fs.delete(temp_dir)
+            raise RuntimeError(f"Could not publish the {table_name} snapshot as {snapshot_dir}")
+        self._remove_stale(table_dir, published)
+        return self.proc.spark.read.parquet(snapshot_dir)
+
+    def frame(self, table_name, database_name) -> DataFrame:
+        """Returns the cached lookup table without a join hint."""
+        key = (database_name, table_name)
+        with self._lock:
+            cached = self.frames.get(key)
+            checked_at = time.monotonic()
+            if cached is not None and checked_at - cached[2] < ReferenceCacheConfig.REVALIDATE_SECONDS:
+                return cached[0]
+            version = self.table_version(table_name, database_name)
+            if cached is not None and version is not None and version == cached[1]:
+                self.frames[key] = (cached[0], version, checked_at)
+                return cached[0]
+
+            if ReferenceCacheConfig.ENABLED:
+                df = self._load_snapshot(table_name, database_name, version)
+            else:
+                df = self.proc.read_table(table_name, database_name)
+            if cached is not None:
+                cached[0].unpersist()
+            self.frames[key] = (df.cache(), version, checked_at)
+            return self.frames[key][0]
+
+    def get(self, table_name, database_name) -> DataFrame:
+        """Returns the cached, broadcast-hinted lookup table."""
+        return broadcast(self.frame(table_name, database_name))
+
+    def clear(self):
+        with self._lock:
+            for df, _, _ in self.frames.values():
+                df.unpersist()
+            self.frames = {}
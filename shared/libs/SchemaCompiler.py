@@ -0,0 +1,211 @@
+import hashlib
+
+from config.ShipmentFileConfig import ShipmentFileType
+from config.TablesConfig import RecordIdConfig
+from pyspark.sql import Column, Window
+from pyspark.sql.functions import coalesce, col, concat_ws, expr, lit, row_number, sha2, substring, when
+from pyspark.sql.types import DateType, FloatType, IntegerType
+
+# Column types used by the country specs: CostaRicaTypes ("STRING", ...) and ArgentinaTypes ("str", ...)
+SPEC_TYPES = {
+    "STRING": "string",
+    "STR": "string",
+    "TEXT": "string",
+    "INTEGER": "int",
+    "INT": "int",
+    "FLOAT": "float",
+    "DOUBLE": "double",
+    "DATE": "date",
+    "UUID": "uuid",
+}
+
+
+def column_reference(name, qualifier=None) -> Column:
+    """References a column by its exact name; raw names may contain dots, spaces or '#'."""
+    reference = "`" + name.replace("`", "``") + "`"
+    return col(f"{qualifier}.{reference}" if qualifier else reference)
+
+
+def parse_add_spec(spec):
+    """
+    Returns (spark type name, default) for an added column spec. CostaRicaTypes uses
+    (type, value) tuples where "" means null, ArgentinaTypes {"type": ..., "default": ...} dicts.
+    """
+    if isinstance(spec, dict):
+        column_type, default = spec["type"], spec.get("default")
+    else:
+        column_type, default = spec
+    if default == "":
+        default = None
+    return SPEC_TYPES.get(column_type.upper(), column_type.lower()), default
+
+
+# Separates the values hashed into a content-hash record id; nulls hash as NULL_MARKER
+RECORD_ID_SEPARATOR = "\x1f"
+NULL_MARKER = "\\N"
+# Hex digit ranges of the SHA-256 forming the 8-4-4-4-12 groups of a UUID-shaped id
+UUID_GROUPS = ((0, 8), (8, 12), (12, 16), (16, 20), (20, 32))
+
+
+def record_id_column(source_table, key_columns: list, ordinal: Column = None) -> Column:
+    """
+    Deterministic RECORD_ID: a UUID-shaped SHA-256 of the source table name, the line's key
+    values and its ordinal among the lines sharing them (see record_ordinal_column), so
+    recomputing a plan or reprocessing a table yields the same ids and lines repeating a key
+    still get distinct ids. Ordinal 0 is not hashed, so lines with a unique key, and the first
+    line of a repeated one, keep their id when lines repeating the key are added.
+    """
+    values = [lit(source_table)] + [coalesce(column.cast("string"), lit(NULL_MARKER)) for column in key_columns]
+    if ordinal is not None:
+        # concat_ws skips nulls
+        values.append(when(ordinal > 0, ordinal.cast("string")))
+    digest = sha2(concat_ws(RECORD_ID_SEPARATOR, *values), 256)
+    return concat_ws("-", *[substring(digest, start + 1, end - start) for start, end in UUID_GROUPS])
+
+
+def record_ordinal_column(line: Column, first_line: Column) -> Column:
+    """
+    Ordinal of a line among the lines sharing its key values: 0 for the key's first line
+    (first_line, the smallest RecordIdConfig.LINE_COLUMN of the key; null when the key does not
+    repeat), the line's own position for the others. Positions are unique and do not change with
+    the lines' values, so neither do the ordinals.
+    """
+    return when(first_line.isNull() | (line == first_line), lit(0)).otherwise(line)
+
+
+def record_ordinal_window(key_columns: list, order_columns: list) -> Column:
+    """
+    Fallback of record_ordinal_column for raw tables without line positions: the position (from
+    0) of a line among the lines with the same key values, ordered by all its columns. Lines that
+    tie are identical, so which of them gets which ordinal does not matter.
+    """
+    return row_number().over(Window.partitionBy(*key_columns).orderBy(*order_columns)) - 1
+
+
+def record_id(source_table, values, ordinal=0):
+    """Python counterpart of record_id_column for one row's key values and ordinal."""
+    parts = [source_table] + [NULL_MARKER if value is None else str(value) for value in values]
+    if ordinal:
+        parts.append(str(ordinal))
+    digest = hashlib.sha256(RECORD_ID_SEPARATOR.join(parts).encode("utf-8")).hexdigest()
+    return "-".join(digest[start:end] for start, end in UUID_GROUPS)
+
+
+def record_ordinals(keys, lines):
+    """Python counterpart of record_ordinal_column for lists of key tuples and line positions."""
+    first_lines = {}
+    for key, line in zip(keys, lines):
+        first_lines[key] = min(first_lines.get(key, line), line)
+    return [0 if line == first_lines[key] else line for key, line in zip(keys, lines)]
+
+
+def record_window_ordinals(keys, rows):
+    """Python counterpart of record_ordinal_window for lists of key tuples and whole rows."""
+    order = sorted(range(len(rows)), key=lambda index: tuple((value is not None, value) for value in rows[index]))
+    ordinals = [0] * len(rows)
+    seen = {}
+    for index in order:
+        ordinals[index] = seen.get(keys[index], 0)
+        seen[keys[index]] = ordinals[index] + 1
+    return ordinals
+
+
+def default_column(column_type, default) -> Column:
+    if column_type == "uuid":
+        return expr("uuid()")
+    return lit(default).cast(column_type)
+
+
+def type_default(validation_rules):
+    """Type of the null column added for a missing ShipmentFileType field, or None if it is left out."""
+    if "float" in validation_rules:
+        return FloatType()
+    if "date" in validation_rules:
+        return DateType()
+    if "integer" in validation_rules or "short" in validation_rules:
+        return IntegerType()
+    return None
+
+
+def plan_projection(columns, rename=None, add=None, column_specs=ShipmentFileType.fields):
+    """
+    Resolves a country type spec against the columns of the data, doing what rename_columns,
+    add_columns, add_columns_by_type and reorder_and_maintain_columns do one after the other:
+        - renames columns present in the data (missing source columns are ignored),
+        - adds the spec's extra columns with their typed defaults unless already present,
+        - adds typed null columns for missing float/date/integer ShipmentFileType fields,
+        - orders columns by column_no, keeping columns outside column_specs at the end.
+    Returns (name, source) pairs in output order, where source is one of
+    ("column", source name), ("default", type name, value) or ("null", DataType). The plan is
+    engine-independent: compile_projection turns it into Spark columns, PandasBackend into Series.
+    RecordIdConfig.LINE_COLUMN is left out.
+    """
+    projection = [(name, ("column", name)) for name in columns if name != RecordIdConfig.LINE_COLUMN]
+    for old_name, new_name in (rename or {}).items():
+        projection = [
+            (new_name if name == old_name else name, source) for name, source in projection
+        ]
+
+    present = {name for name, _ in projection}
+    for name, spec in (add or {}).items():
+        if name not in present:
+            projection.append((name, ("default",) + parse_add_spec(spec)))
+            present.add(name)
+
+    for name, specs in column_specs.items():
+        if name not in present:
+            data_type = type_default(specs["validation_rules"])
+            if data_type is not None:
+                projection.append((name, ("null", data_type)))
+                present.add(name)
+
+    ordered = sorted(
+        (item for item in projection if item[0] in column_specs),
+        key=lambda item: column_specs[item[0]]["column_no"],
+    )
+    return ordered + [item for item in projection if item[0] not in column_specs]
+
+
+def record_key_sources(plan, key_columns):
+    """
+    Source column names of the key columns in a projection plan; None for keys not in the data
+    (hashed as null). Data with none of the key columns is keyed by all its columns instead.
+    """
+    sources = {name: source[1] for name, source in plan if source[0] == "column"}
+    keys = [sources.get(column) for column in key_columns]
+    if all(key is None for key in keys):
+        return list(sources.values())
+    return keys
+
+
+def needs_record_id(plan, record_key):
+    """True if a projection plan computes content-hash record ids (see compile_projection)."""
+    return record_key is not None and any(source[:2] == ("default", "uuid") for _, source in plan)
+
+
+def compile_projection(
+    columns, rename=None, add=None, column_specs=ShipmentFileType.fields, record_key=None, ordinal: Column = None
+):
+    """
+    Compiles a country type spec (see plan_projection) into the column list of a single select.
+    With record_key = (source table, key columns) uuid columns get the deterministic record_id_column
+    of the key columns' source values instead of a random uuid(); ordinal tells apart the lines
+    repeating a key (see Spark4DataProc.record_ordinals), None when no key repeats.
+    """
+    plan = plan_projection(columns, rename, add, column_specs)
+    projection = []
+    for name, source in plan:
+        if source[0] == "column":
+            column = column_reference(source[1])
+        elif source[0] == "default" and source[1] == "uuid" and record_key is not None:
+            source_table, key_columns = record_key
+            keys = record_key_sources(plan, key_columns)
+            column = record_id_column(
+                source_table, [lit(None) if key is None else column_reference(key) for key in keys], ordinal
+            )
+        elif source[0] == "default":
+            column = default_column(source[1], source[2])
+        else:
+            column = lit(None).cast(source[1])
+        projection.append(column.alias(name))
+    return projection
@@ -0,0 +1,337 @@
+import hashlib
+import logging
+import math
+import uuid
+from array import array
+from contextlib import closing
+
+import numpy as np
+from config.TablesConfig import DedupeConfig
+from pyspark.sql import Column
+from pyspark.sql.functions import concat_ws, conv, sha2, substring, when
+from Spark.PostgresCopy import PARTITION_ID_COLUMN, copy_partition_rows, quote_identifier
+from Spark.SchemaCompiler import column_reference
+
+logger = logging.getLogger(__name__)
+
+# Separates the key values in the hashed string
+KEY_SEPARATOR = "\x1f"
+# Hex digits of the SHA-256 kept as key hash: 60 bits, always a positive bigint
+KEY_HASH_DIGITS = 15
+# Column carrying a written row's key hash to the task that writes it (see KeySink)
+KEY_HASH_COLUMN = "__key_hash"
+
+
+def key_hash_column(key_columns) -> Column:
+    """Spark expression of a shipment line's key hash; null unless every key column is set."""
+    columns = [column_reference(column) for column in key_columns]
+    hashed = conv(
+        substring(sha2(concat_ws(KEY_SEPARATOR, *[column.cast("string") for column in columns]), 256), 1, KEY_HASH_DIGITS),
+        16,
+        10,
+    ).cast("bigint")
+    complete = columns[0].isNotNull()
+    for column in columns[1:]:
+        complete = complete & column.isNotNull()
+    return when(complete, hashed)
+
+
+def key_hash(values):
+    """Python counterpart of key_hash_column for one row's key values (str() matches Spark's cast for the key types)."""
+    if any(value is None for value in values):
+        return None
+    digest = hashlib.sha256(KEY_SEPARATOR.join(str(value) for value in values).encode("utf-8")).hexdigest()
+    return int(digest[:KEY_HASH_DIGITS], 16)
+
+
+class BloomFilter:
+    """
+    Bit array Bloom filter over key hashes, with the k bit positions derived from one 60-bit hash
+    by double hashing. Vectorized with numpy so a whole partition is probed at once.
+    """
+
+    def __init__(self, bit_count, hash_count, bits=None, items=0):
+        self.bit_count = bit_count
+        self.hash_count = hash_count
+        self.bits = bits if bits is not None else np.zeros((bit_count + 7) // 8, dtype=np.uint8)
+        self.items = items
+
+    @classmethod
+    def for_capacity(cls, capacity, false_positive_rate):
+        capacity = max(capacity, 1)
+        bit_count = math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        hash_count = max(1, round(bit_count / capacity * math.log(2)))
+        return cls(bit_count, hash_count)
+
+    @property
+    def capacity(self):
+        """Items the filter holds at about the false positive rate it was sized for."""
+        return int(self.bit_count * math.log(2) / self.hash_count)
+
+    def _positions(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        low = hashes & np.uint64(0xFFFFFFFF)
+        high = (hashes >> np.uint64(32)) | np.uint64(1)
+        steps = np.arange(self.hash_count, dtype=np.uint64)
+        return (low[:, None] + steps[None, :] * high[:, None]) % np.uint64(self.bit_count)
+
+    def add(self, hashes):
+        positions = self._positions(hashes).ravel()
+        np.bitwise_or.at(
+            self.bits,
+            (positions >> np.uint64(3)).astype(np.int64),
+            (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)),
+        )
+        self.items += len(hashes)
+
+    def might_contain(self, hashes):
+        """Boolean array: False means the hash was never added, True that it probably was."""
+        if len(hashes) == 0:
+            return np.zeros(0, dtype=bool)
+        positions = self._positions(hashes)
+        set_bits = (self.bits[(positions >> np.uint64(3)).astype(np.int64)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return set_bits.all(axis=1)
+
+
+class KeySink:
+    """
+    Runs on the executors: records the key hashes of the rows a write task copies, with the
+    rows' row_id_column (a UUID), into the table's key staging table, so the keys of a processed
+    table are known once it is written without reading it back. The frame being written carries
+    the hash as its last column (column()); strip() removes it from the rows while collecting the
+    hashes and ids, copy() stages them. Staged partitions are replaced by a retried task like the
+    written rows (see copy_partition_rows).
+    """
+
+    def __init__(self, connection_kwargs, staged_table, key_columns, row_id_column):
+        self.connection_kwargs = connection_kwargs
+        self.staged_table = staged_table
+        self.key_columns = list(key_columns)
+        self.row_id_column = row_id_column
+
+    def column(self) -> Column:
+        return key_hash_column(self.key_columns).alias(KEY_HASH_COLUMN)
+
+    def strip(self, rows, hashes, row_ids):
+        """
+        The rows (Spark Rows) without their trailing key hash, which is appended to hashes (an
+        array("q")) and the row's id to row_ids (a bytearray, 16 bytes per id).
+        """
+        position = None
+        for row in rows:
+            if position is None:
+                position = row.__fields__.index(self.row_id_column)
+            if row[-1] is not None:
+                hashes.append(row[-1])
+                row_ids.extend(uuid.UUID(row[position]).bytes)
+            yield tuple(row[:-1])
+
+    def copy(self, partition_id, staged):
+        """Stages (key hash, row id) pairs."""
+        return copy_partition_rows(
+            partition_id,
+            ((int(value), row_id) for value, row_id in staged),
+            self.connection_kwargs,
+            self.staged_table,
+            ["key_hash", "row_id"],
+        )
+
+    def write_partition(self, partition_id, rows, write):
+        """Calls write with the partition's rows stripped of their hashes, then stages the hashes."""
+        hashes, row_ids = array("q"), bytearray()
+        result = write(self.strip(rows, hashes, row_ids))
+        self.copy(
+            partition_id,
+            ((value, uuid.UUID(bytes=bytes(row_ids[16 * index:16 * index + 16]))) for index, value in enumerate(hashes)),
+        )
+        return result
+
+    def stage_partition(self, partition_id, rows):
+        """Stages the hashes of rows holding only the row id and column(), for writers that cannot strip them."""
+        return self.write_partition(partition_id, rows, lambda stripped: sum(1 for _ in stripped))
+
+
+class ShipmentKeyIndex:
+    """
+    Persistent index of the shipment lines (key hashes of DedupeConfig key columns) already
+    processed for a country, kept in the country's meta schema where the DAG does not look for
+    raw tables:
+        - shipment_key_index: key_hash -> source table, hash-partitioned on key_hash,
+        - shipment_key_bloom: a Bloom filter over all indexed hashes,
+        - <table>_staged_keys: the hashes of a table being written (see KeySink).
+    New lines are first tested against the Bloom filter; only the probable duplicates are
+    looked up in the index, so the index is never scanned. A line is a duplicate if its key
+    was recorded by another table (reprocessing a table never drops its own lines). Tables are
+    probed and written without a lock; the keys a table recorded while another was being
+    processed are caught when the latter records its own (see record_staged).
+    """
+
+    def __init__(self, proc, country_code, database_name):
+        self.proc = proc
+        self.database_name = database_name
+        self.country_code = country_code.lower()
+        self.schema = DedupeConfig.SCHEMA.format(country_code=self.country_code)
+        self.index_table = DedupeConfig.INDEX_TABLE.format(country_code=self.country_code)
+        self.bloom_table = DedupeConfig.BLOOM_TABLE.format(country_code=self.country_code)
+
+    def staged_table(self, source_table):
+        return DedupeConfig.STAGED_TABLE.format(country_code=self.country_code, table_name=source_table)
+
+    def ensure_tables(self, cursor):
+        # Concurrent CREATE ... IF NOT EXISTS of the same table can still fail; serialize them
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"{self.schema}:ddl",))
+        cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {self.schema}")
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self.index_table} (
+                key_hash bigint PRIMARY KEY,
+                source_table text NOT NULL
+            ) PARTITION BY HASH (key_hash)
+            """
+        )
+        for remainder in range(DedupeConfig.HASH_PARTITIONS):
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.index_table}_p{remainder} PARTITION OF {self.index_table} "
+                f"FOR VALUES WITH (MODULUS {DedupeConfig.HASH_PARTITIONS}, REMAINDER {remainder})"
+            )
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self.bloom_table} (
+                id integer PRIMARY KEY,
+                bit_count bigint NOT NULL,
+                hash_count integer NOT NULL,
+                items bigint NOT NULL,
+                bits bytea NOT NULL
+            )
+            """
+        )
+
+    def load_bloom(self):
+        """The current Bloom filter, or None while nothing has been indexed."""
+        with closing(self.proc._pg_connection(self.database_name)) as conn:
+            with conn, conn.cursor() as cursor:
+                self.ensure_tables(cursor)
+                cursor.execute(f"SELECT bit_count, hash_count, items, bits FROM {self.bloom_table} WHERE id = 1")
+                row = cursor.fetchone()
+        if row is None:
+            return None
+        bit_count, hash_count, items, bits = row
+        return BloomFilter(bit_count, hash_count, np.frombuffer(bytes(bits), dtype=np.uint8).copy(), items)
+
+    def duplicates(self, hashes, source_table) -> set:
+        """The hashes (probable duplicates) that the index holds for a table other than source_table."""
+        hashes = list(hashes)
+        found = set()
+        with closing(self.proc._pg_connection(self.database_name)) as conn, conn.cursor() as cursor:
+            for start in range(0, len(hashes), DedupeConfig.PROBE_BATCH):
+                cursor.execute(
+                    f"SELECT key_hash FROM {self.index_table} "
+                    "WHERE key_hash = ANY(%s::bigint[]) AND source_table <> %s",
+                    (hashes[start:start + DedupeConfig.PROBE_BATCH], source_table),
+                )
+                found.update(row[0] for row in cursor.fetchall())
+        return found
+
+    def sink(self, source_table, key_columns, row_id_column) -> KeySink:
+        """(Re)creates source_table's staging table and returns the KeySink its write records its key hashes with."""
+        staged_table = self.staged_table(source_table)
+        with closing(self.proc._pg_connection(self.database_name)) as conn:
+            with conn, conn.cursor() as cursor:
+                self.ensure_tables(cursor)
+                cursor.execute(f"DROP TABLE IF EXISTS {staged_table}")
+                cursor.execute(
+                    f"CREATE UNLOGGED TABLE {staged_table} ({quote_identifier(PARTITION_ID_COLUMN)} integer NOT NULL, "
+                    "key_hash bigint NOT NULL, row_id uuid NOT NULL)"
+                )
+        return KeySink(self.proc._pg_connection_kwargs(self.database_name), staged_table, key_columns, row_id_column)
+
+    def _add_scanned(self, cursor, bloom, query):
+        """Adds the hashes a query returns to bloom, read in batches with a server-side cursor."""
+        with cursor.connection.cursor(name="shipment_key_scan") as scan:
+            scan.itersize = DedupeConfig.PROBE_BATCH
+            scan.execute(query)
+            while True:
+                rows = scan.fetchmany(DedupeConfig.PROBE_BATCH)
+                if not rows:
+                    break
+                bloom.add(np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)))
+        return bloom
+
+    def record_staged(self, source_table, target_table, key_sink: KeySink, mode=DedupeConfig.MODE) -> int:
+        """
+        Adds the key hashes staged by key_sink that the index lacks, as keys of source_table, and
+        drops the staging table; returns the number of keys added. Keys another table recorded
+        since source_table was probed are rechecked first: their rows are dropped from (or flagged
+        in) target_table, the table source_table was written to. The recheck and the recording run
+        in one transaction under the country's dedupe lock, so tables recorded at the same time
+        see each other's keys. The Bloom filter is updated with just the added keys; it is rebuilt
+        twice as large once it would hold more than its capacity.
+        """
+        staged_table = key_sink.staged_table
+        with closing(self.proc._pg_connection(self.database_name)) as conn:
+            with conn, conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (self.index_table,))
+                self.ensure_tables(cursor)
+                cursor.execute(
+                    f"""
+                    CREATE TEMPORARY TABLE late_duplicates ON COMMIT DROP AS
+                    SELECT DISTINCT staged.row_id FROM {staged_table} AS staged
+                    JOIN {self.index_table} AS indexed ON indexed.key_hash = staged.key_hash
+                    WHERE indexed.source_table <> %s
+                    """,
+                    (source_table,),
+                )
+                if cursor.rowcount:
+                    late_rows = cursor.rowcount
+                    row_id = quote_identifier(key_sink.row_id_column)
+                    # Compared as text, the type the id is written with, so an index on it is used
+                    condition = f"{row_id} IN (SELECT row_id::text FROM late_duplicates)"
+                    if mode == "flag":
+                        cursor.execute(
+                            f"UPDATE {target_table} SET {quote_identifier(DedupeConfig.FLAG_COLUMN)} = true WHERE {condition}"
+                        )
+                    else:
+                        cursor.execute(f"DELETE FROM {target_table} WHERE {condition}")
+                    logger.warning(f"{source_table}: {late_rows} lines recorded by another table while it was processed")
+                    self.proc.run_metrics.add(late_duplicates=late_rows)
+                cursor.execute(
+                    f"""
+                    CREATE TEMPORARY TABLE new_keys ON COMMIT DROP AS
+                    SELECT DISTINCT staged.key_hash FROM {staged_table} AS staged
+                    WHERE NOT EXISTS (SELECT 1 FROM {self.index_table} AS indexed WHERE indexed.key_hash = staged.key_hash)
+                    """
+                )
+                cursor.execute(
+                    f"INSERT INTO {self.index_table} (key_hash, source_table) SELECT key_hash, %s FROM new_keys",
+                    (source_table,),
+                )
+                inserted = cursor.rowcount
+
+                cursor.execute(f"SELECT bit_count, hash_count, items, bits FROM {self.bloom_table} WHERE id = 1")
+                row = cursor.fetchone()
+                if row is None:
+                    bloom = BloomFilter.for_capacity(
+                        max(DedupeConfig.BLOOM_CAPACITY, 2 * inserted), DedupeConfig.BLOOM_FALSE_POSITIVE_RATE
+                    )
+                    self._add_scanned(cursor, bloom, "SELECT key_hash FROM new_keys")
+                else:
+                    bit_count, hash_count, items, bits = row
+                    bloom = BloomFilter(bit_count, hash_count, np.frombuffer(bytes(bits), dtype=np.uint8).copy(), items)
+                    if bloom.items + inserted > bloom.capacity:
+                        bloom = BloomFilter.for_capacity(
+                            2 * (bloom.items + inserted), DedupeConfig.BLOOM_FALSE_POSITIVE_RATE
+                        )
+                        self._add_scanned(cursor, bloom, f"SELECT key_hash FROM {self.index_table}")
+                    else:
+                        self._add_scanned(cursor, bloom, "SELECT key_hash FROM new_keys")
+                cursor.execute(
+                    f"""
+                    INSERT INTO {self.bloom_table} (id, bit_count, hash_count, items, bits)
+                    VALUES (1, %s, %s, %s, %s)
+                    ON CONFLICT (id) DO UPDATE SET bit_count = EXCLUDED.bit_count,
+                        hash_count = EXCLUDED.hash_count, items = EXCLUDED.items, bits = EXCLUDED.bits
+                    """,
+                    (bloom.bit_count, bloom.hash_count, bloom.items, bloom.bits.tobytes()),
+                )
+                cursor.execute(f"DROP TABLE {staged_table}")
+        return inserted
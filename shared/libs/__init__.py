@@ -1,50 +1,198 @@
+import datetime
+import json
+import logging
+import math
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import reduce
+from itertools import groupby
+
+import numpy as np
+import psycopg2
+from config.CompanyFileConfig import CompanyFileType, CompanyMasterConfig
 from config.CountryCodeConfig import CountryCodes
+from config.DBConfig import JDBCReadConfig, JDBCWriteConfig
+from config.TablesConfig import (
+	ApproxChecksConfig,
+	BulkExportConfig,
+	CountryLookupConfig,
+	DedupeConfig,
+	EnrichConfig,
+	HSCodeLookupConfig,
+	MonthPartitionConfig,
+	RecordIdConfig,
+)
 from config.ShipmentFileConfig import ShipmentFileType
-from pyspark import SparkConf, SparkContext, SQLContext
-from pyspark.sql import DataFrame, Row, SparkSession
+from pyspark import SparkConf, SparkContext, SQLContext, StorageLevel
+from pyspark.sql import Column, DataFrame, Row, SparkSession
 from pyspark.sql.functions import (
+	approx_count_distinct,
+	array,
+	broadcast,
 	coalesce,
 	col,
+	collect_set,
+	count,
+	create_map,
+	explode,
 	expr,
 	length,
 	lit,
+	map_contains_key,
+	map_from_arrays,
+	pmod,
 	regexp_replace,
+	struct,
+	substring,
+	to_json,
 	trim,
+	trunc,
 	when,
+	xxhash64,
 )
+from pyspark.sql.functions import min as min_
+from pyspark.sql.functions import sum as sum_
 from pyspark.sql.types import (
 	DateType,
+	DoubleType,
 	FloatType,
 	IntegerType,
 	StringType,
 	StructField,
 	StructType,
 )
+from Spark.PostgresCopy import (
+	PARTITION_ID_COLUMN,
+	copy_partition_rows,
+	copy_rows,
+	create_table_sql,
+	quote_identifier,
+	split_table_name,
+)
+from Spark.ApproximateChecks import (
+	Estimate,
+	SampledValues,
+	derive_values,
+	estimate_cardinality,
+	estimate_count,
+	rate_error,
+	required_sample_rows,
+	z_score,
+)
+from Spark.BulkExport import BulkSender, ChunkWriter, write_manifest
+from Spark.CountryLookup import config_country_maps, table_country_maps
+from Spark.Enrichment import lookup, plan_lookups
+from Spark.HSCodeIndex import HSPrefixIndex
+from Spark.Instrumentation import RunMetrics, instrument_class
+from Spark.MonthPartitions import MonthPartitionedTable, month_order, month_start, sort_key
+from Spark.ReferenceCache import ReferenceTableCache
+from Spark.SchemaCompiler import (
+	column_reference,
+	compile_projection,
+	needs_record_id,
+	plan_projection,
+	record_key_sources,
+	record_ordinal_column,
+	record_ordinal_window,
+)
+from Spark.ShipmentDedupe import key_hash_column
+
+logger = logging.getLogger(__name__)
+
+# Characters stripped from company names before TA code matching
+COMPANY_NAME_STRIP_PATTERN = r"[.,\-\"'&/#() +:<>]"
+# TA codes are a country code followed by exactly 8 digits
+TA_CODE_PATTERN = r"^[A-Z]{2}\d{8}$"
+
+
+def hs_description_lookup(country_code):
+	"""HS_CODE -> description and replacement code from the country's HS description table."""
+	return lookup(
+		f"{country_code}_hs_desc",
+		"HS_DESC",
+		{"HS_CODE": "HS_CODE"},
+		{
+			"HS_CODE_DESCRIPTION": ("HS_CODE_DESC", "prefer_lookup"),
+			"HS_CODE": ("new_HS_CODE", "prefer_lookup"),
+		},
+	)
+
+
+def unit_lookup(country_code, unit_column="QUANTITY_UNIT"):
+	"""Raw unit -> normalized unit (Yeni_Birim), QUANTITY scaled by the unit's Aksiyon factor."""
+	return lookup(
+		f"{country_code}_unit_of_quantity",
+		"UNIT_OF_QUANTITY",
+		{unit_column: "UNIT_OF_QUANTITY"},
+		{unit_column: ("Yeni_Birim", "prefer_lookup"), "QUANTITY": ("Aksiyon", "multiply")},
+	)
 
 
 class Spark4DataProc:
-	def __init__(self, url, user, password, appName="SQL_to_PySpark") -> None:
+	def __init__(
+		self,
+		url,
+		user,
+		password,
+		appName="SQL_to_PySpark",
+		master="spark://spark-master:7077",
+		spark=None,
+		reference_cache=None,
+	) -> None:
+		"""
+        Pass an existing SparkSession (and optionally its ReferenceTableCache) to reuse a warm
+        session; such a session is left running when this object goes away. Otherwise the
+        session is only started when first used, so work done without Spark (the pandas
+        backend for small tables) never starts an application.
+        """
 		self.url = url
 		self.user = user
 		self.password = password
 		self.driver = "org.postgresql.Driver"
-
-		conf = SparkConf() \
-			.setAppName(appName) \
-			.setMaster("spark://spark-master:7077") \
-			.set("spark.sql.execution.arrow.pyspark.enabled", "true") \
-			.set("spark.hadoop.mapreduce.fileoutputcommitter.marksuccessfuljobs", "false") \
-			.set("spark.driver.maxResultSize", "32g") \
-			.set('spark.rapids.sql.enabled', 'true')
-
-		sc = SparkContext(conf=conf)
-		sqlContext = SQLContext(sc)
-		self.spark = sqlContext.sparkSession
+		self.appName = appName
+		self.master = master
+		self._owns_session = spark is None
+		self._spark = spark
+		self.reference_cache = reference_cache or ReferenceTableCache(self)
+		self.run_metrics = RunMetrics(self)
+		self.hs_prefix_indexes = {}
+		# Frames persisted while a plan is built, released once it is written
+		self.plan_frames = []
 
 		# self.spark = SparkSession.builder.appName(appName).config("spark.jars", "/opt/bitnami/spark/jars/postgresql-42.2.24.jar").getOrCreate()
 
+	@property
+	def spark(self):
+		if self._spark is None:
+			conf = SparkConf() \
+				.setAppName(self.appName) \
+				.setMaster(self.master) \
+				.set("spark.sql.execution.arrow.pyspark.enabled", "true") \
+				.set("spark.hadoop.mapreduce.fileoutputcommitter.marksuccessfuljobs", "false") \
+				.set("spark.driver.maxResultSize", "32g") \
+				.set("spark.speculation", "false") \
+				.set('spark.rapids.sql.enabled', 'true')
+
+			sc = SparkContext(conf=conf)
+			sqlContext = SQLContext(sc)
+			self._spark = sqlContext.sparkSession
+		return self._spark
+
+	@property
+	def has_session(self):
+		"""Whether a SparkSession has been started (or was passed in) for this object."""
+		return self._spark is not None
+
+	def __init_subclass__(cls, **kwargs):
+		# Country processors' steps (update_columns, comprehensive_checks, ...) are recorded too
+		super().__init_subclass__(**kwargs)
+		instrument_class(cls)
+
 	def __del__(self):
-		self.spark.stop()
+		if getattr(self, "_owns_session", False) and self._spark is not None:
+			self._spark.stop()
 
 	def __get_jdbc_options(self, table_name, database_name):
 		"""Internal method to get JDBC options for reading/writing tables."""
@@ -56,17 +204,713 @@ class Spark4DataProc:
 			"driver": self.driver,
 		}
 
-	def read_table(self, table_name, database_name) -> DataFrame:
-		"""Read a table from the specified SQL Server database."""
+	def _pg_connection_kwargs(self, database_name):
+		"""Internal method to get psycopg2 connection arguments, also shipped to executors."""
+		host, _, port = self.url.partition(":")
+		return {
+			"host": host,
+			"port": port or "5432",
+			"dbname": database_name,
+			"user": self.user,
+			"password": self.password,
+		}
+
+	def _pg_connection(self, database_name):
+		"""Internal method to open a driver-side psycopg2 connection to the given database."""
+		return psycopg2.connect(**self._pg_connection_kwargs(database_name))
+
+	def _existing_tables(self, table_names, database_name) -> set:
+		"""Internal method returning which of the given tables exist in the database."""
+		with closing(self._pg_connection(database_name)) as conn, conn.cursor() as cursor:
+			cursor.execute(
+				"SELECT name FROM unnest(%s::text[]) AS name WHERE to_regclass(name) IS NOT NULL",
+				(list(table_names),),
+			)
+			return {row[0] for row in cursor.fetchall()}
+
+	def __probe_table(self, table_name, database_name):
+		"""
+        Internal method returning column types and on-disk size of a table (summed over the partitions
+        of a partitioned table), or None if it is not a relation.
+        """
+		try:
+			with closing(self._pg_connection(database_name)) as conn, conn.cursor() as cursor:
+				cursor.execute(
+					"""
+					SELECT a.attname, t.typname,
+					       (SELECT coalesce(sum(pg_relation_size(relid)), 0) FROM pg_partition_tree(c.oid))::bigint,
+					       current_setting('block_size')::int
+					FROM pg_class c
+					JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+					JOIN pg_type t ON t.oid = a.atttypid
+					WHERE c.oid = to_regclass(%s)
+					ORDER BY a.attnum
+					""",
+					(table_name,),
+				)
+				rows = cursor.fetchall()
+		except psycopg2.Error:
+			# Subqueries and names Postgres cannot resolve are read without partitioning
+			return None
+		if not rows:
+			return None
+		return {
+			"columns": {name: type_name for name, type_name, _, _ in rows},
+			"size": rows[0][2],
+			"block_size": rows[0][3],
+		}
+
+	def __pick_partition_column(self, table_name, columns, partition_column=None):
+		"""Internal method choosing a numeric/date split column from configuration or by probing."""
+		candidates = [
+			partition_column or JDBCReadConfig.PARTITION_COLUMNS.get(table_name)
+		] + JDBCReadConfig.PARTITION_COLUMN_CANDIDATES
+		for candidate in candidates:
+			if candidate and columns.get(candidate) in JDBCReadConfig.SPLITTABLE_TYPES:
+				return candidate
+		return None
+
+	def __get_partition_bounds(self, table_name, database_name, column_name, column_type):
+		"""Internal method returning (lower, upper) bounds of a split column as JDBC option strings."""
+		with closing(self._pg_connection(database_name)) as conn, conn.cursor() as cursor:
+			cursor.execute(
+				f'SELECT min("{column_name}"), max("{column_name}") FROM {table_name}'
+			)
+			lower, upper = cursor.fetchone()
+		if lower is None or upper is None:
+			return None
+		if column_type in ("date", "timestamp", "timestamptz"):
+			return str(lower), str(upper)
+		# Spark parses numeric bounds as longs
+		return str(math.floor(lower)), str(math.ceil(upper))
+
+	def __get_ctid_predicates(self, size, block_size, num_partitions):
+		"""Internal method splitting the heap into page ranges, used when no split column exists."""
+		pages = max(1, size // block_size)
+		step = math.ceil(pages / num_partitions)
+		predicates = []
+		for start in range(0, pages, step):
+			predicate = f"ctid >= '({start},0)'::tid"
+			if start + step < pages:
+				predicate += f" AND ctid < '({start + step},0)'::tid"
+			predicates.append(predicate)
+		return predicates
+
+	def read_table(
+		self,
+		table_name,
+		database_name,
+		partition_column=None,
+		num_partitions=None,
+		fetch_size=JDBCReadConfig.FETCH_SIZE,
+		partitioned=True,
+	) -> DataFrame:
+		"""
+        Read a table from the specified PostgreSQL database.
+        Large tables are read as several concurrent JDBC queries, split on a numeric/date column
+        (configured or probed) or, when the table has none, on ctid page ranges.
+        """
 		options = self.__get_jdbc_options(table_name, database_name)
+		options["fetchsize"] = str(fetch_size)
+
+		table_info = self.__probe_table(table_name, database_name) if partitioned else None
+		if not table_info or table_info["size"] < JDBCReadConfig.MIN_PARTITIONED_BYTES:
+			return self.spark.read.format("jdbc").options(**options).load()
+
+		if not num_partitions:
+			max_partitions = (
+				JDBCReadConfig.MAX_PARTITIONS
+				or self.spark.sparkContext.defaultParallelism
+			)
+			num_partitions = min(
+				max_partitions,
+				math.ceil(table_info["size"] / JDBCReadConfig.TARGET_PARTITION_BYTES),
+			)
+		if num_partitions < 2:
+			return self.spark.read.format("jdbc").options(**options).load()
+
+		column_name = self.__pick_partition_column(
+			table_name, table_info["columns"], partition_column
+		)
+		if column_name:
+			bounds = self.__get_partition_bounds(
+				table_name, database_name, column_name, table_info["columns"][column_name]
+			)
+			if bounds:
+				options.update(
+					{
+						"partitionColumn": column_name,
+						"lowerBound": bounds[0],
+						"upperBound": bounds[1],
+						"numPartitions": str(num_partitions),
+					}
+				)
+				return self.spark.read.format("jdbc").options(**options).load()
+
+		predicates = self.__get_ctid_predicates(
+			table_info["size"], table_info["block_size"], num_partitions
+		)
+		url = options.pop("url")
+		dbtable = options.pop("dbtable")
+		return self.spark.read.jdbc(url, dbtable, predicates=predicates, properties=options)
+
+	def read_table_sample(
+		self, table_name, database_name, fraction, seed=None, method=ApproxChecksConfig.SAMPLE_METHOD
+	) -> DataFrame:
+		"""
+        Reads a TABLESAMPLE of the table: Postgres draws the sample, so only the sampled rows
+        cross the JDBC connection. method is BERNOULLI (each row with probability fraction) or
+        SYSTEM (whole pages, which also skips reading the others).
+        """
+		options = self.__get_jdbc_options(table_name, database_name)
+		repeatable = f" REPEATABLE ({int(seed)})" if seed is not None else ""
+		options["dbtable"] = (
+			f"(SELECT * FROM {table_name} TABLESAMPLE {method} ({fraction * 100!r}){repeatable}) AS sampled"
+		)
+		options["fetchsize"] = str(JDBCReadConfig.FETCH_SIZE)
 		return self.spark.read.format("jdbc").options(**options).load()
 
 	def write_table(
-		self, df: DataFrame, table_name, database_name, mode="overwrite"
+		self,
+		df: DataFrame,
+		table_name,
+		database_name,
+		mode="overwrite",
+		method=JDBCWriteConfig.METHOD,
+		key_columns=None,
+		key_sink=None,
 	) -> None:
-		"""Write a DataFrame to the specified SQL Server database table."""
-		options = self.__get_jdbc_options(table_name, database_name)
-		df.write.format("jdbc").options(**options).mode(mode).save()
+		"""
+        Write a DataFrame to the specified PostgreSQL database table.
+        mode="upsert" updates the changed rows matching key_columns and inserts the rest, mode="merge"
+        also deletes the rows whose key is no longer present, mode="partition_swap" overwrites the
+        table as month partitions (see write_month_partitions), mode="partition_merge" merges into
+        the month partitions (partition_swap while the table is not partitioned yet) (COPY method only).
+        With a key_sink (see ShipmentKeyIndex.sink) the key hashes of the written rows are staged too.
+        """
+		try:
+			if method == "copy":
+				return self.copy_write_table(
+					df, table_name, database_name, mode=mode, key_columns=key_columns, key_sink=key_sink
+				)
+			options = self.__get_jdbc_options(table_name, database_name)
+			df.write.format("jdbc").options(**options).mode(mode).save()
+			if key_sink is not None:
+				# The JDBC writer cannot hand the hashes over; they take a pass of their own
+				df.select(column_reference(key_sink.row_id_column), key_sink.column()).rdd.mapPartitionsWithIndex(
+					lambda partition_id, rows: [key_sink.stage_partition(partition_id, rows)]
+				).collect()
+		finally:
+			self.release_plan_frames()
+
+	def persist_until_written(self, df: DataFrame) -> DataFrame:
+		"""
+        Persists a frame that a step runs an action on while the plan is being built, so the
+        final write reads it back instead of evaluating the plan up to it a second time.
+        It is released by the next write_table.
+        """
+		df = df.persist(StorageLevel.MEMORY_AND_DISK)
+		self.plan_frames.append(df)
+		return df
+
+	def release_plan_frames(self) -> None:
+		for df in self.plan_frames:
+			df.unpersist()
+		self.plan_frames = []
+
+	def copy_write_table(
+		self, df: DataFrame, table_name, database_name, mode="overwrite", key_columns=None, key_sink=None
+	) -> None:
+		"""
+        Bulk-loads the DataFrame with COPY FROM STDIN into a staging table (one transaction per partition,
+        which a retried task replaces, see copy_partition_rows), then swaps it in for the live table (overwrite), inserts it into the live table (append) or
+        merges it on key_columns (upsert, merge) in a single transaction, so the live table is never seen
+        truncated or half-written.
+        """
+		if mode == "partition_merge":
+			mode = self.__partition_merge_mode(table_name, database_name)
+		if mode == "partition_swap":
+			return self.write_month_partitions(df, table_name, database_name, key_sink=key_sink)
+		if mode not in ("overwrite", "append", "upsert", "merge"):
+			raise ValueError(f"Unsupported write mode for COPY: {mode}")
+		if mode in ("upsert", "merge") and not key_columns:
+			raise ValueError(f"{mode.capitalize()} mode requires key_columns")
+
+		staging_table = self.__create_staging_table(table_name, database_name, df.schema, partition_ids=True)
+		connection_kwargs = self._pg_connection_kwargs(database_name)
+		columns = df.columns
+		if key_sink is not None:
+			# Hashed by the tasks writing the rows, as a trailing column they strip off
+			df = df.select("*", key_sink.column())
+
+		def load_partition(partition_id, rows):
+			def write(rows):
+				return copy_partition_rows(partition_id, rows, connection_kwargs, staging_table, columns)
+
+			yield key_sink.write_partition(partition_id, rows, write) if key_sink else write(rows)
+
+		try:
+			# Counted from the collected results, one per partition however often a task was retried
+			loaded = df.rdd.mapPartitionsWithIndex(load_partition).collect()
+			self.run_metrics.add(
+				rows_written=sum(row_count for row_count, _ in loaded),
+				copy_bytes=sum(byte_count for _, byte_count in loaded),
+			)
+			self.__swap_staging_table(
+				staging_table, table_name, database_name, columns, mode, key_columns
+			)
+		except Exception:
+			self.__drop_table(staging_table, database_name)
+			raise
+
+	def copy_write_rows(
+		self, rows, schema: StructType, table_name, database_name, mode="overwrite", key_columns=None
+	) -> None:
+		"""
+        Driver-side counterpart of copy_write_table for rows that are not in Spark (the pandas backend):
+        the same staging table, column types and publishing, loaded with a single COPY.
+        """
+		if mode == "partition_merge":
+			mode = self.__partition_merge_mode(table_name, database_name)
+		if mode == "partition_swap":
+			return self.write_month_partition_rows(rows, schema, table_name, database_name)
+		if mode not in ("overwrite", "append", "upsert", "merge"):
+			raise ValueError(f"Unsupported write mode for COPY: {mode}")
+		if mode in ("upsert", "merge") and not key_columns:
+			raise ValueError(f"{mode.capitalize()} mode requires key_columns")
+
+		staging_table = self.__create_staging_table(table_name, database_name, schema)
+		columns = schema.fieldNames()
+		try:
+			row_count, byte_count = copy_rows(
+				rows, self._pg_connection_kwargs(database_name), staging_table, columns
+			)
+			self.run_metrics.add(rows_written=row_count, copy_bytes=byte_count)
+			self.__swap_staging_table(
+				staging_table, table_name, database_name, columns, mode, key_columns
+			)
+		except Exception:
+			self.__drop_table(staging_table, database_name)
+			raise
+
+	def write_month_partitions(
+		self, df: DataFrame, table_name, database_name, partition_column=MonthPartitionConfig.PARTITION_COLUMN, key_sink=None
+	) -> None:
+		"""
+        Overwrites table_name as a table partitioned by month of partition_column (see MonthPartitionedTable).
+        The rows are hashed by month and a hash of the whole row (splitting every month into
+        MonthPartitionConfig.WRITERS_PER_MONTH slices) into MonthPartitionConfig.WRITERS tasks and
+        sorted on MonthPartitionConfig.SORT_COLUMNS, so a month is streamed by several concurrent
+        COPYs, each in order, into its own detached table; the months are then attached in one transaction.
+        """
+		table = MonthPartitionedTable(table_name, df.schema, partition_column)
+		connection_kwargs = self._pg_connection_kwargs(database_name)
+		columns = df.columns
+		position = columns.index(partition_column)
+		month_slice = pmod(xxhash64(*[column_reference(column) for column in columns]), lit(MonthPartitionConfig.WRITERS_PER_MONTH))
+		if key_sink is not None:
+			df = df.select("*", key_sink.column())
+
+		def load_partition(partition_id, rows):
+			def write(rows):
+				# Sorted on the partition column first, so each month's rows are contiguous
+				return [
+					(month, *table.load_month(connection_kwargs, month, month_rows, columns, partition_id))
+					for month, month_rows in groupby(rows, key=lambda row: month_start(row[position]))
+				]
+
+			return key_sink.write_partition(partition_id, rows, write) if key_sink else write(rows)
+
+		ordered = df.repartition(
+			MonthPartitionConfig.WRITERS, trunc(col(partition_column), "month"), month_slice
+		).sortWithinPartitions(*MonthPartitionConfig.SORT_COLUMNS)
+		self.__publish_month_partitions(
+			table, database_name, lambda: ordered.rdd.mapPartitionsWithIndex(load_partition).collect()
+		)
+
+	def write_month_partition_rows(
+		self, rows, schema: StructType, table_name, database_name, partition_column=MonthPartitionConfig.PARTITION_COLUMN
+	) -> None:
+		"""Driver-side counterpart of write_month_partitions for rows that are not in Spark (the pandas backend)."""
+		table = MonthPartitionedTable(table_name, schema, partition_column)
+		connection_kwargs = self._pg_connection_kwargs(database_name)
+		columns = schema.fieldNames()
+		positions = [columns.index(column) for column in MonthPartitionConfig.SORT_COLUMNS if column in columns]
+		position = columns.index(partition_column)
+
+		def load_months():
+			# By month first, so each month is one group (and one COPY) whatever the sort columns
+			ordered = sorted(rows, key=lambda row: (month_order(month_start(row[position])), sort_key(row, positions)))
+			return [
+				(month, *table.load_month(connection_kwargs, month, month_rows, columns))
+				for month, month_rows in groupby(ordered, key=lambda row: month_start(row[position]))
+			]
+
+		self.__publish_month_partitions(table, database_name, load_months)
+
+	def __publish_month_partitions(self, table, database_name, load_months):
+		"""
+        Internal method running the month loads, then preparing every loaded month (see
+        MonthPartitionedTable.finish_month, MonthPartitionConfig.WRITERS at a time) and attaching
+        them in one transaction.
+        """
+		connection_kwargs = self._pg_connection_kwargs(database_name)
+		try:
+			# Month tables a failed write left behind would receive this write's rows too
+			with closing(self._pg_connection(database_name)) as conn:
+				with conn, conn.cursor() as cursor:
+					table.discard_staging(cursor)
+			loaded = load_months()
+			months = sorted({month for month, _, _ in loaded}, key=month_order)
+			with ThreadPoolExecutor(max_workers=MonthPartitionConfig.WRITERS) as pool:
+				list(pool.map(lambda month: table.finish_month(connection_kwargs, month), months))
+			self.run_metrics.add(
+				rows_written=sum(row_count for _, row_count, _ in loaded),
+				copy_bytes=sum(byte_count for _, _, byte_count in loaded),
+				partitions_written=len(months),
+			)
+			with closing(self._pg_connection(database_name)) as conn:
+				with conn, conn.cursor() as cursor:
+					table.publish(cursor, months)
+		except Exception:
+			with closing(self._pg_connection(database_name)) as conn:
+				with conn, conn.cursor() as cursor:
+					table.discard_staging(cursor)
+			raise
+
+	def __create_staging_table(self, table_name, database_name, schema: StructType, partition_ids=False):
+		"""Internal method (re)creating the staging table a write is loaded into; returns its name."""
+		staging_table = table_name + JDBCWriteConfig.STAGING_SUFFIX
+		with closing(self._pg_connection(database_name)) as conn:
+			with conn, conn.cursor() as cursor:
+				cursor.execute(f"DROP TABLE IF EXISTS {staging_table}")
+				cursor.execute(create_table_sql(staging_table, schema, partition_ids=partition_ids))
+		return staging_table
+
+	def __drop_table(self, table_name, database_name):
+		with closing(self._pg_connection(database_name)) as conn:
+			with conn, conn.cursor() as cursor:
+				cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+
+	def _count_rows_up_to(self, table_name, database_name, limit) -> int:
+		"""Internal method counting a table's rows, but reading at most limit + 1 of them."""
+		with closing(self._pg_connection(database_name)) as conn, conn.cursor() as cursor:
+			cursor.execute(
+				f"SELECT count(*) FROM (SELECT 1 FROM {table_name} LIMIT %s) AS limited",
+				(limit + 1,),
+			)
+			return cursor.fetchone()[0]
+
+	def _estimated_row_count(self, table_name, database_name):
+		"""Internal method returning the planner's row estimate of a table, None if never analyzed."""
+		with closing(self._pg_connection(database_name)) as conn, conn.cursor() as cursor:
+			# Partitioned tables have no estimate of their own: sum their partitions'. A leaf that was
+			# never analyzed only makes the estimate unknown if it holds data (new months are empty)
+			cursor.execute(
+				"""
+				SELECT sum(greatest(c.reltuples, 0))::bigint,
+					bool_or(c.reltuples < 0 AND pg_relation_size(c.oid) > 0)
+				FROM pg_partition_tree(to_regclass(%s)) AS tree
+				JOIN pg_class c ON c.oid = tree.relid
+				WHERE tree.isleaf
+				""",
+				(table_name,),
+			)
+			total, unanalyzed = cursor.fetchone()
+		if total is None or unanalyzed:
+			return None
+		return total
+
+	def _table_version(self, table_name, database_name):
+		"""
+        Internal method returning a version tag of a table from the catalog and statistics alone
+        (no scan): its oid and file node change when it is replaced, dropped and reloaded or
+        rewritten, its counts of inserted, updated and deleted rows when rows change. None if it
+        is not a table.
+        """
+		try:
+			with closing(self._pg_connection(database_name)) as conn, conn.cursor() as cursor:
+				cursor.execute(
+					"""
+					SELECT c.oid::bigint, pg_relation_filenode(c.oid), pg_stat_get_tuples_inserted(c.oid),
+						pg_stat_get_tuples_updated(c.oid), pg_stat_get_tuples_deleted(c.oid)
+					FROM pg_class c
+					WHERE c.oid = to_regclass(%s)
+					""",
+					(table_name,),
+				)
+				row = cursor.fetchone()
+		except psycopg2.Error:
+			# Subqueries and names Postgres cannot resolve have no version
+			return None
+		if row is None:
+			return None
+		return "_".join(str(value) for value in row)
+
+	def __partition_merge_mode(self, table_name, database_name):
+		"""Internal method resolving partition_merge: merge into an existing month-partitioned table, else partition_swap."""
+		with closing(self._pg_connection(database_name)) as conn, conn.cursor() as cursor:
+			return "merge" if MonthPartitionedTable(table_name).is_partitioned(cursor) else "partition_swap"
+
+	def __swap_staging_table(
+		self, staging_table, table_name, database_name, columns, mode, key_columns=None
+	):
+		"""Internal method publishing a loaded staging table in one transaction."""
+		_, relation = split_table_name(table_name)
+		column_list = ", ".join(quote_identifier(column) for column in columns)
+		with closing(self._pg_connection(database_name)) as conn:
+			with conn, conn.cursor() as cursor:
+				# Only needed while loading; dropping a column does not rewrite the table
+				cursor.execute(
+					f"ALTER TABLE {staging_table} DROP COLUMN IF EXISTS {quote_identifier(PARTITION_ID_COLUMN)}"
+				)
+				if mode == "overwrite":
+					cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+					cursor.execute(f"ALTER TABLE {staging_table} RENAME TO {relation}")
+					return
+
+				cursor.execute(
+					f"CREATE TABLE IF NOT EXISTS {table_name} (LIKE {staging_table})"
+				)
+				partitioned_table = MonthPartitionedTable(table_name)
+				targets = None
+				if partitioned_table.is_partitioned(cursor):
+					# Rows of months the table has no partition for yet would be rejected
+					months = partitioned_table.ensure_months(cursor, staging_table)
+					if mode == "merge":
+						# Months no longer staged lose their rows too
+						months = partitioned_table.attached_months(cursor)
+					# Each month reads its rows of the staging table through this index
+					cursor.execute(
+						f"CREATE INDEX ON {staging_table} ({quote_identifier(partitioned_table.partition_column)})"
+					)
+					# A unique index on the parent would have to include the partition column
+					targets = [
+						(partitioned_table.leaf_table(month), partitioned_table.month_predicate(month, "staged"))
+						for month in months
+					]
+				if mode in ("upsert", "merge"):
+					self.__merge_staging_table(
+						cursor, staging_table, table_name, columns, key_columns, delete_missing=mode == "merge", targets=targets
+					)
+				else:
+					cursor.execute(
+						f"INSERT INTO {table_name} ({column_list}) "
+						f"SELECT {column_list} FROM {staging_table}"
+					)
+				cursor.execute(f"DROP TABLE {staging_table}")
+
+	def __merge_staging_table(
+		self, cursor, staging_table, table_name, columns, key_columns, delete_missing, targets=None
+	):
+		"""
+        Internal method merging a staging table into the live table on key_columns: new keys are
+        inserted and existing rows only rewritten when a value actually changed (INSERT ... ON
+        CONFLICT ... WHERE ... IS DISTINCT FROM), so reprocessing unchanged data writes nothing.
+        With delete_missing, live rows whose key is not staged are deleted (a full-table sync).
+        Tables whose keys are not unique yet, and staged rows repeating a key, fall back to
+        replacing the matching rows; staged repeats of a key the live table keeps unique fail.
+        Staged rows with a null key can never match their live row and are rejected.
+        targets, (table, condition on the staged rows) pairs, merges into the partitions of a
+        partitioned table one by one, each with its own unique key index.
+        """
+		column_list = ", ".join(quote_identifier(column) for column in columns)
+		key_list = ", ".join(quote_identifier(key) for key in key_columns)
+		key_match = " AND ".join(
+			f"live.{quote_identifier(key)} = staged.{quote_identifier(key)}" for key in key_columns
+		)
+		cursor.execute(
+			f"DELETE FROM {staging_table} WHERE "
+			+ " OR ".join(f"{quote_identifier(key)} IS NULL" for key in key_columns)
+		)
+		if cursor.rowcount:
+			# They would be inserted again by every run
+			logger.warning(f"{table_name}: {cursor.rowcount} rows with a null {'/'.join(key_columns)} not written")
+			self.run_metrics.add(null_key_rows=cursor.rowcount)
+		cursor.execute(
+			f"SELECT coalesce(sum(repeats - 1), 0) FROM "
+			f"(SELECT count(*) AS repeats FROM {staging_table} GROUP BY {key_list} HAVING count(*) > 1) AS repeated"
+		)
+		repeated_rows = cursor.fetchone()[0]
+		if repeated_rows:
+			# ON CONFLICT cannot apply two staged rows to one live row, and picking one would lose the other
+			logger.warning(f"{table_name}: {repeated_rows} staged rows repeat a {'/'.join(key_columns)}, replacing instead of merging")
+			self.run_metrics.add(repeated_key_rows=repeated_rows)
+
+		value_columns = [column for column in columns if column not in key_columns]
+		if value_columns:
+			live_values = ", ".join(f"live.{quote_identifier(column)}" for column in value_columns)
+			new_values = ", ".join(f"EXCLUDED.{quote_identifier(column)}" for column in value_columns)
+			assignments = ", ".join(
+				f"{quote_identifier(column)} = EXCLUDED.{quote_identifier(column)}" for column in value_columns
+			)
+			conflict = (
+				f"DO UPDATE SET {assignments} WHERE ROW({live_values}) IS DISTINCT FROM ROW({new_values})"
+			)
+		else:
+			conflict = "DO NOTHING"
+
+		for live_table, condition in targets or [(table_name, None)]:
+			_, relation = split_table_name(live_table)
+			where = f" WHERE {condition}" if condition else ""
+			keyed = False
+			if not repeated_rows:
+				index_name = quote_identifier(f"{relation}_{'_'.join(key_columns)}_key".lower()[:63])
+				cursor.execute("SAVEPOINT merge_key")
+				try:
+					cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {live_table} ({key_list})")
+					cursor.execute("RELEASE SAVEPOINT merge_key")
+					keyed = True
+				except psycopg2.Error:
+					# Existing duplicate keys: keep the previous delete-and-insert behaviour
+					cursor.execute("ROLLBACK TO SAVEPOINT merge_key")
+
+			if delete_missing:
+				cursor.execute(
+					f"DELETE FROM {live_table} AS live WHERE NOT EXISTS "
+					f"(SELECT 1 FROM {staging_table} AS staged WHERE {key_match})"
+				)
+			if not keyed:
+				cursor.execute(f"DELETE FROM {live_table} AS live USING {staging_table} AS staged WHERE {key_match}")
+				try:
+					cursor.execute(
+						f"INSERT INTO {live_table} ({column_list}) SELECT {column_list} FROM {staging_table} AS staged{where}"
+					)
+				except psycopg2.errors.UniqueViolation as error:
+					raise ValueError(
+						f"{live_table} keeps {'/'.join(key_columns)} unique, but {repeated_rows} staged rows repeat one"
+					) from error
+				continue
+
+			cursor.execute(
+				f"INSERT INTO {live_table} AS live ({column_list}) "
+				f"SELECT {column_list} FROM {staging_table} AS staged{where} "
+				f"ON CONFLICT ({key_list}) {conflict}"
+			)
+
+	def read_reference_table(self, table_name, database_name) -> DataFrame:
+		"""Read a small lookup table through the session/snapshot cache; the result is broadcast-hinted."""
+		return self.reference_cache.get(table_name, database_name)
+
+	def run_pipeline(self, df: DataFrame, steps) -> DataFrame:
+		"""
+        Chains the given transformation steps into one lazy DataFrame plan.
+        Nothing is materialized between the steps; Spark only runs the plan on the final action.
+        """
+		for step in steps:
+			df = step(df)
+		return df
+
+	def process_table(
+		self, source_table, target_table, database_name, steps, mode="overwrite", key_columns=None, key_sink=None
+	) -> None:
+		"""Reads the source table once, applies all steps as a single plan and writes the result once."""
+		df = self.read_table(source_table, database_name)
+		df = self.run_pipeline(df, steps)
+		self.write_table(df, target_table, database_name, mode=mode, key_columns=key_columns, key_sink=key_sink)
+
+	def process_table_resumable(
+		self,
+		source_table,
+		target_table,
+		database_name,
+		stages,
+		checkpoints,
+		mode="overwrite",
+		partition_by=None,
+		key_columns=None,
+		key_sink=None,
+	) -> None:
+		"""
+        Like process_table, but every (name, step) stage writes its output to the CheckpointStore.
+        A rerun after a failure starts from the last completed stage, as long as the source table
+        is the same version (see _table_version); only the final result is written to Postgres,
+        after which the table's checkpoints are removed.
+        partition_by is an optional Column expression used to partition the checkpoint files.
+        """
+		stage_names = [name for name, _ in stages]
+		source_version = self._table_version(source_table, database_name)
+		completed = checkpoints.completed_stages(target_table, stage_names, source_version)
+		if completed != stage_names[: len(completed)]:
+			checkpoints.clear(target_table)
+			completed = []
+
+		if completed:
+			df = checkpoints.load(target_table, completed[-1])
+		else:
+			df = self.read_table(source_table, database_name)
+
+		for name, step in stages[len(completed):]:
+			df = checkpoints.save(
+				step(df), target_table, name, stage_names, partition_by=partition_by, source_version=source_version
+			)
+
+		self.write_table(df, target_table, database_name, mode=mode, key_columns=key_columns, key_sink=key_sink)
+		checkpoints.clear(target_table)
+
+	def export_bulk_ndjson(
+		self,
+		df: DataFrame,
+		index_name,
+		output_path=BulkExportConfig.OUTPUT_PATH,
+		id_column=BulkExportConfig.ID_COLUMN,
+		endpoint=BulkExportConfig.ENDPOINT,
+		directory_name=None,
+		stream=BulkExportConfig.STREAM,
+		concurrency=BulkExportConfig.CONCURRENCY,
+	) -> list[dict]:
+		"""
+        Writes the DataFrame as Elasticsearch _bulk NDJSON into index_name under
+        <output_path>/<directory_name or index_name>/: every partition is serialized in parallel
+        (to_json on the executors) into gzip chunks capped at BulkExportConfig.MAX_CHUNK_BYTES, with
+        id_column as document _id, plus a _manifest.json of the chunks. With an endpoint the chunks
+        are then posted concurrently (see BulkSender). Returns the chunk list of the manifest.
+        With an endpoint and stream, nothing is written: every task posts the chunks it builds
+        (see ChunkWriter.send_partition) and the chunks' results are returned; the documents are
+        coalesced to concurrency partitions, so no more requests are in flight than when sending
+        from the driver, however many cores the cluster has.
+        """
+		documents = df.select(
+			col(id_column).cast("string"),
+			to_json(struct(*[column_reference(column) for column in df.columns])),
+		)
+		if endpoint and stream:
+			writer = ChunkWriter(None, index_name)
+			sender = BulkSender(endpoint)
+			chunks = documents.coalesce(concurrency).rdd.mapPartitionsWithIndex(
+				lambda partition_id, rows: writer.send_partition(partition_id, rows, sender)
+			).collect()
+			self.run_metrics.add(
+				exported_documents=sum(chunk["documents"] for chunk in chunks),
+				export_bytes=sum(chunk["compressed_bytes"] for chunk in chunks),
+			)
+			summary = BulkSender.summary(chunks)
+			self.run_metrics.add(
+				sent_documents=summary["documents"],
+				failed_documents=summary["failed_documents"],
+				bulk_retries=summary["retries"],
+			)
+			return chunks
+
+		directory = os.path.join(output_path, directory_name or index_name)
+		# Chunks of a previous export would be sent again next to the new ones
+		shutil.rmtree(directory, ignore_errors=True)
+		os.makedirs(directory)
+		writer = ChunkWriter(directory, index_name)
+		chunks = documents.rdd.mapPartitionsWithIndex(writer.write_partition).collect()
+		write_manifest(directory, chunks)
+		self.run_metrics.add(
+			exported_documents=sum(chunk["documents"] for chunk in chunks),
+			export_bytes=sum(chunk["compressed_bytes"] for chunk in chunks),
+		)
+		if endpoint:
+			summary = BulkSender(endpoint).send(chunks)
+			self.run_metrics.add(
+				sent_documents=summary["documents"],
+				failed_documents=summary["failed_documents"],
+				bulk_retries=summary["retries"],
+			)
+		return chunks
 
 	def rename_columns(self, df, old_new_columns) -> DataFrame:
 		"""Rename columns in the DataFrame based on a mapping dictionary."""
@@ -139,58 +983,176 @@ class Spark4DataProc:
 
 		return df
 
+	def apply_column_specs(
+		self, df, rename=None, add=None, column_specs=ShipmentFileType.fields, record_key=None
+	) -> DataFrame:
+		"""
+        Renames, adds defaulted columns, adds missing typed columns and reorders in one select,
+        instead of one plan node per column (see SchemaCompiler.compile_projection).
+        record_key = (source table, key columns) makes uuid columns deterministic content hashes.
+        """
+		columns = df.columns
+		ordinal = None
+		plan = plan_projection(columns, rename, add, column_specs)
+		if needs_record_id(plan, record_key):
+			df, ordinal = self.__record_ordinals(df, record_key_sources(plan, record_key[1]))
+		return df.select(compile_projection(columns, rename, add, column_specs, record_key, ordinal))
+
+	def __record_ordinals(self, df: DataFrame, key_sources):
+		"""
+        Internal method returning (df, ordinal column) for the record ids of the lines repeating a
+        key, found by a count-by-key pre-pass that reads only the key columns (and line positions).
+        The ordinal is None when no key repeats, so the projection stays a single select. The
+        repeated keys are broadcast with their first line (see SchemaCompiler.record_ordinal_column);
+        raw tables without RecordIdConfig.LINE_COLUMN fall back to ordering the lines of each key
+        by all their columns, a window over the whole table.
+        """
+		keys = [column_reference(key) for key in key_sources if key is not None]
+		line = RecordIdConfig.LINE_COLUMN
+		if line not in df.columns:
+			repeats = df.groupBy(*keys).count().where(col("count") > 1).limit(1).count()
+			if not repeats:
+				return df, None
+			return df, record_ordinal_window(keys, [column_reference(column) for column in df.columns])
+
+		first_line = "__first_line"
+		repeated = df.groupBy(*keys).agg(count(lit(1)).alias("lines"), min_(column_reference(line)).alias(first_line))
+		repeated = repeated.where(col("lines") > 1).drop("lines")
+		rows = repeated.collect()
+		self.run_metrics.add(repeated_keys=len(rows))
+		if not rows:
+			return df, None
+		key_names = [f"__key_{position}" for position in range(len(keys))]
+		first_lines = self.spark.createDataFrame(rows, repeated.schema).toDF(*key_names, first_line)
+		matches = reduce(
+			lambda left, right: left & right,
+			[key.eqNullSafe(col(name)) for key, name in zip(keys, key_names)],
+		)
+		df = df.join(broadcast(first_lines), matches, "left").select(
+			*[column_reference(column) for column in df.columns], col(first_line)
+		)
+		return df, record_ordinal_column(column_reference(line), col(first_line))
+
+	def lookup_size_bytes(self, df: DataFrame):
+		"""Optimizer size estimate of a lookup DataFrame (exact for cached tables), None if unavailable."""
+		try:
+			return int(df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes().toString())
+		except Exception:
+			return None
+
+	def apply_lookup_policy(self, policy, current: Column, value: Column) -> Column:
+		"""Combines a column's current value with a looked up value (see Enrichment.LOOKUP_POLICIES)."""
+		if policy == "prefer_lookup":
+			return coalesce(value, current)
+		if policy == "keep_existing":
+			return coalesce(current, value)
+		if policy == "replace":
+			return value
+		return when(value.isNotNull(), current * value).otherwise(current)
+
+	def enrich(self, df: DataFrame, lookups, broadcast_max_bytes=EnrichConfig.BROADCAST_MAX_BYTES) -> DataFrame:
+		"""
+        Applies a list of declarative lookups (see Enrichment.lookup) against reference tables:
+        lookups on the same table and keys share one join, each join only carries the key and
+        output columns it needs, and all columns are replaced in place (new ones appended) by a
+        single final select. Lookup tables at most broadcast_max_bytes large are broadcast,
+        larger ones are left to a shuffle join.
+        """
+		state = {column: col("df." + column) for column in df.columns}
+		joined = df.alias("df")
+		for operation in plan_lookups(df.columns, lookups):
+			if operation[0] == "join":
+				_, alias, table_name, database_name, keys, needed = operation
+				lookup_columns = list(dict.fromkeys([column for _, column in keys] + needed))
+				lookup_df = self.reference_cache.frame(table_name, database_name).select(
+					[column_reference(column) for column in lookup_columns]
+				)
+				size = self.lookup_size_bytes(lookup_df)
+				if size is not None and size <= broadcast_max_bytes:
+					lookup_df = broadcast(lookup_df)
+				self.run_metrics.add(lookup_bytes=size or 0)
+				condition = reduce(
+					lambda left, right: left & right,
+					[state[data_column] == column_reference(column, alias) for data_column, column in keys],
+				)
+				joined = joined.join(lookup_df.alias(alias), condition, "left")
+			else:
+				_, column_name, alias, lookup_column, policy = operation
+				state[column_name] = self.apply_lookup_policy(
+					policy, state.get(column_name, lit(None)), column_reference(lookup_column, alias)
+				)
+		return joined.select([column.alias(name) for name, column in state.items()])
+
 	def update_hs_code_description(self, df, country_code):
 		"""
         Updates the HS_CODE and HS_CODE_DESCRIPTION columns in the main DataFrame by matching HS_CODE with
         the HS_CODE_DESC from a country-specific HS description table. Also updates HS_CODE with new_HS_CODE if it is not null.
         """
-		# Define the table name based on the country code
-		table_name = f"{country_code}_hs_desc"
-
-		# Read the HS description table from the specified database
-		hs_desc_df = self.read_table(database_name="HS_DESC", table_name=table_name)
-
-		# Join the main DataFrame with the HS description DataFrame on HS_CODE
-		updated_df = df.join(hs_desc_df, df["HS_CODE"] == hs_desc_df["HS_CODE"], "left")
+		if HSCodeLookupConfig.PREFIX_MATCH:
+			return self.update_hs_code_by_prefix(df, country_code)
+		return self.enrich(df, [hs_description_lookup(country_code)])
 
-		# Update the HS_CODE_DESCRIPTION with HS_CODE_DESC from the joined table
-		select_columns = [col("df." + column) for column in df.columns] + [
-			coalesce(col("hs.HS_CODE_DESC"), col("df.HS_CODE_DESCRIPTION")).alias(
-				"HS_CODE_DESCRIPTION"
-			),
-			coalesce(col("hs.new_HS_CODE"), col("df.HS_CODE")).alias("HS_CODE"),
-		]
-
-		updated_df = updated_df.select(select_columns)
-		return updated_df
+	def hs_prefix_index(self, country_code) -> HSPrefixIndex:
+		"""
+        The longest-prefix index of a country's HS description table, rebuilt whenever the
+        reference cache returns a different (reloaded) frame for the table.
+        """
+		hs_desc = self.reference_cache.frame(f"{country_code}_hs_desc", "HS_DESC")
+		built = self.hs_prefix_indexes.get(country_code)
+		if built is None or built[0] is not hs_desc:
+			rows = hs_desc.select("HS_CODE", "HS_CODE_DESC", "new_HS_CODE").collect()
+			self.hs_prefix_indexes[country_code] = (hs_desc, HSPrefixIndex(rows))
+		return self.hs_prefix_indexes[country_code][1]
+
+	def update_hs_code_by_prefix(self, df, country_code):
+		"""
+        update_hs_code_description with longest-prefix matching: HS_CODE takes the description of
+        the longest table code it starts with, and that code's new_HS_CODE only if it is the whole
+        (normalized) HS_CODE, as a replacement code is specific to the code it was given for.
+        The index is compiled into two constant maps that travel with the plan, so every level
+        is a hash probe on the executors instead of a join.
+        """
+		index = self.hs_prefix_index(country_code)
+		keys = sorted(index.entries)
+		descriptions = map_from_arrays(
+			lit(keys).cast("array<string>"),
+			lit([index.entries[key][0] for key in keys]).cast("array<string>"),
+		)
+		new_codes = map_from_arrays(
+			lit(keys).cast("array<string>"),
+			lit([index.entries[key][1] for key in keys]).cast("array<string>"),
+		)
 
-	def join_and_update_country(
-		self, df: DataFrame, column_name: str, country_code_df: DataFrame
-	) -> DataFrame:
-		"""Update country columns by joining with the country code DataFrame and replacing values if a match is found."""
-		# Join the data frame with the country code data frame based on the specified column,
-		# but only select the columns from the original DataFrame after the join.
-		df = (
-			df.alias("df")
-			.join(
-				country_code_df.alias("codes"),
-				col("df." + column_name) == col("codes.country2"),
-				"left",
-			)
-			.select(
-				"df.*",  # Select all columns from the original DataFrame
-				when(col("codes.code").isNotNull(), col("codes.code"))
-				.otherwise(col("df." + column_name))
-				.alias(column_name),
+		code = regexp_replace(col("HS_CODE").cast(StringType()), "[^0-9]", "")
+		matched = lit(None).cast(StringType())
+		if index.lengths:
+			matched = coalesce(
+				*[
+					when(
+						(length(code) >= size) & map_contains_key(descriptions, substring(code, 1, size)),
+						substring(code, 1, size),
+					)
+					for size in index.lengths
+				]
 			)
+		current_description = (
+			col("HS_CODE_DESCRIPTION") if "HS_CODE_DESCRIPTION" in df.columns else lit(None).cast(StringType())
+		)
+		replacements = {
+			"HS_CODE_DESCRIPTION": coalesce(descriptions[matched], current_description),
+			"HS_CODE": coalesce(when(length(matched) == length(code), new_codes[matched]), col("HS_CODE")),
+		}
+		return df.select(
+			[replacements.pop(column, col(column)).alias(column) for column in df.columns]
+			+ [column.alias(name) for name, column in replacements.items()]
 		)
-
-		return df
 
 	def update_country_column(self, df: DataFrame, column_name: str) -> DataFrame:
-		"""Update a specific country column using the country code DataFrame."""
-		country_code_df = self.read_table("CountryCode", "Country_Port_Code")
-		return self.join_and_update_country(df, column_name, country_code_df)
+		"""Update a specific country column using the country code table."""
+		return self.enrich(
+			df,
+			[lookup("CountryCode", "Country_Port_Code", {column_name: "country2"}, {column_name: ("code", "prefer_lookup")})],
+		)
 
 	def update_exporter_country(self, df: DataFrame) -> DataFrame:
 		"""Update EXPORTER_COUNTRY column."""
@@ -222,18 +1184,17 @@ class Spark4DataProc:
 	def update_port(
 		self, df: DataFrame, join_column: str, update_column: str
 	) -> DataFrame:
-		"""Update port columns by joining with the country code DataFrame."""
-		country_code_uniq_df = self.read_table("Country_Code_Uniq", "Country_Port_Code")
-		return df.join(
-			country_code_uniq_df,
-			df[join_column] == country_code_uniq_df["Alpha-2 code"],
-			"left",
-		).withColumn(
-			update_column,
-			when(
-				df[update_column].isNull(),
-				country_code_uniq_df["English short name (upper/lower case)"],
-			).otherwise(df[update_column]),
+		"""Fill missing port names with the name of the country in join_column."""
+		return self.enrich(
+			df,
+			[
+				lookup(
+					"Country_Code_Uniq",
+					"Country_Port_Code",
+					{join_column: "Alpha-2 code"},
+					{update_column: ("English short name (upper/lower case)", "keep_existing")},
+				)
+			],
 		)
 
 	def update_port_of_arrival(self, df: DataFrame) -> DataFrame:
@@ -244,6 +1205,109 @@ class Spark4DataProc:
 		"""Update PORT_OF_DEPARTURE column."""
 		return self.update_port(df, "EXPORTER_COUNTRY", "PORT_OF_DEPARTURE")
 
+	def country_lookup_maps(self, source=CountryLookupConfig.SOURCE) -> tuple[dict, dict]:
+		"""
+        (country name -> code, code -> port name) maps used by update_countries_and_ports, from
+        CountryCodeConfig ("config") or from the CountryCode / Country_Code_Uniq tables ("snapshot").
+        """
+		if source == "config":
+			return config_country_maps()
+		country_rows = (
+			self.read_reference_table("CountryCode", "Country_Port_Code")
+			.select("country2", "code")
+			.collect()
+		)
+		port_rows = (
+			self.read_reference_table("Country_Code_Uniq", "Country_Port_Code")
+			.select("`Alpha-2 code`", "`English short name (upper/lower case)`")
+			.collect()
+		)
+		return table_country_maps(country_rows, port_rows)
+
+	def map_literal(self, mapping: dict) -> Column:
+		"""Compiles a small python dict into a map<string,string> literal evaluated inside the plan."""
+		if not mapping:
+			return lit(None).cast("map<string,string>")
+		return create_map(*[lit(item) for pair in mapping.items() for item in pair])
+
+	def update_countries_and_ports(
+		self,
+		df: DataFrame,
+		country_columns=("COUNTRY_OF_ORIGIN", "EXPORTER_COUNTRY", "IMPORTER_COUNTRY"),
+		port_columns=(("IMPORTER_COUNTRY", "PORT_OF_ARRIVAL"), ("EXPORTER_COUNTRY", "PORT_OF_DEPARTURE")),
+		source=CountryLookupConfig.SOURCE,
+	) -> DataFrame:
+		"""
+        Same result as update_country_column for every country column followed by update_port for
+        every (country column, port column) pair, but as a single projection: the lookup tables
+        are small enough to be inlined as map literals, so there is no join, shuffle or JDBC read.
+        """
+		names_to_codes, codes_to_names = self.country_lookup_maps(source)
+		code_map = self.map_literal(names_to_codes)
+		name_map = self.map_literal(codes_to_names)
+
+		replacements = {}
+		for column_name in country_columns:
+			if column_name in df.columns:
+				replacements[column_name] = coalesce(code_map[col(column_name)], col(column_name))
+		for join_column, update_column in port_columns:
+			if join_column in df.columns and update_column in df.columns:
+				# Ports are filled from the already converted country code, as update_port does
+				country = replacements.get(join_column, col(join_column))
+				replacements[update_column] = when(
+					col(update_column).isNull(), name_map[country]
+				).otherwise(col(update_column))
+
+		return df.select(
+			[
+				replacements[column].alias(column) if column in replacements else col(column)
+				for column in df.columns
+			]
+		)
+
+	def dedupe_shipments(self, df: DataFrame, key_index, source_table, key_columns, mode=DedupeConfig.MODE) -> DataFrame:
+		"""
+        Drops (mode="drop") or flags (mode="flag", DedupeConfig.FLAG_COLUMN) the lines of df whose
+        key_columns another table already recorded in key_index (a ShipmentKeyIndex). Only the key
+        columns are read for the probe: the Bloom filter is broadcast and tested per partition, the
+        few probable duplicates are confirmed against the index on the driver.
+        """
+		key_hash = "__key_hash"
+		keyed = df.withColumn(key_hash, key_hash_column(key_columns))
+		duplicates = set()
+		bloom = key_index.load_bloom()
+		if bloom is not None:
+			bloom_broadcast = self.spark.sparkContext.broadcast(bloom)
+
+			def probable_duplicates(rows):
+				hashes = np.fromiter((row[0] for row in rows), dtype=np.int64)
+				return hashes[bloom_broadcast.value.might_contain(hashes)].tolist()
+
+			candidates = (
+				keyed.select(key_hash).where(col(key_hash).isNotNull()).rdd
+				.mapPartitions(probable_duplicates)
+				.distinct()
+				.collect()
+			)
+			bloom_broadcast.destroy()
+			duplicates = key_index.duplicates(candidates, source_table)
+			self.run_metrics.add(probable_duplicates=len(candidates), duplicate_keys=len(duplicates))
+
+		if not duplicates:
+			if mode == "flag":
+				return df.withColumn(DedupeConfig.FLAG_COLUMN, lit(False))
+			return df
+		duplicates_df = broadcast(
+			self.spark.createDataFrame([(value,) for value in duplicates], f"{key_hash} bigint")
+		)
+		if mode == "flag":
+			return (
+				keyed.join(duplicates_df.withColumn(DedupeConfig.FLAG_COLUMN, lit(True)), key_hash, "left")
+				.fillna(False, subset=[DedupeConfig.FLAG_COLUMN])
+				.select(*[col(column) for column in df.columns], DedupeConfig.FLAG_COLUMN)
+			)
+		return keyed.join(duplicates_df, key_hash, "left_anti").select(df.columns)
+
 	def update_column_none(self, df: DataFrame, columns: list[str]) -> DataFrame:
 		"""Update None columns."""
 		for col_name in columns:
@@ -252,107 +1316,374 @@ class Spark4DataProc:
 			)
 		return df
 
-	def update_ta_code(
-		self, df, country_column, name_column, ta_code_column, condition
-	):
-		"""Update TA_CODE column for specified country codes from the CountryCodes class."""
-		# Use the country codes defined in the CountryCodes class
-		country_codes = CountryCodes.COUNTRY_CODES_TWO_CHARS
+	def normalize_company_name(self, column):
+		"""Builds the normalized company name key used for TA code matching."""
+		return trim(regexp_replace(column, COMPANY_NAME_STRIP_PATTERN, ""))
 
-		# Iterate over each defined country code and perform updates in the original DataFrame
-		for country_code in country_codes:
-			if (
-				country_code
-				in df.select(country_column)
-				.distinct()
-				.rdd.map(lambda r: r[0])
-				.collect()
-			):
-				table_name = f"{country_code}_kod_atama"
+	def collect_distinct_values(self, df: DataFrame, columns: list[str]) -> set:
+		"""Collects the distinct non-null values of several columns with a single Spark job."""
+		values = (
+			df.select(explode(array(*[col(column) for column in columns])).alias("value"))
+			.where(col("value").isNotNull())
+			.distinct()
+			.collect()
+		)
+		return {row["value"] for row in values}
+
+	def read_company_file(self, country_code) -> DataFrame:
+		"""Reads a country's company file and keeps only rows passing the CompanyFileType validation rules."""
+		df = self.read_table(
+			CompanyMasterConfig.SOURCE_TABLE.format(country_code=country_code),
+			CompanyMasterConfig.DATABASE,
+		)
+		if "COMPANY_NAME" not in df.columns:
+			df = df.withColumnRenamed(CompanyMasterConfig.SOURCE_NAME_COLUMN, "COMPANY_NAME")
 
-				# Read the TA code assignment table for the specific country
-				new_codes_df = self.read_table(table_name, "Yeni_veri_kod_atama_uniq")
+		condition = lit(True)
+		for column_name, specs in CompanyFileType.fields.items():
+			if column_name not in df.columns:
+				continue
+			rules = specs["validation_rules"]
+			if "exist" in rules:
+				condition = condition & col(column_name).isNotNull()
+			if "ta_code" in rules:
+				condition = condition & col(column_name).rlike(TA_CODE_PATTERN)
+		return df.where(condition)
+
+	def normalized_company_keys(self, companies: DataFrame) -> DataFrame:
+		"""Computes the normalized name key of a company file and keeps one TA code per key."""
+		name_key = CompanyMasterConfig.NAME_KEY_COLUMN
+		return (
+			companies.select(
+				self.normalize_company_name(col("COMPANY_NAME")).alias(name_key),
+				col("TA_CODE"),
+			)
+			.where(col(name_key).isNotNull() & (col(name_key) != ""))
+			.groupBy(name_key)
+			.agg(min_("TA_CODE").alias("TA_CODE"))
+		)
 
-				# Join with the TA code DataFrame based on the condition and update the TA code column
-				df = df.join(new_codes_df, condition, "left").withColumn(
-					ta_code_column,
-					when(
-						col(ta_code_column).isNull(), new_codes_df["TA_CODE"]
-					).otherwise(col(ta_code_column)),
+	def build_company_master(self, country_code) -> None:
+		"""
+        Builds the company master of a country: the validated company file reduced to one
+        TA_CODE per normalized name key, stored as a table with a unique index on the key.
+        The version of the company file it was built from is recorded as the table's comment.
+        """
+		table_name = CompanyMasterConfig.MASTER_TABLE.format(country_code=country_code)
+		# Taken before reading, so changes made while building leave the master stale
+		source_version = self._table_version(
+			CompanyMasterConfig.SOURCE_TABLE.format(country_code=country_code), CompanyMasterConfig.DATABASE
+		)
+		master_df = self.normalized_company_keys(self.read_company_file(country_code))
+		self.write_table(master_df, table_name, CompanyMasterConfig.DATABASE, mode="overwrite")
+
+		_, relation = split_table_name(table_name)
+		name_key = quote_identifier(CompanyMasterConfig.NAME_KEY_COLUMN)
+		with closing(self._pg_connection(CompanyMasterConfig.DATABASE)) as conn:
+			with conn, conn.cursor() as cursor:
+				cursor.execute(
+					f"CREATE UNIQUE INDEX IF NOT EXISTS {relation}_name_key_idx ON {table_name} ({name_key})"
 				)
+				cursor.execute(f"COMMENT ON TABLE {table_name} IS %s", (source_version,))
+				cursor.execute(f"ANALYZE {table_name}")
 
-		return df
+	def _current_company_masters(self, country_codes) -> set:
+		"""
+        Internal method returning the countries whose company master was built from the current
+        version of their company file (see build_company_master). A stale master is reported and
+        left out, so its country falls back to the company file until the master is rebuilt.
+        """
+		current = set()
+		with closing(self._pg_connection(CompanyMasterConfig.DATABASE)) as conn, conn.cursor() as cursor:
+			for country_code in country_codes:
+				cursor.execute(
+					"SELECT to_regclass(%(table)s) IS NOT NULL, obj_description(to_regclass(%(table)s), 'pg_class')",
+					{"table": CompanyMasterConfig.MASTER_TABLE.format(country_code=country_code)},
+				)
+				exists, built_from = cursor.fetchone()
+				if not exists:
+					continue
+				source_version = self._table_version(
+					CompanyMasterConfig.SOURCE_TABLE.format(country_code=country_code), CompanyMasterConfig.DATABASE
+				)
+				if built_from is not None and built_from == source_version:
+					current.add(country_code)
+				else:
+					logger.warning(f"{country_code}: company master is older than the company file, reading the file")
+		return current
+
+	def load_ta_code_lookup(self, country_codes) -> DataFrame | None:
+		"""
+        Loads the company masters of the given countries as one lookup keyed by
+        (TA_COUNTRY, TA_NAME_KEY). Countries without a master built from the current company file
+        fall back to normalizing their company file on the fly. Returns None if no country has a table.
+        """
+		country_codes = sorted(set(country_codes) & set(CountryCodes.COUNTRY_CODES_TWO_CHARS))
+		current = self._current_company_masters(country_codes)
+
+		frames = []
+		for country_code in country_codes:
+			if country_code in current:
+				companies = self.read_table(
+					CompanyMasterConfig.MASTER_TABLE.format(country_code=country_code), CompanyMasterConfig.DATABASE
+				)
+			else:
+				companies = self.normalized_company_keys(self.read_company_file(country_code))
+			frames.append(
+				companies.select(
+					lit(country_code).alias("TA_COUNTRY"),
+					col(CompanyMasterConfig.NAME_KEY_COLUMN).alias("TA_NAME_KEY"),
+					col("TA_CODE").alias("TA_LOOKUP_CODE"),
+				)
+			)
+		if not frames:
+			return None
+		return broadcast(reduce(DataFrame.unionByName, frames))
+
+	def update_ta_code(
+		self, df, country_column, name_column, ta_code_column, lookup=None
+	):
+		"""
+        Fill empty values of ta_code_column from the TA code assignment tables with a single join
+        on (country, normalized name). The lookup is loaded for the countries present in df unless given.
+        """
+		# Some sources carry no name for one side (e.g. Costa Rica imports have no exporter name)
+		if name_column not in df.columns:
+			return df
+		if lookup is None:
+			df = self.persist_until_written(df)
+			lookup = self.load_ta_code_lookup(self.collect_distinct_values(df, [country_column]))
+		if lookup is None:
+			return df
+
+		joined = df.alias("df").join(
+			lookup.alias("ta"),
+			(col("df." + country_column) == col("ta.TA_COUNTRY"))
+			& (self.normalize_company_name(col("df." + name_column)) == col("ta.TA_NAME_KEY")),
+			"left",
+		)
+		return joined.select(
+			[
+				coalesce(col("df." + column), col("ta.TA_LOOKUP_CODE")).alias(column)
+				if column == ta_code_column
+				else col("df." + column)
+				for column in df.columns
+			]
+		)
 
-	def update_exporter_ta_code(self, df):
+	def update_exporter_ta_code(self, df, lookup=None):
 		"""Update EXPORTER_TA_CODE column based on cleaned names and matching country codes."""
-		condition = trim(
-			regexp_replace(col("EXPORTER_NAME"), "[.,-\"'&/#() +:<>]", "")
-		) == regexp_replace(col("COMPANY_ham"), "[.,-\"'&/#() +:<>]", "")
 		return self.update_ta_code(
-			df, "EXPORTER_COUNTRY", "EXPORTER_NAME", "EXPORTER_TA_CODE", condition
+			df, "EXPORTER_COUNTRY", "EXPORTER_NAME", "EXPORTER_TA_CODE", lookup
 		)
 
-	def update_importer_ta_code(self, df):
-		"""Update IMPORTER_TA_CODE column based on TAX ID and name, handling multiple conditions."""
-		condition = trim(
-			regexp_replace(col("IMPORTER_NAME"), "[.,-\"'&/#() +:<>]", "")
-		) == regexp_replace(col("COMPANY_ham"), "[.,-\"'&/#() +:<>]", "")
-
+	def update_importer_ta_code(self, df, lookup=None):
+		"""Update IMPORTER_TA_CODE column based on cleaned names and matching country codes."""
 		return self.update_ta_code(
-			df, "IMPORTER_COUNTRY", "IMPORTER_NAME", "IMPORTER_TA_CODE", condition
+			df, "IMPORTER_COUNTRY", "IMPORTER_NAME", "IMPORTER_TA_CODE", lookup
+		)
+
+	def update_exporter_and_importer_ta_codes(self, df):
+		"""Update both TA code columns, collecting countries and loading the lookup only once."""
+		# The countries are collected from the persisted frame the write then reads, not a second run of the plan
+		df = self.persist_until_written(df)
+		lookup = self.load_ta_code_lookup(
+			self.collect_distinct_values(df, ["EXPORTER_COUNTRY", "IMPORTER_COUNTRY"])
 		)
+		df = self.update_exporter_ta_code(df, lookup)
+		return self.update_importer_ta_code(df, lookup)
 
-	def update_quantity_and_unit(self, df, country_code):
+	def update_quantity_and_unit(self, df, country_code, unit_column="QUANTITY_UNIT"):
 		"""
-        Updates 'UNIT_OF_QUANTITY' based on a country-specific mapping table and adjusts 'QUANTITY'
-        based on the action specified in the mapping table. Only retains columns from the original DataFrame.
+        Updates the unit column based on a country-specific mapping table (UNIT_OF_QUANTITY -> Yeni_Birim)
+        and adjusts 'QUANTITY' by the mapping's Aksiyon factor. Only retains columns from the original DataFrame.
         :param df: DataFrame to update
         :param country_code: Country code to determine which mapping table to use
+        :param unit_column: Column of df holding the raw unit (QUANTITY_UNIT after renaming)
+        """
+		# QUANTITY is written as a double whatever its raw type (and whether or not the unit matched)
+		df = df.withColumn("QUANTITY", col("QUANTITY").cast(DoubleType()))
+		return self.enrich(df, [unit_lookup(country_code, unit_column)])
+
+	def count_if(self, condition) -> Column:
+		"""Aggregate counting the rows for which condition is true."""
+		return sum_(when(condition, 1).otherwise(0))
+
+	def null_check_aggregations(self, columns: list[str]) -> dict[str, Column]:
+		return {column: self.count_if(col(column).isNull()) for column in columns}
+
+	def hs_code_check_aggregations(self) -> dict[str, Column]:
+		return {
+			"null_hs_code": self.count_if(col("HS_CODE").isNull()),
+			"null_hs_code_description": self.count_if(col("HS_CODE_DESCRIPTION").isNull()),
+			"invalid_hs_code_format": self.count_if(~col("HS_CODE").rlike(r"^\d+$")),
+		}
+
+	def ta_code_check_aggregations(self, ta_columns) -> dict[str, Column]:
+		return {
+			column: self.count_if(col(column).isNull() | ~col(column).rlike(TA_CODE_PATTERN))
+			for column in ta_columns
+		}
+
+	def quantity_check_aggregations(self) -> dict[str, Column]:
+		return {
+			"null_quantity": self.count_if(col("QUANTITY").isNull()),
+			"null_quantity_unit": self.count_if(col("QUANTITY_UNIT").isNull()),
+		}
+
+	def run_checks(
+		self,
+		df: DataFrame,
+		aggregations: dict[str, dict[str, Column]],
+		value_sets: dict[str, str] | None = None,
+	) -> dict:
+		"""
+        Evaluates every check aggregation (group -> name -> aggregate Column) and collects the
+        distinct values of the value_sets columns (name -> column) in a single pass over df.
+        """
+		names = []
+		columns = []
+		for group, checks in aggregations.items():
+			for name, aggregation in checks.items():
+				columns.append(aggregation.alias(f"check_{len(names)}"))
+				names.append((group, name))
+		for name, column_name in (value_sets or {}).items():
+			columns.append(collect_set(col(column_name)).alias(f"check_{len(names)}"))
+			names.append(("value_sets", name))
+
+		row = df.agg(*columns).first()
+		results = {}
+		for index, (group, name) in enumerate(names):
+			value = row[f"check_{index}"]
+			results.setdefault(group, {})[name] = value if value is not None else 0
+		return results
+
+	def run_checks_approximate(
+		self,
+		df: DataFrame,
+		aggregations: dict[str, dict[str, Column]],
+		value_sets: dict[str, str] | None = None,
+		cardinalities: dict[str, str] | None = None,
+		pilot_fraction=ApproxChecksConfig.PILOT_FRACTION,
+		max_fraction=ApproxChecksConfig.MAX_SAMPLE_FRACTION,
+		max_rate_error=ApproxChecksConfig.MAX_RATE_ERROR,
+		confidence=ApproxChecksConfig.CONFIDENCE,
+		rsd=ApproxChecksConfig.CARDINALITY_RSD,
+		seed=ApproxChecksConfig.SEED,
+		sampler=None,
+	) -> dict:
+		"""
+        run_checks on a Bernoulli sample of df. The count aggregations (all checks count rows)
+        are scaled to the table and returned as Estimates with confidence intervals, once every
+        rate is known within max_rate_error. A pilot sample of pilot_fraction gives the rates; if
+        it is not precise enough the sample size they need (required_sample_rows) sets the one
+        further fraction drawn, since every sample costs a full scan. value_sets hold the values
+        seen in the sample (SampledValues), cardinalities (name -> column) are
+        approx_count_distinct sketches. If the needed fraction exceeds max_fraction, or the
+        sample still falls short, the counts are computed exactly on all rows. sampler
+        (fraction -> DataFrame) draws the samples instead of df.sample, e.g. a read_table_sample
+        of the table df was read from.
         """
-		# Define the table name based on the country code
-		table_name = f"{country_code}_unit_of_quantity"
-
-		# Read the unit of quantity mapping table
-		unit_mapping_df = self.read_table(table_name, "your_database_name")
-
-		# Join the main DataFrame with the mapping DataFrame on 'UNIT_OF_QUANTITY'
-		df = df.alias("df").join(
-			unit_mapping_df.alias("map"),
-			on=df["UNIT_OF_QUANTITY"] == unit_mapping_df["UNIT_OF_QUANTITY"],
-			how="left",
-		)
-
-		# Update 'UNIT_OF_QUANTITY' to the new unit and adjust 'QUANTITY' according to the action
-		# Selecting only original df columns and applying transformations
-		df = df.select(
-			*[
-				 col("df." + column)
-				 for column in df.columns
-				 if column not in unit_mapping_df.columns
-			 ]
-			 + [
-				 when(col("map.Yeni_Birim").isNotNull(), col("map.Yeni_Birim"))
-				 .otherwise(col("df.UNIT_OF_QUANTITY"))
-				 .alias("UNIT_OF_QUANTITY"),
-				 when(
-					 col("map.Aksiyon").isNotNull(),
-					 col("df.QUANTITY") * col("map.Aksiyon"),
-				 )
-				 .otherwise(col("df.QUANTITY"))
-				 .alias("QUANTITY"),
-			 ]
+		z = z_score(confidence)
+		names = [(group, name) for group, checks in aggregations.items() for name in checks]
+		fraction = pilot_fraction
+		while fraction is not None:
+			sample = sampler(fraction) if sampler else df.sample(fraction=fraction, seed=seed)
+			row = sample.agg(
+				count(lit(1)).alias("sample_rows"),
+				*[
+					aggregation.alias(f"check_{index}")
+					for index, aggregation in enumerate(
+						aggregation for checks in aggregations.values() for aggregation in checks.values()
+					)
+				],
+				*[collect_set(col(column)).alias(f"values_{name}") for name, column in (value_sets or {}).items()],
+				*[
+					approx_count_distinct(col(column), rsd).alias(f"distinct_{name}")
+					for name, column in (cardinalities or {}).items()
+				],
+			).first()
+			sample_rows = row["sample_rows"]
+			counts = [row[f"check_{index}"] or 0 for index in range(len(names))]
+			if sample_rows == 0 or any(rate_error(value, sample_rows, z) > max_rate_error for value in counts):
+				# Only the pilot picks a further fraction; a table too small to sample is counted exactly
+				needed = None
+				if fraction == pilot_fraction and sample_rows:
+					needed_rows = max(
+						(required_sample_rows(value, sample_rows, z, max_rate_error) for value in counts), default=0
+					)
+					needed = needed_rows * fraction / sample_rows
+				fraction = needed if needed is not None and pilot_fraction < needed <= max_fraction else None
+				continue
+
+			results = {}
+			for (group, name), value in zip(names, counts):
+				results.setdefault(group, {})[name] = estimate_count(value, sample_rows, fraction, z, confidence)
+			if value_sets:
+				results["value_sets"] = {
+					name: SampledValues(row[f"values_{name}"], fraction, sample_rows) for name in value_sets
+				}
+			if cardinalities:
+				results["cardinality"] = {
+					name: estimate_cardinality(row[f"distinct_{name}"], rsd, z, confidence, fraction, sample_rows)
+					for name in cardinalities
+				}
+			return results
+
+		results = self.run_checks(
+			df,
+			{
+				**aggregations,
+				"cardinality": {
+					name: approx_count_distinct(col(column), rsd) for name, column in (cardinalities or {}).items()
+				},
+			},
+			value_sets,
 		)
+		for group, checks in results.items():
+			if group == "cardinality":
+				results[group] = {
+					name: estimate_cardinality(value, rsd, z, confidence, 1.0, None) for name, value in checks.items()
+				}
+			elif group != "value_sets":
+				results[group] = {name: Estimate.exact_value(value) for name, value in checks.items()}
+		if not cardinalities:
+			results.pop("cardinality", None)
+		return results
 
-		return df
+	def evaluate_checks(
+		self, df, aggregations, value_sets=None, approximate=False, cardinalities=None, sampler=None
+	) -> dict:
+		"""run_checks, or run_checks_approximate (with the cardinalities) when approximate is set."""
+		if approximate:
+			return self.run_checks_approximate(df, aggregations, value_sets, cardinalities, sampler=sampler)
+		return self.run_checks(df, aggregations, value_sets)
+
+	def load_lookup_values(self, lookups: dict[str, tuple[str, str, str]]) -> dict[str, set]:
+		"""
+        Collects the key values of several reference tables (name -> (table, database, column))
+        as one union, so all anti-join style checks share a single lookup stage.
+        """
+		frames = [
+			self.read_reference_table(table_name, database_name).select(
+				lit(name).alias("lookup"), col(column_name).cast("string").alias("value")
+			)
+			for name, (table_name, database_name, column_name) in lookups.items()
+		]
+		values = {name: set() for name in lookups}
+		if frames:
+			for row in reduce(DataFrame.unionByName, frames).distinct().collect():
+				values[row["lookup"]].add(row["value"])
+		return values
 
-	def check_null_columns(self, df: DataFrame, columns: list[str]) -> dict[str, int]:
-		"""Check for null values in specified columns."""
-		return {column: df.where(col(column).isNull()).count() for column in columns}
+	def check_null_columns(self, df: DataFrame, columns: list[str], approximate=False) -> dict[str, int]:
+		"""Check for null values in specified columns (estimated from a sample if approximate)."""
+		return self.evaluate_checks(df, {"null": self.null_check_aggregations(columns)}, approximate=approximate)["null"]
 
 	def check_missing_country(self, df: DataFrame, country_column: str) -> DataFrame:
 		"""Check for missing country codes in specified column."""
-		country_code_uniq_df = self.read_table(
-			"Country_Port_Code.dbo.Country_Code_Uniq", "Country_Port_Code"
+		country_code_uniq_df = self.read_reference_table(
+			"Country_Code_Uniq", "Country_Port_Code"
 		)
 		return (
 			df.select(country_column)
@@ -363,71 +1694,125 @@ class Spark4DataProc:
 			.distinct()
 		)
 
-	def check_quantity_integrity(self, df, country_code):
+	def check_quantity_integrity(self, df, country_code, approximate=False):
 		"""
-        Checks for null values in QUANTITY and QUANTITY_UNIT columns, and lists UNIT_OF_QUANTITY values
+        Checks for null values in QUANTITY and QUANTITY_UNIT columns, and lists QUANTITY_UNIT values
         not found in the unit mapping table specific to the country code provided.
         :param df: DataFrame to check
         :param country_code: Country code to determine which mapping table to use
         :return: Dictionary with results of checks
         """
-		results = {}
-
-		# Load the unit mapping table based on country code
-		table_name = f"{country_code}_unit_of_quantity"
-		unit_mapping_df = self.read_table(table_name, "UNIT_OF_QUANTITY")
-
-		# Check for null values in QUANTITY
-		results["null_quantity"] = df.where(col("QUANTITY").isNull()).count()
-
-		# Check for null values in QUANTITY_UNIT
-		results["null_quantity_unit"] = df.where(col("QUANTITY_UNIT").isNull()).count()
-
-		# Find UNIT_OF_QUANTITY values not found in the unit mapping table
-		unique_units_df = df.select("UNIT_OF_QUANTITY").distinct()
-		mapping_units_df = unit_mapping_df.select("UNIT_OF_QUANTITY").distinct()
-		missing_units = unique_units_df.join(
-			mapping_units_df, ["UNIT_OF_QUANTITY"], "left_anti"
+		results = self.evaluate_checks(
+			df,
+			{"quantity": self.quantity_check_aggregations()},
+			{"units": "QUANTITY_UNIT"},
+			approximate,
 		)
-		results["missing_units"] = [
-			row["UNIT_OF_QUANTITY"] for row in missing_units.collect()
-		]  # Convert to list for easier handling
-
-		return results
+		known_units = self.load_lookup_values(
+			{"units": (f"{country_code}_unit_of_quantity", "UNIT_OF_QUANTITY", "UNIT_OF_QUANTITY")}
+		)["units"]
+		return {
+			**results["quantity"],
+			"missing_units": derive_values(
+				results["value_sets"]["units"], sorted(set(results["value_sets"]["units"]) - known_units)
+			),
+		}
 
-	def check_ta_codes(self, df, ta_columns):
+	def check_ta_codes(self, df, ta_columns, approximate=False):
 		"""Check TA codes for specified columns to ensure they follow the specified format '{CountryCode}{8 digits}'"""
-		results = {}
-		for column in ta_columns:
-			# Regex pattern expects a country code followed by exactly 8 digits
-			pattern = r"^[A-Z]{2}\d{8}$"
-			invalid_ta = df.filter(
-				(col(column).isNull()) | (~col(column).rlike(pattern))
-			)
-			count_invalid_ta = invalid_ta.count()
-			if count_invalid_ta > 0:
-				results[column] = count_invalid_ta
-		return results
+		counts = self.evaluate_checks(
+			df, {"ta": self.ta_code_check_aggregations(ta_columns)}, approximate=approximate
+		)["ta"]
+		return {column: count for column, count in counts.items() if count > 0}
 
-	def check_hs_code_integrity(self, df):
+	def check_hs_code_integrity(self, df, approximate=False):
 		"""Check HS code length, null values, and ensure HS codes are numeric, returning results in a dictionary"""
-		results = {}
-
-		# Check for null values in HS_CODE
-		results["null_hs_code"] = df.filter(col("HS_CODE").isNull()).count()
-
-		# Check for null values in HS_CODE_DESCRIPTION
-		results["null_hs_code_description"] = df.filter(
-			col("HS_CODE_DESCRIPTION").isNull()
-		).count()
-
-		# Check if HS_CODE consists only of digits and is not empty
-		results["invalid_hs_code_format"] = df.filter(
-			~col("HS_CODE").rlike("^\d+$")
-		).count()
-
+		return self.evaluate_checks(df, {"hs": self.hs_code_check_aggregations()}, approximate=approximate)["hs"]
+
+	def run_comprehensive_checks(
+		self,
+		df: DataFrame,
+		null_columns: list[str],
+		country_column: str,
+		ta_columns: list[str],
+		country_code: str,
+		approximate=False,
+		sampler=None,
+	) -> dict:
+		"""
+        Runs the whole check suite with one aggregation pass over df plus one shared lookup stage
+        for the country and unit anti-join checks. The result has the same shape as the individual checks.
+        With approximate the figures are Estimates from a sample (see run_checks_approximate),
+        plus a cardinality group with the distinct counts of the country, unit and HS code columns
+        (sampler as in run_checks_approximate).
+        """
+		results = self.evaluate_checks(
+			df,
+			{
+				"null_checks": self.null_check_aggregations(null_columns),
+				"hs_code_integrity": self.hs_code_check_aggregations(),
+				"ta_code_issues": self.ta_code_check_aggregations(ta_columns),
+				"quantity_integrity": self.quantity_check_aggregations(),
+			},
+			{"countries": country_column, "units": "QUANTITY_UNIT"},
+			approximate,
+			{"countries": country_column, "units": "QUANTITY_UNIT", "hs_codes": "HS_CODE"},
+			sampler,
+		)
+		known = self.load_lookup_values(
+			{
+				"countries": ("Country_Code_Uniq", "Country_Port_Code", "Alpha-2 code"),
+				"units": (f"{country_code}_unit_of_quantity", "UNIT_OF_QUANTITY", "UNIT_OF_QUANTITY"),
+			}
+		)
+		value_sets = results.pop("value_sets")
+		results["invalid_country_codes"] = derive_values(
+			value_sets["countries"], sorted(set(value_sets["countries"]) - known["countries"])
+		)
+		results["ta_code_issues"] = {
+			column: count for column, count in results["ta_code_issues"].items() if count > 0
+		}
+		results["quantity_integrity"]["missing_units"] = derive_values(
+			value_sets["units"], sorted(set(value_sets["units"]) - known["units"])
+		)
 		return results
 
+	def write_check_results(self, results: dict, table_name, database_name) -> None:
+		"""Appends one row per check result to the given checks table, creating it if needed."""
+		checked_at = datetime.datetime.now(datetime.timezone.utc)
+		rows = []
+		for group, checks in results.items():
+			if not isinstance(checks, dict):
+				checks = {group: checks}
+			for name, value in checks.items():
+				if isinstance(value, SampledValues):
+					rows.append((checked_at, group, name, len(value), json.dumps(value.as_dict())))
+				elif isinstance(value, (list, set, tuple)):
+					rows.append((checked_at, group, name, len(value), json.dumps(sorted(value))))
+				elif isinstance(value, Estimate):
+					rows.append((checked_at, group, name, float(value), json.dumps(value.as_dict())))
+				else:
+					rows.append((checked_at, group, name, value, None))
+
+		with closing(self._pg_connection(database_name)) as conn:
+			with conn, conn.cursor() as cursor:
+				cursor.execute(
+					f"""
+					CREATE TABLE IF NOT EXISTS {table_name} (
+						checked_at timestamptz NOT NULL,
+						check_group text NOT NULL,
+						check_name text NOT NULL,
+						value double precision,
+						details jsonb
+					)
+					"""
+				)
+				cursor.executemany(
+					f"INSERT INTO {table_name} (checked_at, check_group, check_name, value, details) "
+					"VALUES (%s, %s, %s, %s, %s)",
+					rows,
+				)
+
 	def create_schema_p7(self) -> StructType:
 		schema = StructType(
 			[
@@ -483,15 +1868,32 @@ class Spark4DataProc:
 		return schema
 
 	def convert_to_p7(self, df: DataFrame) -> DataFrame:
-		# Tabloyu istenen formata dönüştür
+		"""
+        Converts the DataFrame to the P7 format with a single projection that stays in the JVM:
+        every P7 field is matched by name and cast to its type (missing fields become typed nulls),
+        other columns are kept as strings after the P7 fields.
+        """
 		p7_schema = self.create_schema_p7()
-		p7_df = self.spark.createDataFrame(df.rdd, p7_schema)
+		p7_columns = [
+			(col(field.name) if field.name in df.columns else lit(None))
+			.cast(field.dataType)
+			.alias(field.name)
+			for field in p7_schema.fields
+		]
+		# Tabloda olup P7 formatında olmayan sütunlar string olarak korunur
+		extra_columns = [
+			col(column).cast(StringType()).alias(column)
+			for column in df.columns
+			if column not in p7_schema.fieldNames()
+		]
+		return df.select(p7_columns + extra_columns)
+
+	def check_p7_nullability(self, df: DataFrame) -> dict[str, int]:
+		"""Counts, in one pass, the rows that violate each non-nullable P7 field (e.g. RECORD_ID, IMPORTER_TA_CODE)."""
+		non_nullable = [
+			field.name for field in self.create_schema_p7().fields if not field.nullable
+		]
+		return self.run_checks(df, {"p7": self.null_check_aggregations(non_nullable)})["p7"]
 
-		# Orijinal kolon isimlerine uygun olmayan sütunları null olarak ayarla
-		for column in df.columns:
-			if column not in p7_df.columns:
-				p7_df = p7_df.withColumn(
-					column, col(column).cast("string").cast("string")
-				)  # Var olan sütunlar string olarak dönüştürülecek
 
-		return p7_df
+instrument_class(Spark4DataProc)
@@ -0,0 +1,21 @@
+import argparse
+import logging
+
+from Spark.ProcessingService import ProcessingService
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-lived table processing service with a warm Spark session")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--master", default="spark://spark-master:7077")
+    parser.add_argument("--workers", type=int, default=1, help="tables processed at the same time")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    service = ProcessingService(master=args.master, max_workers=args.workers)
+    service.serve(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
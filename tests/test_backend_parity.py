@@ -0,0 +1,113 @@
+"""
+PandasBackend promises the same rows, column order and column types as Spark4DataProc. Both
+backends run process_table on the same raw table under a local Spark session; reading and
+writing Postgres is replaced by the in-memory input and a capture of the written result.
+Runs where Spark and config are importable (as for the DAG scripts) and Java is installed.
+"""
+import os
+import shutil
+from datetime import date
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyspark")
+if shutil.which("java") is None and not os.environ.get("JAVA_HOME"):
+    pytest.skip("Spark needs Java", allow_module_level=True)
+
+from config.DataTypes.CR import CostaRicaTypes
+from config.TablesConfig import RecordIdConfig
+from pyspark.sql import SparkSession
+from pyspark.sql.types import DateType, DoubleType, LongType, StringType, StructField, StructType
+from Spark import Spark4DataProc
+from Spark.PandasBackend import PandasBackend, PandasTable
+
+SOURCE_TABLE = "cr.imp_2024_01"
+TARGET_TABLE = "cr.imp_2024_01_islendi"
+NUMERIC_COLUMNS = {"QUANTITY", "VALUE_(USD)", "NET_WEIGHT_(KG)", "GROSS_WEIGHT_(KG)"}
+
+
+def raw_schema():
+    fields = [StructField(RecordIdConfig.LINE_COLUMN, LongType(), False)]
+    for column in CostaRicaTypes.IMPORT_CHANGE_COLUMN_NAMES:
+        if column == "DATE":
+            fields.append(StructField(column, DateType(), True))
+        elif column in NUMERIC_COLUMNS:
+            fields.append(StructField(column, DoubleType(), True))
+        else:
+            fields.append(StructField(column, StringType(), True))
+    return StructType(fields)
+
+
+def raw_rows(schema):
+    lines = [
+        # Lines 1 and 3 repeat a key, line 4 has a null key column
+        {"DATE": date(2024, 1, 5), "OPERATION#": "A-1", "ITEM": "1", "QUANTITY": 2.0, "UNIT": "KG"},
+        {"DATE": date(2024, 1, 5), "OPERATION#": "A-1", "ITEM": "2", "QUANTITY": 1.5, "UNIT": "U"},
+        {"DATE": date(2024, 1, 5), "OPERATION#": "A-1", "ITEM": "1", "QUANTITY": 3.0, "UNIT": "KG"},
+        {"DATE": date(2024, 1, 6), "OPERATION#": "B-7", "ITEM": None, "QUANTITY": None, "UNIT": None},
+    ]
+    return [
+        tuple(line_number if field.name == RecordIdConfig.LINE_COLUMN else line.get(field.name) for field in schema)
+        for line_number, line in enumerate(lines, 1)
+    ]
+
+
+@pytest.fixture(scope="module")
+def spark():
+    session = (
+        SparkSession.builder.master("local[*]")
+        .appName("backend-parity")
+        .config("spark.sql.session.timeZone", "UTC")
+        .getOrCreate()
+    )
+    yield session
+    session.stop()
+
+
+def column_steps(ops):
+    return [
+        lambda table: ops.apply_column_specs(
+            table,
+            rename=CostaRicaTypes.IMPORT_CHANGE_COLUMN_NAMES,
+            add=CostaRicaTypes.IMPORT_ADD_COLUMN,
+            record_key=(SOURCE_TABLE, CostaRicaTypes.KEY_COLUMNS),
+        )
+    ]
+
+
+def test_process_table_matches_spark(spark, monkeypatch):
+    schema = raw_schema()
+    rows = raw_rows(schema)
+    proc = Spark4DataProc("localhost:5432", "user", "password", spark=spark)
+    backend = PandasBackend(proc)
+    written = {}
+
+    monkeypatch.setattr(proc, "read_table", lambda table_name, database_name, **_: spark.createDataFrame(rows, schema))
+    monkeypatch.setattr(proc, "write_table", lambda df, table_name, database_name, **_: written.update(spark=df))
+    monkeypatch.setattr(
+        backend,
+        "read_table",
+        lambda table_name, database_name: PandasTable(
+            pd.DataFrame(rows, columns=schema.fieldNames(), dtype=object), schema
+        ),
+    )
+    monkeypatch.setattr(
+        backend, "write_table", lambda table, table_name, database_name, **_: written.update(pandas=table)
+    )
+
+    proc.process_table(SOURCE_TABLE, TARGET_TABLE, "test", column_steps(proc))
+    backend.process_table(SOURCE_TABLE, TARGET_TABLE, "test", column_steps(backend))
+
+    spark_df, pandas_table = written["spark"], written["pandas"]
+    assert pandas_table.columns == spark_df.columns
+    assert [field.dataType for field in pandas_table.schema] == [field.dataType for field in spark_df.schema]
+
+    key = spark_df.columns.index(RecordIdConfig.KEY_COLUMN)
+    spark_rows = sorted((tuple(row) for row in spark_df.collect()), key=lambda row: row[key])
+    pandas_rows = sorted(
+        pandas_table.frame.astype(object).where(pandas_table.frame.notna(), None).itertuples(index=False, name=None),
+        key=lambda row: row[key],
+    )
+    assert len({row[key] for row in spark_rows}) == len(rows)
+    assert pandas_rows == spark_rows